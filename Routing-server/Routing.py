@@ -1,14 +1,33 @@
 import fastapi
-from fastapi import HTTPException, Header
+from fastapi import HTTPException, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Dict, Optional
 import uvicorn
 from pydantic import BaseModel
 import threading
+import asyncio
 import time
+import math
 import uuid
-from dataclasses import dataclass, field
-from collections import defaultdict
+import json
+import random
+import heapq
+import bisect
+import itertools
+import re
+import zlib
+import base64
+from dataclasses import dataclass, field, fields, replace
+from collections import deque, OrderedDict, Counter
+from contextlib import contextmanager, nullcontext
+import sqlite3
+import os
+import sys
+import tempfile
+import atexit
 import logging
 
 # Configure logging
@@ -21,20 +40,406 @@ logger = logging.getLogger(__name__)
 # Models
 class QueryModel(BaseModel):
     query: str
+    requirements: Dict = {}  # e.g. {"model": "gemma-2b", "min_context_length": 4096, "hardware_class": "desktop"}
+    completion_mode: str = "all"  # "all", "first" (first N answers), "quorum" (N matching answers) or "consensus"
+    required_responses: Optional[int] = None  # N for "first"/"quorum"; for "consensus" the agreement needed
+    cache: bool = True  # False skips the response cache and coalescing with identical queries
+    priority: str = "normal"  # "high", "normal" or "low" (see PRIORITY_CLASSES)
 
 class ResponseModel(BaseModel):
     query_number: int
     response: str
+    metadata: Dict = {}  # Worker-reported stats such as tokens_per_second
+
+class ResponseChunkModel(BaseModel):
+    query_number: int
+    chunk: str
+    sequence: Optional[int] = None  # Lets the router drop retried duplicates
 
 class QueryNumberModel(BaseModel):
     query_number: int
 
+class HeartbeatModel(BaseModel):
+    query_numbers: List[int] = []  # Assignments the worker is still working on
+
+class WorkerBatchModel(BaseModel):
+    responses: List[ResponseModel] = []
+    chunks: List[ResponseChunkModel] = []
+    heartbeat: List[int] = []  # Assignments to renew leases on, as in POST /heartbeat
+    claim: int = 0  # How many new queries to hand out after the submissions are processed
+    wait: float = 0  # Long-poll seconds for the claim, as in GET /request?wait=
+
 class NodeRegistrationModel(BaseModel):
     node_capabilities: Dict = {}
     node_info: Dict = {}
 
 # Data structures
-@dataclass
+def _resolve_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+class UpdateSignal:
+    """Version counter that lets coroutines wait for changes made on other threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._waiters = set()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def notify(self):
+        """Bump the version and wake every waiting coroutine"""
+        with self._lock:
+            self._version += 1
+            waiters, self._waiters = self._waiters, set()
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve_waiter, future)
+            except RuntimeError:
+                pass  # Event loop already closed
+
+    async def wait(self, since_version: int, timeout: float) -> bool:
+        """Wait until the version moves past since_version, False on timeout"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+
+        with self._lock:
+            if self._version != since_version:
+                return True
+            self._waiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+class ExpiryIndex:
+    """Min-heap of deadlines keeping at most one live entry per key
+
+    schedule() records a key's latest deadline. Moving a deadline later only
+    updates a dict; the old heap entry is pushed again with the new time
+    when it reaches the top. The cost therefore follows the number of
+    expirations, not how often deadlines move or how many keys exist.
+    """
+    
+    def __init__(self):
+        self._heap: List = []  # (due, key), may hold outdated entries
+        self._due: Dict = {}  # key -> latest deadline
+        self._condition = threading.Condition()
+    
+    def __len__(self) -> int:
+        return len(self._due)
+    
+    def __contains__(self, key) -> bool:
+        return key in self._due
+    
+    def schedule(self, key, due: float):
+        """Set when a key expires, replacing any earlier or later deadline"""
+        with self._condition:
+            current = self._due.get(key)
+            self._due[key] = due
+            if current is None or due < current:
+                heapq.heappush(self._heap, (due, key))
+                if self._heap[0][1] == key:
+                    self._condition.notify()
+    
+    def cancel(self, key):
+        with self._condition:
+            self._due.pop(key, None)
+    
+    def wait_due(self, max_wait: float) -> List:
+        """Block until some keys are due (or max_wait passes) and return them"""
+        with self._condition:
+            deadline = time.time() + max_wait
+            while True:
+                current_time = time.time()
+                due_keys = []
+                
+                while self._heap and self._heap[0][0] <= current_time:
+                    due, key = heapq.heappop(self._heap)
+                    latest = self._due.get(key)
+                    if latest is None or latest < due:
+                        continue  # Cancelled, already fired, or superseded by an earlier entry
+                    if latest > due:
+                        heapq.heappush(self._heap, (latest, key))  # Postponed
+                        continue
+                    del self._due[key]
+                    due_keys.append(key)
+                
+                if due_keys or current_time >= deadline:
+                    return due_keys
+                
+                next_due = self._heap[0][0] if self._heap else deadline
+                self._condition.wait(min(next_due, deadline) - current_time)
+
+# Metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 180, 300)
+LOCK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+def _format_labels(labels) -> str:
+    """Render (name, value) pairs as a Prometheus label set"""
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+    
+    def __init__(self):
+        self._lock = threading.Lock()  # Per series, so label children never contend with each other
+        self.value = 0.0
+    
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+    
+    def sample(self) -> float:
+        with self._lock:
+            return self.value
+
+class _HistogramChild:
+    """One histogram series, counted in a shard per observing thread
+    
+    observe() only touches the calling thread's shard, so threads observing
+    the same series (every query lock shares one) never wait on each other.
+    sample() merges the shards at scrape time.
+    """
+    __slots__ = ("_lock", "_bounds", "_local", "_shards")
+    
+    def __init__(self, bounds: tuple):
+        self._lock = threading.Lock()  # Guards the list of shards, taken once per thread and per scrape
+        self._bounds = bounds
+        self._local = threading.local()
+        self._shards: List[list] = []  # [bucket counts, sum] per thread; counts are per bucket, the last one +Inf
+    
+    def observe(self, value: float):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = [[0] * (len(self._bounds) + 1), 0.0]
+            with self._lock:
+                self._shards.append(shard)
+        shard[0][bisect.bisect_left(self._bounds, value)] += 1
+        shard[1] += value
+    
+    def sample(self) -> tuple:
+        """Merged (counts, sum, count); an observation in progress may be counted before it is summed"""
+        with self._lock:
+            shards = list(self._shards)
+        counts = [0] * (len(self._bounds) + 1)
+        total = 0.0
+        for shard_counts, shard_sum in shards:
+            for index, bucket_count in enumerate(shard_counts):
+                counts[index] += bucket_count
+            total += shard_sum
+        return counts, total, sum(counts)
+
+class LabeledMetric:
+    """Metric split into series by label values; subclasses define the series and how they render"""
+    kind = "untyped"
+    
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._children: Dict[tuple, object] = {}
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def labels(self, **labels):
+        """The series for these label values; keep it to skip the lookup on hot paths"""
+        key = tuple(sorted(labels.items()))
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def _series(self) -> List[tuple]:
+        """(labels, child) pairs; the metric lock only guards the set of children"""
+        with self._lock:
+            return list(self._children.items())
+    
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+class CounterMetric(LabeledMetric):
+    """Monotonic counter, optionally split by labels"""
+    kind = "counter"
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount: float = 1.0, **labels):
+        self.labels(**labels).inc(amount)
+    
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(key)} {child.sample()}" for key, child in self._series()]
+
+class HistogramMetric(LabeledMetric):
+    """Distribution of observed values in fixed cumulative buckets"""
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value: float, **labels):
+        self.labels(**labels).observe(value)
+    
+    def render(self) -> List[str]:
+        lines = []
+        for key, child in self._series():
+            counts, total, count = child.sample()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class CallbackMetric:
+    """Gauge or counter whose samples are read at scrape time
+    
+    The callback returns a number, or a list of (labels dict, value).
+    """
+    
+    def __init__(self, name: str, help_text: str, kind: str, callback):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.callback = callback
+    
+    def render(self) -> List[str]:
+        samples = self.callback()
+        if isinstance(samples, (int, float)):
+            return [f"{self.name} {samples}"]
+        return [f"{self.name}{_format_labels(sorted(labels.items()))} {value}" for labels, value in samples]
+
+class MetricsRegistry:
+    """Metrics exposed in the Prometheus text format
+    
+    Asking for a metric that already exists returns it, so several server
+    instances in one process share their series. Counter series carry their
+    own short lock and histogram series a shard per thread; scraping never
+    touches router state except through the callbacks of CallbackMetric.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+    
+    def _get_or_create(self, name: str, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+    
+    def counter(self, name: str, help_text: str) -> CounterMetric:
+        return self._get_or_create(name, lambda: CounterMetric(name, help_text))
+    
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS) -> HistogramMetric:
+        return self._get_or_create(name, lambda: HistogramMetric(name, help_text, buckets))
+    
+    def callback(self, name: str, help_text: str, callback, kind: str = "gauge"):
+        """Register (or re-point) a metric computed at scrape time"""
+        with self._lock:
+            self._metrics[name] = CallbackMetric(name, help_text, kind, callback)
+    
+    def render(self) -> str:
+        with self._lock:
+            registered = list(self._metrics.values())
+        
+        lines = []
+        for metric in registered:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+LOCK_WAIT_SECONDS = metrics.histogram("routing_lock_wait_seconds", "Time spent waiting to acquire a state lock", LOCK_BUCKETS)
+LOCK_HOLD_SECONDS = metrics.histogram("routing_lock_hold_seconds", "Time a state lock was held", LOCK_BUCKETS)
+LOCK_BUSY = metrics.counter("routing_lock_busy_total", "Non-blocking lock attempts that found the lock taken")
+
+class InstrumentedLock:
+    """threading.Lock that records how long callers wait for it and hold it
+    
+    Locks of the same kind share one label (every query lock is "query"),
+    so the number of series stays fixed however much state there is. Each
+    thread observes into its own shard of a series, so locking two queries
+    on two threads doesn't serialize on their metrics.
+    """
+    __slots__ = ("_lock", "_acquired_at", "_wait", "_hold", "_busy")
+    
+    def __init__(self, label: str):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self._wait = LOCK_WAIT_SECONDS.labels(lock=label)
+        self._hold = LOCK_HOLD_SECONDS.labels(lock=label)
+        self._busy = LOCK_BUSY.labels(lock=label)
+    
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started = time.perf_counter()
+        if not self._lock.acquire(blocking, timeout):
+            self._busy.inc()
+            return False
+        self._acquired_at = time.perf_counter()
+        self._wait.observe(self._acquired_at - started)
+        return True
+    
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        self._hold.observe(held)
+    
+    def locked(self) -> bool:
+        return self._lock.locked()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+
+def _query_lock() -> InstrumentedLock:
+    return InstrumentedLock("query")
+
+# Records are slotted where the interpreter supports it: hundreds of thousands
+# of them are alive at once, and a per-instance __dict__ would dominate their size
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+def _node_handle(node_id: str) -> str:
+    """Canonical copy of a node ID, so every record referencing a node shares one string"""
+    return sys.intern(node_id)
+
+@dataclass(**_SLOTS)
 class NodeInfo:
     node_id: str
     registration_time: float
@@ -43,114 +448,2843 @@ class NodeInfo:
     info: Dict = field(default_factory=dict)
     queries_submitted: int = 0
     responses_provided: int = 0
+    active_assignments: int = 0  # Assigned queries this node has not answered yet
+    avg_response_latency: float = 0.0  # Smoothed seconds from assignment to response
+    avg_tokens_per_second: float = 0.0  # Smoothed generation speed reported by the worker
+    answer_quality: float = 0.5  # Smoothed share of its answers that agreed with the best answer
+    last_heartbeat: float = 0.0  # When the node last renewed a lease, 0 if it never has
+    cancelled_queries: set = field(default_factory=set)  # Query numbers the node should abandon
 
-@dataclass
+@dataclass(**_SLOTS)
+class PartialStream:
+    """Bounded buffer of generated text a worker has uploaded but the submitter has not read yet"""
+    stream_id: int
+    chunks: deque = field(default_factory=deque)
+    buffered_chars: int = 0
+    next_sequence: int = 0
+    finished: bool = False
+
+@dataclass(**_SLOTS)
+class SpilledBody:
+    """Compressed answer kept in a file by ResponseStore"""
+    path: str
+    size: int  # Compressed bytes
+
+def _unpack_body(body) -> str:
+    """Answer text from any form ResponseStore.pack() returns"""
+    if isinstance(body, str):
+        return body
+    if isinstance(body, SpilledBody):
+        with open(body.path, "rb") as f:
+            body = f.read()
+    return zlib.decompress(body).decode("utf-8")
+
+@dataclass(**_SLOTS)
+class StoredResponse:
+    """One answer to a query; body is its text, or the compressed or spilled form of it"""
+    node_id: str
+    body: object
+    timestamp: float
+    weight: float = 1.0  # The answering node's vote in aggregation, from its track record
+    
+    @property
+    def response(self) -> str:
+        return _unpack_body(self.body)
+
+@dataclass(**_SLOTS)
+class Assignment:
+    """One node's claim on a query: "active", "answered", "cancelled" or "expired"
+    
+    Only "active" assignments are outstanding. An active one is cancelled
+    when the query completes without it, or expired when its lease runs out.
+    """
+    assigned_at: float
+    deadline: float  # After this the assignment counts as straggling and may be hedged
+    lease_expires: float  # When the assignment is revoked unless renewed
+    state: str = "active"
+
+@dataclass(**_SLOTS)
 class QueryInfo:
     query_number: int
     query: str
     submitter_node_id: str
     timestamp: float
-    responses: List[Dict] = field(default_factory=list)
-    assigned_nodes: List[str] = field(default_factory=list)
+    responses: List[StoredResponse] = field(default_factory=list)
+    answer_groups: List[int] = field(default_factory=list)  # Near-duplicate group of each response
+    group_support: List[float] = field(default_factory=list)  # Weighted agreement per group
+    best_response: Optional[int] = None  # Index of the aggregated best answer
+    assignments: Dict[str, Assignment] = field(default_factory=dict)  # Node ID -> its claim, in assignment order
+    requirements: Dict = field(default_factory=dict)
+    completion_mode: str = "all"
+    required_responses: int = 3
+    completed: bool = False
+    hedged_assignments: int = 0
     max_responses: int = 3
     timeout: float = 180.0  # 3 minutes
+    partial_streams: Dict[str, PartialStream] = field(default_factory=dict)  # Keyed by worker node ID
+    followers: List[str] = field(default_factory=list)  # Submitters of identical queries coalesced onto this one
+    cache_key: Optional[str] = None  # Response cache key, None if the answers must not be cached
+    priority: str = "normal"
+    share_weight: float = 1.0  # Fair-queuing weight earned by the submitter's contributions
+    removed: bool = False  # Set once the query has been ended/expired
+    dirty: bool = False  # Changed since the backend last persisted it, see StateBackend.touch()
+    lock: InstrumentedLock = field(default_factory=_query_lock, repr=False, compare=False)  # Guards the fields above
 
-class DistributedRoutingServer:
+@dataclass(**_SLOTS)
+class DispatchEntry:
+    """Queue slot for a query, tracking which workers can no longer take it"""
+    query_number: int
+    excluded_nodes: set = field(default_factory=set)  # Submitter plus every node already assigned
+    submitter_node_id: str = ""
+    priority: int = 1  # PRIORITY_CLASSES value, higher classes are dispatched first
+    start_tag: float = 0.0  # Virtual time at which the query's fair share begins
+
+class DispatchQueue:
+    """Queries waiting for workers, dispatched fairly across submitters
+    
+    Start-time fair queuing: every submitter is a flow, and a queued query
+    is tagged with max(virtual time, its flow's last finish tag), each query
+    moving the flow's finish tag on by 1/weight. Queries go out by priority
+    class, then start tag, so a submitter flooding the queue only pushes its
+    own tags ahead, while a light submitter's next query is tagged at the
+    current virtual time and goes out almost at once. Virtual time follows
+    the start tag of whatever was dispatched last.
+    
+    Each flow is a list of (start tag, query number) kept sorted, so
+    membership is O(1), enqueue appends and removal is a binary search in
+    one flow; eligible_for() merges the flows lazily at O(log flows) per
+    entry. Queries whose slots are all taken are parked outside the flows
+    until requeue() puts them back in place by start tag, so a pass only
+    walks queries that can take a worker; parked queries still count as
+    queued. The queue carries its own lock. Single operations take it
+    internally; a dispatch pass holds `lock` for the whole eligible_for()
+    iteration.
+    """
+    
     def __init__(self):
-        self.lock = threading.Lock()
-        self.counter = 0
-        self.nodes: Dict[str, NodeInfo] = {}
-        self.queries: Dict[int, QueryInfo] = {}
-        self.pending_queries: List[int] = []
-        
-        # Configuration
-        self.max_queries_per_node = 5
-        self.node_timeout = 300  # 5 minutes
-        self.query_timeout = 180  # 3 minutes
-        self.max_responses_per_query = 3  # Fixed the typo here
-        self.max_memory_size = 1000  # Maximum queries to keep in memory
+        self.lock = InstrumentedLock("dispatch_queue")
+        self.virtual_time = 0.0
+        self._entries: Dict[int, DispatchEntry] = {}  # Queued and parked
+        self._parked: Dict[int, DispatchEntry] = {}
+        self._flows: Dict[tuple, List[tuple]] = {}  # (priority, submitter) -> sorted [(start_tag, query_number)]
+        self._flow_finish: Dict[str, float] = {}  # Submitter -> finish tag of its last queued query
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, query_number: int) -> bool:
+        return query_number in self._entries
+    
+    def append(self, query_number: int, submitter_node_id: str, excluded_nodes: List[str] = (),
+               priority: int = 1, weight: float = 1.0):
+        """Queue a query, never offering it back to its submitter or the excluded nodes"""
+        with self.lock:
+            self.discard_locked(query_number)
+            start_tag = max(self.virtual_time, self._flow_finish.get(submitter_node_id, 0.0))
+            self._flow_finish[submitter_node_id] = start_tag + 1 / weight
+            
+            entry = DispatchEntry(query_number, {submitter_node_id, *excluded_nodes},
+                                  submitter_node_id, priority, start_tag)
+            self._entries[query_number] = entry
+            self._link(entry)
+            
+            # A finish tag behind virtual time says nothing a fresh flow wouldn't
+            if len(self._flow_finish) > 2 * len(self._flows) + 64:
+                self._flow_finish = {submitter: finish for submitter, finish in self._flow_finish.items()
+                                     if finish > self.virtual_time}
+    
+    def discard(self, query_number: int) -> bool:
+        """Remove a query if queued, returning whether it was"""
+        with self.lock:
+            return self.discard_locked(query_number)
+    
+    def discard_locked(self, query_number: int) -> bool:
+        """discard() for callers already holding the queue lock"""
+        entry = self._entries.pop(query_number, None)
+        if entry is None:
+            return False
         
-        # Start background cleanup
-        self._start_cleanup_thread()
+        if self._parked.pop(query_number, None) is None:
+            self._unlink(entry)
+        return True
     
-    def _start_cleanup_thread(self):
-        """Start background thread for periodic cleanup"""
-        def cleanup_worker():
-            while True:
-                try:
-                    time.sleep(30)  # Run every 30 seconds
-                    self._cleanup_expired_data()
-                except Exception as e:
-                    logger.error(f"Cleanup worker error: {e}")
+    def _link(self, entry: DispatchEntry):
+        """Put an entry in its flow; start tags only grow within a flow, so this is usually an append"""
+        flow = self._flows.setdefault((entry.priority, entry.submitter_node_id), [])
+        bisect.insort(flow, (entry.start_tag, entry.query_number))
+    
+    def _unlink(self, entry: DispatchEntry):
+        flow_key = (entry.priority, entry.submitter_node_id)
+        flow = self._flows[flow_key]
+        del flow[bisect.bisect_left(flow, (entry.start_tag, entry.query_number))]
+        if not flow:
+            del self._flows[flow_key]
+    
+    def park_locked(self, query_number: int):
+        """Stop offering a query until requeue(), keeping its place (caller holds the queue lock)"""
+        entry = self._entries.get(query_number)
+        if entry is None or query_number in self._parked:
+            return
+        self._unlink(entry)
+        self._parked[query_number] = entry
+    
+    def requeue(self, query_number: int) -> bool:
+        """Offer a parked query again, returning whether it was parked"""
+        with self.lock:
+            entry = self._parked.pop(query_number, None)
+            if entry is None:
+                return False
+            self._link(entry)
+            return True
+    
+    def eligible_for(self, node_id: str):
+        """Yield queued entries in dispatch order that the node may still take
         
-        cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-        cleanup_thread.start()
-        logger.info("Cleanup thread started")
+        Caller must hold the queue lock and must not add or remove entries
+        while iterating; collect removals and apply them afterwards.
+        """
+        flows = [zip(itertools.repeat(-priority), flow) for (priority, _), flow in self._flows.items()]
+        for _, (_, query_number) in heapq.merge(*flows):
+            entry = self._entries[query_number]
+            if node_id not in entry.excluded_nodes:
+                yield entry
     
-    def _cleanup_expired_data(self):
-        """Clean up expired queries and inactive nodes"""
-        current_time = time.time()
+    def exclude(self, entry: DispatchEntry, node_id: str):
+        """Stop offering an entry to a node (caller holds the queue lock)"""
+        entry.excluded_nodes.add(node_id)
+    
+    def charge(self, entry: DispatchEntry):
+        """Advance virtual time past an entry just handed to a worker (caller holds the queue lock)"""
+        self.virtual_time = max(self.virtual_time, entry.start_tag)
+
+COMPLETION_MODES = ("all", "first", "quorum", "consensus")
+PRIORITY_CLASSES = {"high": 2, "normal": 1, "low": 0}  # Strict order between classes, fair queuing within one
+
+def _normalize_response(text: str) -> str:
+    """Canonical form used to decide whether two answers agree"""
+    return " ".join(text.lower().split())
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+def _answer_signature(text: str) -> frozenset:
+    """Word bigrams of an answer, for cheap similarity between answers"""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < 2:
+        return frozenset(words)
+    return frozenset(zip(words, words[1:]))
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    """Jaccard similarity of two answer signatures"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+class AnswerAggregator:
+    """Groups a query's answers and scores how strongly they agree
+    
+    Answers at least duplicate_similarity alike (word-bigram Jaccard) are
+    near-duplicates of each other and form one group, represented by its
+    first answer. A group's support is the weight of its members, plus the
+    weight of every other answer at least min_similarity alike scaled by
+    that similarity, so paraphrases lend partial agreement. The best answer
+    is the highest-weighted member of the best-supported group.
+    """
+    
+    def __init__(self, duplicate_similarity: float = 0.8, min_similarity: float = 0.4):
+        self.duplicate_similarity = duplicate_similarity
+        self.min_similarity = min_similarity
+    
+    def aggregate(self, responses: List[StoredResponse]):
+        """Return (group of each answer, support of each group, index of the best answer or None)"""
+        signatures = [_answer_signature(r.response) for r in responses]
+        groups = []
+        representatives = []
+        for index, signature in enumerate(signatures):
+            for group, representative in enumerate(representatives):
+                if _similarity(signature, signatures[representative]) >= self.duplicate_similarity:
+                    groups.append(group)
+                    break
+            else:
+                groups.append(len(representatives))
+                representatives.append(index)
         
-        with self.lock:
-            # Clean up expired queries
-            expired_queries = []
-            for query_id, query_info in self.queries.items():
-                if current_time - query_info.timestamp > query_info.timeout:
-                    expired_queries.append(query_id)
-            
-            for query_id in expired_queries:
-                logger.info(f"Cleaning up expired query: {query_id}")
-                del self.queries[query_id]
-                if query_id in self.pending_queries:
-                    self.pending_queries.remove(query_id)
+        support = []
+        for group, representative in enumerate(representatives):
+            total = 0.0
+            for index, r in enumerate(responses):
+                if groups[index] == group:
+                    total += r.weight
+                else:
+                    similarity = _similarity(signatures[representative], signatures[index])
+                    if similarity >= self.min_similarity:
+                        total += r.weight * similarity
+            support.append(round(total, 4))
+        
+        if not support:
+            return groups, support, None
+        best_group = max(range(len(support)), key=lambda group: (support[group], -group))
+        best_response = max((index for index, group in enumerate(groups) if group == best_group),
+                            key=lambda index: (responses[index].weight, -index))
+        return groups, support, best_response
+
+def _response_cache_key(query: str, requirements: Dict) -> str:
+    """Cache key for a query: its normalized text plus every requirement that is set
+    
+    Requirements _meets_requirements() ignores (None, empty) are left out,
+    so they don't split otherwise identical queries.
+    """
+    text = _normalize_response(query).rstrip(" ?!.")
+    requested = {name: value for name, value in requirements.items() if value not in (None, "", [], {})}
+    return f"{json.dumps(requested, sort_keys=True, default=str)}|{text}"
+
+@dataclass(**_SLOTS)
+class CachedAnswer:
+    responses: List[str]
+    completion_mode: str
+    required_responses: int
+    stored_at: float
+
+class ResponseCache:
+    """Answers of completed queries, plus the identical queries still in flight
+
+    Entries live for `ttl` seconds and the least recently used one is
+    evicted past `max_entries`. The in-flight index maps a cache key to the
+    query currently being dispatched for it, so duplicates can join that
+    query instead of being dispatched again. The cache carries its own lock
+    and never takes any other lock while holding it.
+    """
+    
+    def __init__(self, max_entries: int = 1000, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()  # cache key -> CachedAnswer, least recently used first
+        self._inflight: Dict[str, int] = {}  # cache key -> query number
+        self._inflight_keys: Dict[int, str] = {}  # query number -> cache key
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, key: str, completion_mode: str, required_responses: int) -> Optional[List[str]]:
+        """Stored answers good enough for the given completion criterion, counting the hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry.stored_at > self.ttl:
+                del self._entries[key]
+                entry = None
             
-            # Clean up inactive nodes
-            inactive_nodes = []
-            for node_id, node_info in self.nodes.items():
-                if current_time - node_info.last_seen > self.node_timeout:
-                    inactive_nodes.append(node_id)
+            # Any non-quorum answers will do for "first"; otherwise the mode must match
+            if completion_mode == "first" and entry and entry.completion_mode != "quorum":
+                usable = len(entry.responses) >= required_responses
+            else:
+                usable = (entry is not None and entry.completion_mode == completion_mode
+                          and entry.required_responses >= required_responses)
             
-            for node_id in inactive_nodes:
-                logger.info(f"Removing inactive node: {node_id}")
-                del self.nodes[node_id]
+            if usable:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry.responses)
             
-            # Limit memory usage
-            if len(self.queries) > self.max_memory_size:
-                # Remove oldest queries
-                oldest_queries = sorted(self.queries.items(), 
-                                      key=lambda x: x[1].timestamp)[:len(self.queries) - self.max_memory_size]
-                
-                for query_id, _ in oldest_queries:
-                    del self.queries[query_id]
-                    if query_id in self.pending_queries:
-                        self.pending_queries.remove(query_id)
+            self.misses += 1
+            return None
+    
+    def put(self, key: str, completion_mode: str, required_responses: int, responses: List[str]):
+        with self._lock:
+            self._entries[key] = CachedAnswer(list(responses), completion_mode, required_responses, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def find_inflight(self, key: str) -> Optional[int]:
+        with self._lock:
+            return self._inflight.get(key)
+    
+    def add_inflight(self, key: str, query_number: int):
+        with self._lock:
+            self._inflight[key] = query_number
+            self._inflight_keys[query_number] = key
+    
+    def discard_inflight(self, query_number: int):
+        """Forget a query that completed or was removed"""
+        with self._lock:
+            key = self._inflight_keys.pop(query_number, None)
+            if key is not None and self._inflight.get(key) == query_number:
+                del self._inflight[key]
+    
+    def count_coalesced(self):
+        with self._lock:
+            self.coalesced += 1
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "in_flight": len(self._inflight),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+class RateLimiter:
+    """Token bucket per key: `rate` tokens a second, up to `burst` saved up
+    
+    Once more than max_keys buckets are tracked, the ones that have refilled
+    completely are forgotten, since a fresh bucket is identical. The limiter
+    carries its own lock and never takes any other lock while holding it.
+    """
+    
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, tuple] = {}  # key -> (tokens, last update)
+    
+    def acquire(self, key: str) -> float:
+        """Take a token, returning 0 on success or the seconds until one is available"""
+        if self.rate <= 0:
+            return 0.0
+        
+        current_time = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, current_time))
+            tokens = min(self.burst, tokens + (current_time - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, current_time)
+                return (1 - tokens) / self.rate
             
-            if expired_queries or inactive_nodes:
-                logger.info(f"Cleanup completed: {len(expired_queries)} queries, {len(inactive_nodes)} nodes removed")
+            self._buckets[key] = (tokens - 1, current_time)
+            if len(self._buckets) > self.max_keys:
+                self._buckets = {
+                    bucket_key: (bucket_tokens, bucket_updated)
+                    for bucket_key, (bucket_tokens, bucket_updated) in self._buckets.items()
+                    if bucket_tokens + (current_time - bucket_updated) * self.rate < self.burst
+                }
+            return 0.0
+
+class RateMeter:
+    """Events per second over a sliding window, counted in one-second buckets"""
     
-    def _generate_node_id(self) -> str:
-        """Generate unique node ID"""
-        return f"node_{uuid.uuid4().hex[:8]}"
+    def __init__(self, window: float = 60):
+        self.window = window
+        self._lock = threading.Lock()
+        self._buckets: deque = deque()  # [second, count], oldest first
+        self._started = time.time()
+    
+    def _trim(self, current_time: float):
+        while self._buckets and self._buckets[0][0] <= current_time - self.window:
+            self._buckets.popleft()
+    
+    def record(self, count: int = 1):
+        current_time = time.time()
+        second = int(current_time)
+        with self._lock:
+            if self._buckets and self._buckets[-1][0] == second:
+                self._buckets[-1][1] += count
+            else:
+                self._buckets.append([second, count])
+            self._trim(current_time)
     
-    def _register_or_update_node(self, node_id: str, capabilities: Dict = None, info: Dict = None):
-        """Register new node or update existing one"""
+    def rate(self) -> float:
         current_time = time.time()
+        with self._lock:
+            self._trim(current_time)
+            total = sum(count for _, count in self._buckets)
+        # A young meter averages over its lifetime rather than the full window
+        return total / max(1.0, min(self.window, current_time - self._started))
+
+class ResponseStore:
+    """Keeps answer bodies compressed at rest and spills the largest to files
+    
+    Answers shorter than compress_threshold characters stay plain strings.
+    Longer ones are zlib-compressed when that saves at least 10%; generated
+    prose typically shrinks to a third. A compressed body of spill_threshold
+    bytes or more is written to its own file under `directory` and only its
+    path is kept, so a few huge answers don't pin router memory. Files are
+    deleted with their query; ones orphaned by a crash are swept at startup
+    once older than max_age.
+    """
+    
+    def __init__(self, directory: str, compress_threshold: int = 1024, spill_threshold: int = 64 * 1024,
+                 level: int = 6, max_age: float = 3600):
+        self.directory = directory
+        self.compress_threshold = compress_threshold
+        self.spill_threshold = spill_threshold
+        self.level = level
+        os.makedirs(directory, exist_ok=True)
+        self._sweep(max_age)
+    
+    def _sweep(self, max_age: float):
+        cutoff = time.time() - max_age
+        swept = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".z") and entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                    swept += 1
+                except OSError:
+                    pass  # Another router process got there first
+        if swept:
+            logger.info(f"Removed {swept} orphaned spilled responses")
+    
+    def pack(self, text: str):
+        """Storage form of an answer: the str itself, compressed bytes or a SpilledBody"""
+        if len(text) < self.compress_threshold:
+            return text
+        
+        encoded = text.encode("utf-8")
+        compressed = zlib.compress(encoded, self.level)
+        if len(compressed) > len(encoded) * 0.9:
+            return text
+        if len(compressed) < self.spill_threshold:
+            return compressed
+        
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}.z")
+        with open(path, "wb") as f:
+            f.write(compressed)
+        return SpilledBody(path, len(compressed))
+    
+    def discard(self, responses: List[StoredResponse]):
+        """Delete the files behind spilled answers"""
+        for r in responses:
+            if isinstance(r.body, SpilledBody):
+                try:
+                    os.remove(r.body.path)
+                except FileNotFoundError:
+                    pass
+
+def _stored_size(body) -> int:
+    """Bytes a packed body takes in memory or on disk"""
+    if isinstance(body, SpilledBody):
+        return body.size
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    return len(body)
+
+def _outstanding_nodes(query_info: QueryInfo) -> List[str]:
+    """Assigned nodes that have neither answered nor been cancelled"""
+    return [node_id for node_id, assignment in query_info.assignments.items()
+            if assignment.state == "active"]
+
+def _meets_requirements(capabilities: Dict, requirements: Dict) -> bool:
+    """Check a node's declared capabilities against a query's requirements"""
+    model = requirements.get("model")
+    if model:
+        models = capabilities.get("models") or [capabilities.get("model")]
+        if model not in models:
+            return False
+    
+    min_context_length = requirements.get("min_context_length")
+    if min_context_length and capabilities.get("context_length", 0) < min_context_length:
+        return False
+    
+    hardware_class = requirements.get("hardware_class")
+    if hardware_class and capabilities.get("hardware_class") != hardware_class:
+        return False
+    
+    return True
+
+class SchedulingPolicy:
+    """Decides whether a polling node should take a query or leave it for a better peer
+
+    Subclasses define cost(); lower is better. The ranking passed to allows()
+    is a list of (cost, NodeInfo) for live nodes sorted by cost.
+    """
+    name = "fifo"
+    
+    def cost(self, server: "DistributedRoutingServer", node_info: NodeInfo) -> float:
+        return 0.0
+    
+    def allows(self, server, node_info: NodeInfo, ranking: List, is_rival, slots: int) -> bool:
+        """Allow the node unless `slots` eligible rivals are strictly cheaper
+        
+        The ranking may be a little stale, so a rival only counts if it is
+        still cheaper now; otherwise two nodes could each defer to the other.
+        """
+        own_cost = self.cost(server, node_info)
+        better_rivals = 0
+        
+        for cost, rival in ranking:
+            if cost >= own_cost:
+                break
+            if (rival.node_id != node_info.node_id and is_rival(rival)
+                    and self.cost(server, rival) < own_cost):
+                better_rivals += 1
+                if better_rivals >= slots:
+                    return False
+        
+        return True
+
+class LeastLoadedPolicy(SchedulingPolicy):
+    """Prefer nodes with the fewest in-flight assignments relative to their cap"""
+    name = "least_loaded"
+    
+    def cost(self, server, node_info: NodeInfo) -> float:
+        return node_info.active_assignments / server._node_capacity(node_info)
+
+class FastestCompletionPolicy(SchedulingPolicy):
+    """Prefer nodes expected to finish soonest given their queue and observed speed"""
+    name = "fastest_completion"
+    
+    def cost(self, server, node_info: NodeInfo) -> float:
+        return (node_info.active_assignments + 1) * server._expected_service_time(node_info)
+
+class PowerOfTwoChoicesPolicy(FastestCompletionPolicy):
+    """Compare against `slots` random live rivals instead of the whole ranking
+    
+    Like the base policy the node only defers if `slots` eligible rivals
+    are strictly cheaper, here judged on the ones it happened to draw.
+    """
+    name = "power_of_two"
+    
+    def allows(self, server, node_info: NodeInfo, ranking: List, is_rival, slots: int) -> bool:
+        # A few extra draws so the node itself or ineligible peers don't use up the sample
+        drawn = random.sample(ranking, min(len(ranking), 3 * slots))
+        rivals = [rival for _, rival in drawn if rival.node_id != node_info.node_id and is_rival(rival)][:slots]
+        if len(rivals) < slots:
+            return True
+        own_cost = self.cost(server, node_info)
+        return any(self.cost(server, rival) >= own_cost for rival in rivals)
+
+SCHEDULING_POLICIES = {
+    policy.name: policy
+    for policy in (SchedulingPolicy, LeastLoadedPolicy, FastestCompletionPolicy, PowerOfTwoChoicesPolicy)
+}
+
+_QUERY_RECORD_FIELDS = [f.name for f in fields(QueryInfo) if f.name not in ("removed", "dirty", "lock")]
+_NODE_RECORD_FIELDS = [f.name for f in fields(NodeInfo)]
+_NODE_RUNTIME_FIELDS = ("last_seen", "active_assignments", "last_heartbeat")
+
+def _response_to_record(r: StoredResponse) -> Dict:
+    """Answers stay in their stored form; compressed bytes are base64-encoded"""
+    record = {"node_id": r.node_id, "timestamp": r.timestamp, "weight": r.weight}
+    if isinstance(r.body, str):
+        record["response"] = r.body
+    elif isinstance(r.body, SpilledBody):
+        record["spilled"] = [r.body.path, r.body.size]
+    else:
+        record["compressed"] = base64.b64encode(r.body).decode("ascii")
+    return record
+
+def _response_from_record(record: Dict) -> StoredResponse:
+    if "compressed" in record:
+        body = base64.b64decode(record["compressed"])
+    elif "spilled" in record:
+        body = SpilledBody(*record["spilled"])
+    else:
+        body = record["response"]
+    return StoredResponse(_node_handle(record["node_id"]), body, record["timestamp"], record.get("weight", 1.0))
+
+def _query_to_record(query_info: QueryInfo) -> Dict:
+    """JSON-serializable copy of a query for shared state backends"""
+    record = {name: getattr(query_info, name) for name in _QUERY_RECORD_FIELDS}
+    record["responses"] = [_response_to_record(r) for r in query_info.responses]
+    record["assignments"] = {
+        node_id: [assignment.assigned_at, assignment.deadline, assignment.lease_expires, assignment.state]
+        for node_id, assignment in query_info.assignments.items()
+    }
+    record["partial_streams"] = {
+        node_id: {
+            "stream_id": stream.stream_id,
+            "chunks": list(stream.chunks),
+            "buffered_chars": stream.buffered_chars,
+            "next_sequence": stream.next_sequence,
+            "finished": stream.finished
+        }
+        for node_id, stream in query_info.partial_streams.items()
+    }
+    return record
+
+def _legacy_assignments(record: Dict) -> Dict:
+    """Assignments of a record written before they were kept as one map per query"""
+    cancelled = set(record.pop("cancelled_nodes", ()))
+    expired = set(record.pop("expired_nodes", ()))
+    assigned_at = record.pop("assigned_at", {})
+    deadlines = record.pop("assignment_deadlines", {})
+    lease_expires = record.pop("lease_expires", {})
+    responded = {r["node_id"] for r in record["responses"]}
+    
+    assignments = {}
+    for node_id in record.pop("assigned_nodes", ()):
+        state = ("answered" if node_id in responded else "cancelled" if node_id in cancelled
+                 else "expired" if node_id in expired else "active")
+        assignments[node_id] = [assigned_at.get(node_id, record["timestamp"]), deadlines.get(node_id, 0),
+                                lease_expires.get(node_id, float("inf")), state]
+    return assignments
+
+def _query_from_record(record: Dict) -> QueryInfo:
+    """Rebuild a QueryInfo from _query_to_record() output"""
+    if "assignments" not in record:
+        record["assignments"] = _legacy_assignments(record)
+    
+    record["submitter_node_id"] = _node_handle(record["submitter_node_id"])
+    record["followers"] = [_node_handle(node_id) for node_id in record["followers"]]
+    record["responses"] = [_response_from_record(r) for r in record["responses"]]
+    record["assignments"] = {
+        _node_handle(node_id): Assignment(*assignment)
+        for node_id, assignment in record["assignments"].items()
+    }
+    record["partial_streams"] = {
+        _node_handle(node_id): PartialStream(**dict(stream, chunks=deque(stream["chunks"])))
+        for node_id, stream in record["partial_streams"].items()
+    }
+    return QueryInfo(**record)
+
+def _node_to_record(node_info: NodeInfo) -> Dict:
+    """JSON-serializable copy of a node for shared state backends"""
+    record = {name: getattr(node_info, name) for name in _NODE_RECORD_FIELDS}
+    record["cancelled_queries"] = sorted(node_info.cancelled_queries)
+    return record
+
+def _durable_node_record(node_info: NodeInfo) -> Dict:
+    """_node_to_record() without the fields every poll changes, which a restarted router rebuilds"""
+    record = _node_to_record(node_info)
+    for name in _NODE_RUNTIME_FIELDS:
+        del record[name]
+    return record
+
+def _node_from_record(record: Dict) -> NodeInfo:
+    """Rebuild a NodeInfo from _node_to_record() output"""
+    record["node_id"] = _node_handle(record["node_id"])
+    record["cancelled_queries"] = set(record["cancelled_queries"])
+    return NodeInfo(**record)
+
+class StateBackend:
+    """Where the router keeps its nodes, queries and dispatch queue
+    
+    DistributedRoutingServer only reaches its state through these methods.
+    The context managers hand out records that may be modified in place;
+    changes are kept when the block exits, for queries only if the caller
+    marked them with touch(). Backends decide how that is made atomic:
+    in-process locks, or database transactions when several router
+    processes share the state.
+    """
+    name = "base"
+    shared = False  # True if other processes can change the state behind our back
+    poll_interval: Optional[float] = None  # How often waiters re-check a shared state
+    
+    def next_query_number(self) -> int:
+        """Allocate a new, never reused query number"""
+        raise NotImplementedError
+    
+    def last_query_number(self) -> int:
+        """Highest query number allocated so far"""
+        raise NotImplementedError
+    
+    def add_query(self, query_info: QueryInfo, dispatch: bool = True):
+        """Store a new query and, if dispatch, queue it for anyone but its submitter"""
+        raise NotImplementedError
+    
+    def query(self, query_number: int, blocking: bool = True, writable: bool = True):
+        """Context manager yielding the live query, or None if it does not exist
+        
+        With blocking=False a query that is busy elsewhere also yields None.
+        writable=False is a hint that the caller only reads; only a dispatch
+        pass may still touch() a query it opened that way.
+        """
+        raise NotImplementedError
+    
+    def touch(self, query_info: QueryInfo, durable: bool = True):
+        """Mark a query opened with query() as changed, so it is written back when the block exits
+        
+        durable=False marks changes that only matter while this router runs
+        (stream buffers), which a process-local backend need not persist.
+        """
+        query_info.dirty = True
+    
+    def remove_query(self, query_number: int, on_removed):
+        """Delete a query and its queue slot, returning on_removed(query_info)
+        
+        Returns None if the query did not exist.
+        """
+        raise NotImplementedError
+    
+    def list_queries(self) -> List[QueryInfo]:
+        """Point-in-time list of every stored query"""
+        raise NotImplementedError
+    
+    def query_count(self) -> int:
+        raise NotImplementedError
+    
+    def oldest_query_numbers(self, count: int) -> List[int]:
+        """The `count` longest-stored queries, oldest first"""
+        raise NotImplementedError
+    
+    def nodes(self, node_ids: Optional[List[str]] = None, writable: bool = True):
+        """Context manager yielding the node registry as a mutable dict
+        
+        node_ids limits which nodes need to be loaded; the dict may still
+        contain others. Adding and deleting keys registers/removes nodes.
+        writable=False promises the caller only reads, so nothing is
+        compared or written back; writers should name the nodes they change.
+        """
+        raise NotImplementedError
+    
+    def node_count(self) -> int:
+        raise NotImplementedError
+    
+    def dequeue(self, query_number: int):
+        """Take a query out of the dispatch queue"""
+        raise NotImplementedError
+    
+    def dispatch(self):
+        """Context manager yielding the dispatch queue for one exclusive claim pass
+        
+        The queue offers eligible_for(node_id), exclude(entry, node_id),
+        charge(entry), discard_locked(query_number) and
+        park_locked(query_number), see DispatchQueue.
+        """
+        raise NotImplementedError
+    
+    def requeue(self, query_number: int) -> bool:
+        """Offer a parked query to workers again, returning whether it was parked"""
+        raise NotImplementedError
+    
+    def pending_count(self) -> int:
+        raise NotImplementedError
+
+class InMemoryState(StateBackend):
+    """Process-local state, split so unrelated requests don't serialize on one lock
+    
+    Each part of the state has its own synchronization:
+    - nodes_lock: the node registry and every NodeInfo field
+    - queries_lock: the query table's membership and the query counter
+    - pending_queries.lock: the dispatch queue
+    - QueryInfo.lock: one query's responses, assignments and streams
+    
+    Locks are always taken in that order, right to left: a query lock may be
+    held while taking nodes_lock, never the other way around. The dispatch
+    pass holds the queue lock and only try-acquires query locks, so a path
+    holding a query lock must release it before touching the queue. Single
+    dict lookups on queries/nodes are atomic and done without a lock.
+    """
+    name = "memory"
+    
+    def __init__(self):
+        self.nodes_lock = InstrumentedLock("nodes")
+        self.queries_lock = InstrumentedLock("queries")
+        self.counter = 0
+        self._nodes: Dict[str, NodeInfo] = {}
+        self._queries: Dict[int, QueryInfo] = {}
+        self.pending_queries = DispatchQueue()
+    
+    def next_query_number(self) -> int:
+        with self.queries_lock:
+            self.counter += 1
+            return self.counter
+    
+    def last_query_number(self) -> int:
+        return self.counter
+    
+    def add_query(self, query_info: QueryInfo, dispatch: bool = True):
+        with self.queries_lock:
+            self._queries[query_info.query_number] = query_info
+        if dispatch:
+            self.pending_queries.append(query_info.query_number, query_info.submitter_node_id,
+                                        priority=PRIORITY_CLASSES[query_info.priority],
+                                        weight=query_info.share_weight)
+    
+    @contextmanager
+    def query(self, query_number: int, blocking: bool = True, writable: bool = True):
+        query_info = self._queries.get(query_number)
+        if query_info is None or not query_info.lock.acquire(blocking):
+            yield None
+            return
+        
+        try:
+            # The query may have been removed while we waited for its lock
+            yield None if query_info.removed else query_info
+        finally:
+            query_info.lock.release()
+    
+    def remove_query(self, query_number: int, on_removed):
+        with self.queries_lock:
+            query_info = self._queries.pop(query_number, None)
+        if not query_info:
+            return None
+        
+        self.pending_queries.discard(query_number)
+        
+        with query_info.lock:
+            query_info.removed = True
+            return on_removed(query_info)
+    
+    def list_queries(self) -> List[QueryInfo]:
+        with self.queries_lock:
+            return list(self._queries.values())
+    
+    def query_count(self) -> int:
+        return len(self._queries)
+    
+    def oldest_query_numbers(self, count: int) -> List[int]:
+        # Dicts keep insertion order, which is submission order
+        with self.queries_lock:
+            return list(itertools.islice(self._queries, count))
+    
+    @contextmanager
+    def nodes(self, node_ids: Optional[List[str]] = None, writable: bool = True):
+        with self.nodes_lock:
+            yield self._nodes
+    
+    def node_count(self) -> int:
+        return len(self._nodes)
+    
+    def touch(self, query_info: QueryInfo, durable: bool = True):
+        pass  # The live objects are the state
+    
+    def dequeue(self, query_number: int):
+        self.pending_queries.discard(query_number)
+    
+    @contextmanager
+    def dispatch(self):
+        with self.pending_queries.lock:
+            yield self.pending_queries
+    
+    def requeue(self, query_number: int) -> bool:
+        return self.pending_queries.requeue(query_number)
+    
+    def pending_count(self) -> int:
+        return len(self.pending_queries)
+
+class Journal:
+    """Append-only log of state records in numbered segment files
+    
+    append() only buffers a line; flush() writes everything buffered since
+    the last flush with a single fsync (group commit), so request threads
+    never wait on the disk unless they ask to via wait_durable().
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.records_since_rotate = 0
+        self._condition = threading.Condition()  # Guards the buffer and sequence numbers
+        self._io_lock = threading.Lock()  # Serializes writes, fsyncs and rotation
+        self._buffer: List[str] = []
+        self._appended = 0
+        self._durable = 0
+        self.segment = max(self.segments(), default=0) + 1
+        self._file = open(self._segment_path(self.segment), "a", encoding="utf-8")
+    
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"journal.{segment:08d}.log")
+    
+    def segments(self) -> List[int]:
+        """Numbers of the segment files on disk, oldest first"""
+        return sorted(int(name.split(".")[1]) for name in os.listdir(self.directory)
+                      if name.startswith("journal.") and name.endswith(".log"))
+    
+    def read_segment(self, segment: int):
+        """Yield the records of one segment, stopping at a torn final line"""
+        with open(self._segment_path(segment), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring incomplete journal record in segment {segment}")
+                    return
+    
+    def remove_segments_before(self, segment: int):
+        for old_segment in self.segments():
+            if old_segment < segment:
+                os.remove(self._segment_path(old_segment))
+    
+    def append(self, line: str) -> int:
+        """Buffer one JSON record, returning its sequence number"""
+        with self._condition:
+            self._buffer.append(line)
+            self._appended += 1
+            self.records_since_rotate += 1
+            return self._appended
+    
+    def flush(self):
+        """Write and fsync everything appended so far"""
+        with self._io_lock:
+            with self._condition:
+                lines, self._buffer = self._buffer, []
+                sequence = self._appended
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            with self._condition:
+                self._durable = sequence
+                self._condition.notify_all()
+    
+    def wait_durable(self, sequence: int):
+        """Block until the record with this sequence number has been fsynced"""
+        with self._condition:
+            while self._durable < sequence:
+                self._condition.wait()
+    
+    def rotate(self) -> int:
+        """Flush and continue in a new segment, returning its number"""
+        with self._io_lock:
+            with self._condition:
+                lines, self._buffer = self._buffer, []
+                sequence = self._appended
+                self.records_since_rotate = 0
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self.segment += 1
+            self._file = open(self._segment_path(self.segment), "a", encoding="utf-8")
+            with self._condition:
+                self._durable = sequence
+                self._condition.notify_all()
+            return self.segment
+
+class JournaledState(InMemoryState):
+    """InMemoryState that survives restarts through a write-ahead journal and snapshots
+    
+    Every change is journaled as the full new record of the query or node
+    (or its removal), so replaying is idempotent and order is all that
+    matters. Queries are only journaled when touch()ed durably, so opening
+    one costs nothing; stream buffers are not journaled on their own.
+    Nodes are journaled without last_seen, active_assignments and
+    last_heartbeat, so a poll or heartbeat that only refreshes those costs
+    no journal write; recovery counts assignments again from the queries
+    and treats every node as seen at startup. The dispatch queue is not
+    journaled: it is rebuilt from the unfinished queries. A background thread group-commits the journal every
+    flush_interval; with sync_commit a change is only acknowledged once it
+    is on disk, otherwise at most flush_interval of changes can be lost.
+    After snapshot_every records a snapshot is written and older segments
+    are deleted, which bounds the replay work on startup.
+    """
+    name = "journal"
+    
+    def __init__(self, directory: str, sync_commit: bool = False,
+                 flush_interval: float = 0.02, snapshot_every: int = 10000):
+        super().__init__()
+        self.directory = directory
+        self.sync_commit = sync_commit
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+        
+        self.journal = Journal(directory)
+        self._recover()
+        self.snapshot()
+        
+        flush_thread = threading.Thread(target=self._flush_worker, daemon=True)
+        flush_thread.start()
+        atexit.register(self.journal.flush)
+    
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.directory, "snapshot.json")
+    
+    def _recover(self):
+        """Load the last snapshot and replay the journal written after it"""
+        started = time.time()
+        queries: Dict[int, Dict] = {}
+        nodes: Dict[str, Dict] = {}
+        counter = 0
+        journal_start = 0
+        
+        if os.path.exists(self._snapshot_path()):
+            with open(self._snapshot_path(), encoding="utf-8") as f:
+                snapshot = json.load(f)
+            journal_start = snapshot["journal_start"]
+            counter = snapshot["counter"]
+            queries = {record["query_number"]: record for record in snapshot["queries"]}
+            nodes = {record["node_id"]: record for record in snapshot["nodes"]}
+        
+        replayed = 0
+        for segment in self.journal.segments():
+            if segment < journal_start or segment == self.journal.segment:
+                continue
+            for entry in self.journal.read_segment(segment):
+                op = entry["op"]
+                if op == "query":
+                    record = entry["record"]
+                    queries[record["query_number"]] = record
+                    counter = max(counter, record["query_number"])
+                elif op == "remove_query":
+                    queries.pop(entry["query_number"], None)
+                    counter = max(counter, entry["query_number"])
+                elif op == "node":
+                    nodes[entry["record"]["node_id"]] = entry["record"]
+                elif op == "remove_node":
+                    nodes.pop(entry["node_id"], None)
+                replayed += 1
+        
+        self.counter = counter
+        # Journals written before runtime fields were left out still carry them
+        self._nodes = {node_id: _node_from_record({**record, "last_seen": started, "last_heartbeat": 0.0,
+                                                  "active_assignments": 0})
+                       for node_id, record in nodes.items()}
+        for query_number in sorted(queries):
+            query_info = _query_from_record(queries[query_number])
+            self._queries[query_number] = query_info
+            if not query_info.completed:
+                # The dispatch pass drops it again if it has no open slots
+                self.pending_queries.append(query_number, query_info.submitter_node_id,
+                                            [*query_info.assignments, *query_info.followers],
+                                            PRIORITY_CLASSES[query_info.priority], query_info.share_weight)
+        
+        # Capacity reservations of claims cut short by the restart were never given back
+        active = Counter(node_id for query_info in self._queries.values()
+                         for node_id in _outstanding_nodes(query_info))
+        for node_id, node_info in self._nodes.items():
+            node_info.active_assignments = active[node_id]
+        
+        if queries or nodes or replayed:
+            logger.info(f"Recovered {len(self._queries)} queries and {len(self._nodes)} nodes "
+                        f"({replayed} journal records) in {time.time() - started:.2f}s")
+    
+    def snapshot(self):
+        """Write a compact snapshot and drop the journal segments it covers
+        
+        Changes made while the snapshot is taken land in the new segment and
+        are replayed over it, which is safe because records are idempotent.
+        """
+        journal_start = self.journal.rotate()
+        counter = self.counter
+        
+        queries = []
+        for query_info in self.list_queries():
+            with query_info.lock:
+                if not query_info.removed:
+                    queries.append(_query_to_record(query_info))
+        with self.nodes_lock:
+            nodes = [_durable_node_record(node_info) for node_info in self._nodes.values()]
+        
+        temporary_path = self._snapshot_path() + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({"journal_start": journal_start, "counter": counter,
+                       "queries": queries, "nodes": nodes}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self._snapshot_path())
+        
+        self.journal.remove_segments_before(journal_start)
+    
+    def _flush_worker(self):
+        while True:
+            try:
+                time.sleep(self.flush_interval)
+                self.journal.flush()
+                if self.journal.records_since_rotate >= self.snapshot_every:
+                    self.snapshot()
+            except Exception as e:
+                logger.error(f"Journal worker error: {e}")
+    
+    def _commit(self, sequence: Optional[int]):
+        """Wait for a journaled change to be durable if running with sync_commit"""
+        if sequence and self.sync_commit:
+            self.journal.wait_durable(sequence)
+    
+    def add_query(self, query_info: QueryInfo, dispatch: bool = True):
+        super().add_query(query_info, dispatch)
+        self._commit(self.journal.append(json.dumps({"op": "query", "record": _query_to_record(query_info)})))
+    
+    def touch(self, query_info: QueryInfo, durable: bool = True):
+        if durable:
+            query_info.dirty = True
+    
+    @contextmanager
+    def query(self, query_number: int, blocking: bool = True, writable: bool = True):
+        sequence = None
+        with super().query(query_number, blocking, writable) as query_info:
+            yield query_info
+            if query_info and query_info.dirty:
+                query_info.dirty = False
+                sequence = self.journal.append(json.dumps({"op": "query", "record": _query_to_record(query_info)}))
+        self._commit(sequence)
+    
+    def remove_query(self, query_number: int, on_removed):
+        result = super().remove_query(query_number, on_removed)
+        if result is not None:
+            self._commit(self.journal.append(json.dumps({"op": "remove_query", "query_number": query_number})))
+        return result
+    
+    @contextmanager
+    def nodes(self, node_ids: Optional[List[str]] = None, writable: bool = True):
+        if not writable:
+            with super().nodes(node_ids, writable) as nodes:
+                yield nodes
+            return
+        
+        sequence = None
+        with super().nodes(node_ids) as nodes:
+            watched = list(nodes) if node_ids is None else node_ids
+            before = {node_id: json.dumps(_durable_node_record(nodes[node_id]))
+                      for node_id in watched if node_id in nodes}
+            yield nodes
+            
+            if node_ids is None:
+                watched = set(before) | set(nodes)
+            for node_id in watched:
+                node_info = nodes.get(node_id)
+                if node_info is None:
+                    if node_id in before:
+                        sequence = self.journal.append(json.dumps({"op": "remove_node", "node_id": node_id}))
+                    continue
+                after = json.dumps(_durable_node_record(node_info))
+                if after != before.get(node_id):
+                    sequence = self.journal.append(f'{{"op": "node", "record": {after}}}')
+        self._commit(sequence)
+
+class _SQLiteDispatchQueue:
+    """DispatchQueue interface over the pending/dispatch_excluded tables"""
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+    
+    def eligible_for(self, node_id: str):
+        last_key = (-len(PRIORITY_CLASSES), 0.0, 0)
+        while True:
+            # Page through the queue so rows can be changed while we iterate
+            rows = self._conn.execute(
+                "SELECT priority, start_tag, seq, query_number FROM pending p "
+                "WHERE NOT parked AND (-priority, start_tag, seq) > (?, ?, ?) AND NOT EXISTS "
+                "(SELECT 1 FROM dispatch_excluded e WHERE e.query_number = p.query_number AND e.node_id = ?) "
+                "ORDER BY priority DESC, start_tag, seq LIMIT 64",
+                (*last_key, node_id)
+            ).fetchall()
+            if not rows:
+                return
+            for priority, start_tag, seq, query_number in rows:
+                yield DispatchEntry(query_number, priority=priority, start_tag=start_tag)
+            priority, start_tag, seq, _ = rows[-1]
+            last_key = (-priority, start_tag, seq)
+    
+    def exclude(self, entry: DispatchEntry, node_id: str):
+        self._conn.execute("INSERT OR IGNORE INTO dispatch_excluded VALUES (?, ?)", (entry.query_number, node_id))
+    
+    def discard_locked(self, query_number: int):
+        self._conn.execute("DELETE FROM pending WHERE query_number = ?", (query_number,))
+        self._conn.execute("DELETE FROM dispatch_excluded WHERE query_number = ?", (query_number,))
+    
+    def park_locked(self, query_number: int):
+        self._conn.execute("UPDATE pending SET parked = 1 WHERE query_number = ?", (query_number,))
+    
+    def charge(self, entry: DispatchEntry):
+        if self._conn.execute("UPDATE meta SET value = ? WHERE key = 'virtual_time' AND value < ?",
+                              (entry.start_tag, entry.start_tag)).rowcount:
+            self._conn.execute("DELETE FROM dispatch_flows WHERE finish <= ?", (entry.start_tag,))
+
+class SQLiteState(StateBackend):
+    """State in a SQLite database in WAL mode, shared by router processes on one host
+    
+    Every change runs in a BEGIN IMMEDIATE transaction. SQLite lets only one
+    such transaction run at a time across all processes, so a claim pass is
+    exclusive and a query slot is handed out at most once, whichever process
+    serves the poll. Operations nested on one thread join the outer
+    transaction. Records are stored as JSON and written back only if changed.
+    """
+    name = "sqlite"
+    shared = True
+    poll_interval = 0.5
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock_wait = LOCK_WAIT_SECONDS.labels(lock="sqlite")  # Waiting for BEGIN IMMEDIATE
+        self._lock_hold = LOCK_HOLD_SECONDS.labels(lock="sqlite")  # Write transaction duration
+        
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS queries (query_number INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS pending (seq INTEGER PRIMARY KEY AUTOINCREMENT, query_number INTEGER UNIQUE NOT NULL, "
+                         "priority INTEGER NOT NULL DEFAULT 1, start_tag REAL NOT NULL DEFAULT 0, parked INTEGER NOT NULL DEFAULT 0)")
+            conn.execute("CREATE TABLE IF NOT EXISTS dispatch_excluded (query_number INTEGER NOT NULL, node_id TEXT NOT NULL, "
+                         "PRIMARY KEY (query_number, node_id))")
+            conn.execute("CREATE TABLE IF NOT EXISTS dispatch_flows (submitter_node_id TEXT PRIMARY KEY, finish REAL NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('query_counter', 0)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('virtual_time', 0)")
+            
+            # Databases created before fair queuing have a FIFO-only pending table
+            pending_columns = {row[1] for row in conn.execute("PRAGMA table_info(pending)")}
+            if "start_tag" not in pending_columns:
+                conn.execute("ALTER TABLE pending ADD COLUMN priority INTEGER NOT NULL DEFAULT 1")
+                conn.execute("ALTER TABLE pending ADD COLUMN start_tag REAL NOT NULL DEFAULT 0")
+            if "parked" not in pending_columns:
+                conn.execute("ALTER TABLE pending ADD COLUMN parked INTEGER NOT NULL DEFAULT 0")
+        
+        logger.info(f"Using shared SQLite state at {path}")
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread, in autocommit mode so transactions are explicit"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+    
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        began = time.perf_counter()
+        self._lock_wait.observe(began - started)
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+            self._lock_hold.observe(time.perf_counter() - began)
+    
+    def next_query_number(self) -> int:
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'query_counter' RETURNING value"
+            ).fetchone()[0]
+    
+    def last_query_number(self) -> int:
+        return self._connection().execute("SELECT value FROM meta WHERE key = 'query_counter'").fetchone()[0]
+    
+    def add_query(self, query_info: QueryInfo, dispatch: bool = True):
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO queries VALUES (?, ?)",
+                         (query_info.query_number, json.dumps(_query_to_record(query_info))))
+            if not dispatch:
+                return
+            
+            # Same start-time fair queuing as DispatchQueue.append()
+            submitter = query_info.submitter_node_id
+            row = conn.execute(
+                "SELECT MAX((SELECT value FROM meta WHERE key = 'virtual_time'), "
+                "COALESCE((SELECT finish FROM dispatch_flows WHERE submitter_node_id = ?), 0))",
+                (submitter,)
+            ).fetchone()
+            start_tag = row[0]
+            conn.execute("INSERT OR REPLACE INTO dispatch_flows VALUES (?, ?)",
+                         (submitter, start_tag + 1 / query_info.share_weight))
+            conn.execute("INSERT INTO pending (query_number, priority, start_tag) VALUES (?, ?, ?)",
+                         (query_info.query_number, PRIORITY_CLASSES[query_info.priority], start_tag))
+            conn.execute("INSERT INTO dispatch_excluded VALUES (?, ?)",
+                         (query_info.query_number, query_info.submitter_node_id))
+    
+    @contextmanager
+    def query(self, query_number: int, blocking: bool = True, writable: bool = True):
+        select = "SELECT data FROM queries WHERE query_number = ?"
+        
+        # Inside a dispatch pass reads already run in its transaction, so touched copies can be written back
+        if not writable and not getattr(self._local, "depth", 0):
+            row = self._connection().execute(select, (query_number,)).fetchone()
+            yield _query_from_record(json.loads(row[0])) if row else None
+            return
+        
+        with self._transaction() as conn:
+            row = conn.execute(select, (query_number,)).fetchone()
+            if row is None:
+                yield None
+                return
+            
+            query_info = _query_from_record(json.loads(row[0]))
+            yield query_info
+            
+            if query_info.dirty:
+                conn.execute("UPDATE queries SET data = ? WHERE query_number = ?",
+                             (json.dumps(_query_to_record(query_info)), query_number))
+    
+    def remove_query(self, query_number: int, on_removed):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM queries WHERE query_number = ?", (query_number,)).fetchone()
+            if row is None:
+                return None
+            
+            conn.execute("DELETE FROM queries WHERE query_number = ?", (query_number,))
+            _SQLiteDispatchQueue(conn).discard_locked(query_number)
+            
+            query_info = _query_from_record(json.loads(row[0]))
+            query_info.removed = True
+            return on_removed(query_info)
+    
+    def list_queries(self) -> List[QueryInfo]:
+        rows = self._connection().execute("SELECT data FROM queries ORDER BY query_number").fetchall()
+        return [_query_from_record(json.loads(data)) for data, in rows]
+    
+    def query_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+    
+    def oldest_query_numbers(self, count: int) -> List[int]:
+        rows = self._connection().execute(
+            "SELECT query_number FROM queries ORDER BY query_number LIMIT ?", (count,)
+        ).fetchall()
+        return [query_number for query_number, in rows]
+    
+    def _select_nodes(self, conn: sqlite3.Connection, node_ids: Optional[List[str]]) -> List:
+        if node_ids is None:
+            return conn.execute("SELECT node_id, data FROM nodes").fetchall()
+        node_ids = list(set(node_ids))
+        return conn.execute(
+            f"SELECT node_id, data FROM nodes WHERE node_id IN ({','.join('?' * len(node_ids))})",
+            node_ids
+        ).fetchall()
+    
+    @contextmanager
+    def nodes(self, node_ids: Optional[List[str]] = None, writable: bool = True):
+        # Same as query(): reads outside a transaction don't take the write lock
+        if not writable and not getattr(self._local, "depth", 0):
+            rows = self._select_nodes(self._connection(), node_ids)
+            yield {node_id: _node_from_record(json.loads(data)) for node_id, data in rows}
+            return
+        
+        with self._transaction() as conn:
+            rows = self._select_nodes(conn, node_ids)
+            stored = dict(rows)
+            nodes = {node_id: _node_from_record(json.loads(data)) for node_id, data in rows}
+            yield nodes
+            
+            for node_id in stored.keys() - nodes.keys():
+                conn.execute("DELETE FROM nodes WHERE node_id = ?", (node_id,))
+            for node_id, node_info in nodes.items():
+                data = json.dumps(_node_to_record(node_info))
+                if data != stored.get(node_id):
+                    conn.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?)", (node_id, data))
+    
+    def node_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+    
+    def dequeue(self, query_number: int):
+        with self._transaction() as conn:
+            _SQLiteDispatchQueue(conn).discard_locked(query_number)
+    
+    @contextmanager
+    def dispatch(self):
+        with self._transaction() as conn:
+            yield _SQLiteDispatchQueue(conn)
+    
+    def requeue(self, query_number: int) -> bool:
+        with self._transaction() as conn:
+            return conn.execute("UPDATE pending SET parked = 0 WHERE query_number = ? AND parked",
+                                (query_number,)).rowcount > 0
+    
+    def pending_count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+STATE_BACKENDS = {backend.name: backend for backend in (InMemoryState, JournaledState, SQLiteState)}
+
+def create_state_backend(name: str = "memory", path: Optional[str] = None) -> StateBackend:
+    """Build a state backend by name (see STATE_BACKENDS)"""
+    if name not in STATE_BACKENDS:
+        raise ValueError(f"Unknown state backend: {name}")
+    if name == "sqlite":
+        return SQLiteState(path or "routing_state.db")
+    if name == "journal":
+        return JournaledState(path or "routing_journal", sync_commit=os.environ.get("ROUTING_JOURNAL_SYNC") == "1")
+    return STATE_BACKENDS[name]()
+
+@dataclass
+class StatusSnapshot:
+    """One immutable copy of the node and query summaries served by /status"""
+    version: int = 0
+    built_at: float = 0.0
+    nodes: Dict[str, Dict] = field(default_factory=dict)
+    queries: Dict[int, Dict] = field(default_factory=dict)
+    node_keys: List[str] = field(default_factory=list)  # Sorted, for cursor pagination
+    query_keys: List[int] = field(default_factory=list)
+    item_versions: Dict[tuple, int] = field(default_factory=dict)  # ("node", id) / ("query", number) -> version it last changed in
+    removed: List[tuple] = field(default_factory=list)  # (version, kind, key), oldest first
+
+class StatusView:
+    """Copy of the state that status requests read instead of the live tables
+    
+    The copy is rebuilt at most every `max_age` seconds, by whichever
+    request finds it stale; concurrent requests keep reading the previous
+    copy meanwhile, so dashboards cost one table walk per interval however
+    many there are. Each rebuild is a new version, and every item records
+    the version its summary last changed in, which lets clients ask only
+    for what changed since a version they hold. Removals are remembered for
+    `tombstone_versions` versions; clients further behind must resync.
+    """
+    
+    def __init__(self, max_age: float = 1.0, tombstone_versions: int = 600):
+        self.max_age = max_age
+        self.tombstone_versions = tombstone_versions
+        self.current = StatusSnapshot()
+        self._rebuild_lock = threading.Lock()
+    
+    def get(self, collect) -> StatusSnapshot:
+        """The current snapshot, rebuilt from collect() -> (nodes, queries) if stale"""
+        snapshot = self.current
+        if time.time() - snapshot.built_at < self.max_age:
+            return snapshot
+        
+        # Only the very first request has nothing older to fall back on
+        if not self._rebuild_lock.acquire(blocking=snapshot.version == 0):
+            return snapshot
+        try:
+            if self.current is not snapshot:
+                return self.current
+            
+            nodes, queries = collect()
+            version = snapshot.version + 1
+            item_versions = {}
+            removed = [item for item in snapshot.removed if item[0] > version - self.tombstone_versions]
+            for kind, items, previous in (("node", nodes, snapshot.nodes), ("query", queries, snapshot.queries)):
+                for key, summary in items.items():
+                    unchanged = previous.get(key) == summary
+                    item_versions[(kind, key)] = snapshot.item_versions[(kind, key)] if unchanged else version
+                removed.extend((version, kind, key) for key in previous.keys() - items.keys())
+            
+            self.current = StatusSnapshot(version, time.time(), nodes, queries, sorted(nodes), sorted(queries),
+                                          item_versions, removed)
+            return self.current
+        finally:
+            self._rebuild_lock.release()
+    
+    def page(self, snapshot: StatusSnapshot, kind: str, cursor=None, limit: int = 100,
+             since_version: Optional[int] = None, matches=None) -> Dict:
+        """Up to `limit` summaries after `cursor`, optionally only those changed since a version"""
+        items, keys = (snapshot.nodes, snapshot.node_keys) if kind == "node" else (snapshot.queries, snapshot.query_keys)
+        start = bisect.bisect_right(keys, cursor) if cursor is not None else 0
+        
+        page = []
+        next_cursor = None
+        for key in itertools.islice(keys, start, None):
+            if since_version is not None and snapshot.item_versions[(kind, key)] <= since_version:
+                continue
+            summary = items[key]
+            if matches and not matches(summary):
+                continue
+            if len(page) == limit:
+                next_cursor = page[-1][0]
+                break
+            page.append((key, summary))
+        
+        result = {
+            "version": snapshot.version,
+            "items": [summary for _, summary in page],
+            "next_cursor": next_cursor
+        }
+        if since_version is not None:
+            result["resync"] = since_version < snapshot.version - self.tombstone_versions
+            result["removed"] = [key for version, removed_kind, key in snapshot.removed
+                                 if removed_kind == kind and version > since_version]
+        return result
+
+class DistributedRoutingServer:
+    """Routing logic on top of a pluggable state backend
+    
+    Nodes, queries and the dispatch queue live in `state` (see StateBackend).
+    The default InMemoryState serves a single process, JournaledState
+    adds restart recovery to it and SQLiteState lets several router
+    processes share one fleet. What stays per process is the
+    scheduler's ranking cache and the update signals that wake parked
+    long-polls and SSE streams. With a shared backend, waiters also re-check
+    every state.poll_interval so changes made by other processes are seen.
+    Spilled answers live in spill_directory, which router processes sharing
+    a state backend must share too.
+    """
+    
+    def __init__(self, state: Optional[StateBackend] = None, spill_directory: Optional[str] = None):
+        self.state = state or InMemoryState()
+        self.work_signal = UpdateSignal()  # Notified whenever new work is queued
+        self._query_signals: Dict[int, UpdateSignal] = {}  # Notified on new responses/chunks/removal
+        self._long_polling: Counter = Counter()  # Node ID -> its GET /request?wait= calls parked in this process
+        self._signals_lock = threading.Lock()
+        
+        # Configuration
+        self.max_queries_per_node = 5  # Default cap on unanswered assignments per node
+        self.max_queries_per_request = 3  # Default claim size when the worker doesn't ask for more
+        self.max_node_capacity = 32  # Upper bound for a node's declared max_concurrent_queries
+        self.max_batch_items = 100  # Responses plus chunks accepted by one POST /batch
+        self.max_long_poll_wait = 60  # Upper bound for GET /request?wait=
+        self.stream_keepalive_interval = 15  # Seconds between SSE keepalive comments
+        self.max_stream_buffer_chars = 16384  # Unread chunk text buffered per worker stream
+        self.node_timeout = 300  # 5 minutes
+        self.query_timeout = 180  # 3 minutes
+        self.max_responses_per_query = 3  # Fixed the typo here
+        self.max_memory_size = 1000  # Maximum queries to keep in memory
+        
+        # Scheduling
+        self.scheduling_policy: SchedulingPolicy = FastestCompletionPolicy()
+        self.scheduler_hold_time = 3  # Seconds a query waits for a preferred node before anyone may take it
+        self.scheduler_refresh_interval = 1  # Seconds between node ranking rebuilds
+        self.scheduler_live_window = self.max_long_poll_wait + 15  # Nodes seen this recently are candidates
+        self.stats_smoothing = 0.3  # EWMA weight of the newest latency/throughput sample
+        self.expected_response_tokens = 256  # Used to turn tokens/sec into a service time
+        self.hardware_service_time = {"desktop": 10.0, "laptop": 15.0, "mobile": 30.0}  # Priors in seconds
+        self.default_service_time = 20.0
+        self._node_ranking: List = []
+        self._node_ranking_time = 0.0
+        self._ranking_lock = InstrumentedLock("ranking")  # Taken before the state's node lock
+        
+        # Hedged dispatch
+        self.min_assignment_deadline = 15  # Seconds before an outstanding assignment may be hedged
+        self.hedge_deadline_factor = 2.0  # Deadline = factor * node's expected service time
+        
+        # Assignment leases
+        self.min_lease_time = 30  # Seconds an assignment survives without a heartbeat, at least
+        self.lease_service_time_factor = 3.0  # Lease = factor * node's expected service time, if longer
+        
+        # Expiry of queries, nodes and leases
+        self.expiry_index = ExpiryIndex()  # Keys: ("query", number), ("node", id), ("lease", number, node id), ("requeue", number)
+        self.expiry_resync_interval = 300  # Shared state only: re-index what other processes created
+        
+        # Fair queuing between submitters
+        self.contributor_credit_step = 10  # Answers given to others that earn a submitter one more share
+        self.max_contributor_bonus = 3.0  # So a submitter's share is at most 4x a newcomer's
+        
+        # Admission control; per process, like the response cache
+        self.max_pending_queries = 500  # Queue depth at which new work is refused with 429
+        self.submit_rate_per_node = 2.0  # Sustained queries per second one submitter may send
+        self.submit_burst = 20  # Queries a submitter may send at once after being idle
+        self.submit_limiter = RateLimiter(self.submit_rate_per_node, self.submit_burst)
+        self.drain_meter = RateMeter(window=60)  # Completed dispatched queries, for wait estimates
+        
+        # Response cache; per process, so with a shared state backend each router caches what it completes
+        self.response_cache = ResponseCache(max_entries=1000, ttl=600)
+        
+        # Aggregation of each query's answers into one best answer
+        self.answer_aggregator = AnswerAggregator(duplicate_similarity=0.8, min_similarity=0.4)
+        self.quality_smoothing = 0.1  # EWMA weight of a node's newest agree/disagree outcome
+        
+        # Answer bodies; no query outlives query_timeout, so older spill files are orphans
+        self.response_store = ResponseStore(spill_directory or os.path.join(tempfile.gettempdir(), "routing_spill"),
+                                            max_age=2 * self.query_timeout)
+        self.max_request_body_bytes = 8 * 1024 * 1024  # After decompression
+        
+        # Metrics, exported at GET /metrics
+        self.start_time = time.time()
+        self.queries_submitted = metrics.counter("routing_queries_submitted_total", "Accepted queries by outcome")
+        self.queries_rejected = metrics.counter("routing_queries_rejected_total", "Queries refused by admission control")
+        self.assignments_made = metrics.counter("routing_assignments_total", "Query slots handed to workers")
+        self.responses_received = metrics.counter("routing_responses_total", "Answers accepted from workers")
+        self.early_completions = metrics.counter("routing_early_completions_total",
+                                                 "Consensus queries completed before max_responses answers arrived")
+        self.response_bytes = metrics.counter("routing_response_bytes_total",
+                                              "Answer bytes as received and as stored after compression")
+        self.leases_expired = metrics.counter("routing_leases_expired_total", "Assignments revoked when their lease ran out")
+        self.queue_wait = metrics.histogram("routing_queue_wait_seconds", "Submission to first assignment", QUERY_BUCKETS)
+        self.time_to_first_chunk = metrics.histogram("routing_time_to_first_chunk_seconds",
+                                                     "Submission to first streamed chunk", QUERY_BUCKETS)
+        self.time_to_first_response = metrics.histogram("routing_time_to_first_response_seconds",
+                                                        "Submission to first complete answer", QUERY_BUCKETS)
+        self.completion_time = metrics.histogram("routing_query_completion_seconds",
+                                                 "Submission to meeting the completion criterion", QUERY_BUCKETS)
+        self.claim_duration = metrics.histogram("routing_claim_duration_seconds", "Router time spent in one claim pass")
+        self.request_duration = metrics.histogram("routing_request_duration_seconds",
+                                                  "Handling time per endpoint, until the response starts")
+        self._node_metrics_cache = (0.0, [])
+        
+        # Status listings are served from a periodically refreshed copy of the state
+        self.status_view = StatusView(max_age=1.0)
+        self.max_status_page_size = 500
+        self._register_state_metrics()
+        
+        # Index whatever the state backend already holds, then expire entries as they come due
+        self._index_existing_state()
+        self._start_expiry_thread()
+    
+    def _register_state_metrics(self):
+        """Gauges read from the state and the node registry when /metrics is scraped"""
+        metrics.callback("routing_uptime_seconds", "Seconds since the router started",
+                         lambda: time.time() - self.start_time)
+        metrics.callback("routing_pending_queries", "Queries waiting in the dispatch queue", self.state.pending_count)
+        metrics.callback("routing_active_queries", "Queries held in state", self.state.query_count)
+        metrics.callback("routing_nodes", "Registered nodes", self.state.node_count)
+        metrics.callback("routing_drain_rate", "Queries completed per second, as used for wait estimates", self.drain_rate)
+        metrics.callback("routing_response_cache_hits_total", "Queries answered from the response cache",
+                         lambda: self.response_cache.hits, kind="counter")
+        metrics.callback("routing_response_cache_misses_total", "Cache lookups that found nothing usable",
+                         lambda: self.response_cache.misses, kind="counter")
+        
+        for name, help_text, attribute, kind in (
+            ("routing_node_responses_total", "Answers a node has provided", "responses_provided", "counter"),
+            ("routing_node_active_assignments", "Unanswered assignments a node holds", "active_assignments", "gauge"),
+            ("routing_node_response_latency_seconds", "Smoothed assignment-to-answer time of a node",
+             "avg_response_latency", "gauge"),
+            ("routing_node_tokens_per_second", "Smoothed generation speed reported by a node", "avg_tokens_per_second", "gauge")
+        ):
+            metrics.callback(name, help_text,
+                             lambda attribute=attribute: [({"node_id": node_id}, values[attribute])
+                                                          for node_id, values in self._node_metrics()],
+                             kind=kind)
+    
+    def _node_metrics(self) -> List:
+        """(node ID, stats) for every node, read once per scrape rather than once per metric"""
+        read_at, samples = self._node_metrics_cache
+        if time.time() - read_at < 1:
+            return samples
+        
+        with self.state.nodes(writable=False) as nodes:
+            samples = [
+                (node_id, {
+                    "responses_provided": node_info.responses_provided,
+                    "active_assignments": node_info.active_assignments,
+                    "avg_response_latency": node_info.avg_response_latency,
+                    "avg_tokens_per_second": node_info.avg_tokens_per_second
+                })
+                for node_id, node_info in nodes.items()
+            ]
+        self._node_metrics_cache = (time.time(), samples)
+        return samples
+    
+    def _collect_status(self):
+        """Summaries of every node and query for the status view, keyed for pagination"""
+        with self.state.nodes(writable=False) as nodes:
+            node_summaries = {
+                node_id: {
+                    "node_id": node_id,
+                    "last_seen_at": node_info.last_seen,
+                    "registration_time": node_info.registration_time,
+                    "queries_submitted": node_info.queries_submitted,
+                    "responses_provided": node_info.responses_provided,
+                    "active_assignments": node_info.active_assignments,
+                    "avg_response_latency": node_info.avg_response_latency,
+                    "avg_tokens_per_second": node_info.avg_tokens_per_second,
+                    "capabilities": dict(node_info.capabilities)
+                }
+                for node_id, node_info in nodes.items()
+            }
+        
+        # Claims and answers change these records concurrently, so copy each under its lock
+        query_summaries = {}
+        for q in self.state.list_queries():
+            with q.lock:
+                if q.removed:
+                    continue
+                query_summaries[q.query_number] = {
+                    "id": q.query_number,
+                    "submitter": q.submitter_node_id,
+                    "responses_count": len(q.responses),
+                    "assigned_nodes": len(q.assignments),
+                    "completion_mode": q.completion_mode,
+                    "priority": q.priority,
+                    "completed": q.completed,
+                    "hedged_assignments": q.hedged_assignments,
+                    "expired_leases": sum(1 for a in q.assignments.values() if a.state == "expired"),
+                    "timestamp": q.timestamp
+                }
+        return node_summaries, query_summaries
+    
+    def status_snapshot(self) -> StatusSnapshot:
+        """Node and query summaries at most status_view.max_age seconds old"""
+        return self.status_view.get(self._collect_status)
+    
+    def _start_expiry_thread(self):
+        """Start background thread that expires queries, nodes and leases when they come due"""
+        def expiry_worker():
+            last_resync = time.time()
+            while True:
+                try:
+                    for key in self.expiry_index.wait_due(max_wait=60):
+                        self._expire_key(key)
+                    
+                    if self.state.shared and time.time() - last_resync >= self.expiry_resync_interval:
+                        last_resync = time.time()
+                        self._index_existing_state()
+                except Exception as e:
+                    logger.error(f"Expiry worker error: {e}")
+        
+        expiry_thread = threading.Thread(target=expiry_worker, daemon=True)
+        expiry_thread.start()
+        logger.info("Expiry thread started")
+    
+    def _index_existing_state(self):
+        """Schedule expiry for every stored query, node and lease (startup and shared-state resync)"""
+        for query_info in self.state.list_queries():
+            self.expiry_index.schedule(("query", query_info.query_number), query_info.timestamp + query_info.timeout)
+            for node_id in _outstanding_nodes(query_info):
+                self.expiry_index.schedule(("lease", query_info.query_number, node_id),
+                                           query_info.assignments[node_id].lease_expires)
+        
+            if query_info.cache_key and not query_info.completed:
+                self.response_cache.add_inflight(query_info.cache_key, query_info.query_number)
+            
+            # Whoever parked it may be gone along with its wakeups; the next pass parks it again if need be
+            if not query_info.completed:
+                self.expiry_index.schedule(("requeue", query_info.query_number), time.time())
+        
+        with self.state.nodes(writable=False) as nodes:
+            for node_id, node_info in nodes.items():
+                self.expiry_index.schedule(("node", node_id), node_info.last_seen + self.node_timeout)
+    
+    def _expire_key(self, key):
+        """Act on a due expiry index key, rescheduling it if the state says it is not due yet"""
+        current_time = time.time()
+        kind = key[0]
+        
+        if kind == "query":
+            query_id = key[1]
+            with self.state.query(query_id, writable=False) as query_info:
+                due = query_info.timestamp + query_info.timeout if query_info else None
+            
+            if due is None:
+                # Removed elsewhere; drop the wakeup signal a local stream may have left behind
+                self._notify_query(query_id, forget=True)
+            elif due > current_time:
+                self.expiry_index.schedule(key, due)
+            else:
+                logger.info(f"Cleaning up expired query: {query_id}")
+                self._remove_query(query_id)
+        
+        elif kind == "node":
+            node_id = key[1]
+            with self.state.nodes([node_id]) as nodes:
+                node_info = nodes.get(node_id)
+                if not node_info:
+                    return
+                due = node_info.last_seen + self.node_timeout
+                if due > current_time:
+                    self.expiry_index.schedule(key, due)
+                else:
+                    logger.info(f"Removing inactive node: {node_id}")
+                    del nodes[node_id]
+        
+        elif kind == "lease":
+            _, query_id, node_id = key
+            with self.state.query(query_id) as query_info:
+                if not query_info:
+                    return
+                expired = self._revoke_expired_leases(query_info, current_time, [node_id])
+                if not expired and node_id in _outstanding_nodes(query_info):
+                    # Renewed by a router process that doesn't share our index
+                    self.expiry_index.schedule(key, query_info.assignments[node_id].lease_expires)
+            self._release_expired_leases([(query_id, node_id) for node_id in expired])
+        
+        elif kind == "requeue":
+            self._requeue(key[1])
+    
+    def _generate_node_id(self) -> str:
+        """Generate unique node ID"""
+        return f"node_{uuid.uuid4().hex[:8]}"
+    
+    def _register_or_update_node(self, nodes: Dict[str, NodeInfo], node_id: str,
+                                 capabilities: Dict = None, info: Dict = None) -> NodeInfo:
+        """Register new node or update existing one in a state.nodes() registry"""
+        current_time = time.time()
+        
+        node_info = nodes.get(node_id)
+        if node_info is None:
+            node_id = _node_handle(node_id)
+            node_info = NodeInfo(
+                node_id=node_id,
+                registration_time=current_time,
+                last_seen=current_time,
+                capabilities=capabilities or {},
+                info=info or {}
+            )
+            nodes[node_id] = node_info
+            logger.info(f"New node registered: {node_id}")
+        else:
+            node_info.last_seen = current_time
+            if capabilities:
+                node_info.capabilities.update(capabilities)
+            if info:
+                node_info.info.update(info)
+        
+        self.expiry_index.schedule(("node", node_id), current_time + self.node_timeout)
+        return node_info
+    
+    def touch_node(self, node_id: str, capabilities: Dict = None, info: Dict = None):
+        """Register or refresh a node"""
+        with self.state.nodes([node_id]) as nodes:
+            self._register_or_update_node(nodes, node_id, capabilities, info)
+    
+    def set_scheduling_policy(self, name: str):
+        """Switch the scheduling policy by name (see SCHEDULING_POLICIES)"""
+        if name not in SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {name}")
+        with self._ranking_lock:
+            self.scheduling_policy = SCHEDULING_POLICIES[name]()
+            self._node_ranking_time = 0.0
+    
+    def query_signal(self, query_number: int) -> UpdateSignal:
+        """Process-local signal notified when a query gets responses or chunks, or is removed"""
+        with self._signals_lock:
+            signal = self._query_signals.get(query_number)
+            if signal is None:
+                signal = self._query_signals[query_number] = UpdateSignal()
+        
+        # Queries submitted through another router process are not indexed here yet
+        if ("query", query_number) not in self.expiry_index:
+            self.expiry_index.schedule(("query", query_number), time.time() + self.query_timeout)
+        return signal
+    
+    @contextmanager
+    def long_poll(self, node_id: str):
+        """Mark a node as parked on a long-poll for the block, making it a peer worth holding work for"""
+        with self._signals_lock:
+            self._long_polling[node_id] += 1
+        try:
+            yield
+        finally:
+            with self._signals_lock:
+                self._long_polling[node_id] -= 1
+                if not self._long_polling[node_id]:
+                    del self._long_polling[node_id]
+    
+    def _notify_query(self, query_number: int, forget: bool = False):
+        """Wake this process's waiters on a query, dropping its signal if forget"""
+        with self._signals_lock:
+            if forget:
+                signal = self._query_signals.pop(query_number, None)
+            else:
+                signal = self._query_signals.get(query_number)
+        if signal:
+            signal.notify()
+    
+    def _node_capacity(self, node_info: NodeInfo) -> int:
+        """Unanswered assignments a node may hold: its declared max_concurrent_queries or the default"""
+        declared = node_info.capabilities.get("max_concurrent_queries")
+        if isinstance(declared, int) and declared > 0:
+            return min(declared, self.max_node_capacity)
+        return self.max_queries_per_node
+    
+    def _expected_service_time(self, node_info: NodeInfo) -> float:
+        """Best guess of how long one generation takes on a node"""
+        if node_info.avg_response_latency > 0:
+            return node_info.avg_response_latency
+        if node_info.avg_tokens_per_second > 0:
+            return self.expected_response_tokens / node_info.avg_tokens_per_second
+        hardware_class = node_info.capabilities.get("hardware_class")
+        return self.hardware_service_time.get(hardware_class, self.default_service_time)
+    
+    def _answer_weight(self, node_info: Optional[NodeInfo]) -> float:
+        """A node's vote when answers are aggregated, from its track record
+        
+        1 for a newcomer or a reliable node, down to 0 for one whose answers
+        keep disagreeing. Capped at 1, so a node never carries a consensus alone.
+        """
+        return min(1.0, 2 * node_info.answer_quality) if node_info else 1.0
+    
+    def _aggregate_answers(self, query_info: QueryInfo):
+        """Regroup and rescore a query's answers (caller holds the query)"""
+        groups, support, best_response = self.answer_aggregator.aggregate(query_info.responses)
+        query_info.answer_groups = groups
+        query_info.group_support = support
+        query_info.best_response = best_response
+    
+    def _record_answer_quality(self, node_info: NodeInfo, agreed: bool):
+        """Fold whether the node's answer agreed with the query's best answer into its quality"""
+        alpha = self.quality_smoothing
+        node_info.answer_quality = alpha * (1.0 if agreed else 0.0) + (1 - alpha) * node_info.answer_quality
+    
+    def _record_node_performance(self, node_info: NodeInfo, latency: Optional[float], tokens_per_second: Optional[float]):
+        """Fold a new observation into the node's smoothed latency and throughput"""
+        alpha = self.stats_smoothing
+        if latency is not None and latency > 0:
+            node_info.avg_response_latency = (latency if node_info.avg_response_latency == 0
+                                              else alpha * latency + (1 - alpha) * node_info.avg_response_latency)
+        if isinstance(tokens_per_second, (int, float)) and tokens_per_second > 0:
+            node_info.avg_tokens_per_second = (tokens_per_second if node_info.avg_tokens_per_second == 0
+                                               else alpha * tokens_per_second + (1 - alpha) * node_info.avg_tokens_per_second)
+    
+    def _get_node_ranking(self, current_time: float) -> List:
+        """Live nodes sorted by policy cost, rebuilt at most every scheduler_refresh_interval"""
+        with self._ranking_lock:
+            if current_time - self._node_ranking_time >= self.scheduler_refresh_interval:
+                policy = self.scheduling_policy
+                with self.state.nodes(writable=False) as nodes:
+                    self._node_ranking = sorted(
+                        ((policy.cost(self, node_info), node_info)
+                         for node_info in nodes.values()
+                         if current_time - node_info.last_seen <= self.scheduler_live_window),
+                        key=lambda ranked: ranked[0]
+                    )
+                self._node_ranking_time = current_time
+            return self._node_ranking
+    
+    def _is_preferred_node(self, node_info: NodeInfo, query_info: QueryInfo, slots: int, current_time: float,
+                           reserved: int = 0) -> bool:
+        """Ask the scheduling policy whether this node should take one of the query's open slots
+        
+        Only peers parked on a long-poll here count as rivals: they are woken
+        by the submit and claim at once, so holding the query for them costs
+        next to nothing, while a peer that polls on a timer could leave it
+        waiting for the whole hold time. `reserved` is capacity the claim
+        pass set aside up front but has not used, which must not make the
+        node look busier than its rivals. Caller must hold the query.
+        """
+        # Never hold a query back forever waiting for a peer that may not poll
+        if current_time - query_info.timestamp >= self.scheduler_hold_time:
+            return True
+        
+        if reserved:
+            node_info = replace(node_info, active_assignments=node_info.active_assignments - reserved)
+        
+        def is_rival(rival: NodeInfo) -> bool:
+            return (rival.node_id in self._long_polling
+                    and rival.node_id != query_info.submitter_node_id
+                    and rival.node_id not in query_info.assignments
+                    and rival.active_assignments < self._node_capacity(rival)
+                    and _meets_requirements(rival.capabilities, query_info.requirements))
+        
+        ranking = self._get_node_ranking(current_time)
+        return self.scheduling_policy.allows(self, node_info, ranking, is_rival, slots)
+    
+    def _responses_needed(self, query_info: QueryInfo) -> int:
+        """How many more answers the query's completion criterion asks for (0 = complete)"""
+        received = len(query_info.responses)
+        
+        # Every slot is dispatched at once and the query completes as soon as two or more workers agree enough
+        if query_info.completion_mode == "consensus":
+            if query_info.best_response is not None:
+                best_group = query_info.answer_groups[query_info.best_response]
+                responders = {r.node_id for r, group in zip(query_info.responses, query_info.answer_groups)
+                              if group == best_group}
+                if len(responders) >= 2 and query_info.group_support[best_group] >= query_info.required_responses:
+                    return 0
+            return max(0, query_info.max_responses - received)
+        
+        if query_info.completion_mode == "quorum":
+            agreeing = Counter(_normalize_response(r.response) for r in query_info.responses)
+            best_agreement = max(agreeing.values(), default=0)
+            if best_agreement >= query_info.required_responses:
+                return 0
+            return max(0, min(query_info.required_responses - best_agreement,
+                              query_info.max_responses - received))
+        
+        return max(0, query_info.required_responses - received)
+    
+    def _dispatch_slots(self, query_info: QueryInfo, current_time: float):
+        """Return (open slots, overdue assignments) for a query
+        
+        Outstanding assignments past their deadline stop counting against the
+        slots, which is what lets a straggler's work be hedged onto another node.
+        """
+        outstanding = _outstanding_nodes(query_info)
+        on_time = sum(1 for node_id in outstanding
+                      if query_info.assignments[node_id].deadline > current_time)
+        return self._responses_needed(query_info) - on_time, len(outstanding) - on_time
+    
+    def _assignment_deadline(self, node_info: NodeInfo, query_info: QueryInfo, current_time: float) -> float:
+        """Time after which a node's assignment counts as straggling"""
+        allowance = max(self.min_assignment_deadline,
+                        self.hedge_deadline_factor * self._expected_service_time(node_info))
+        return min(current_time + allowance, query_info.timestamp + query_info.timeout)
+    
+    def _release_assignments(self, nodes: Dict[str, NodeInfo], node_ids, cancelled_query: Optional[int] = None):
+        """Decrement in-flight counters, optionally telling the nodes to abandon a query
+        
+        `nodes` is the registry from a state.nodes() block covering node_ids.
+        """
+        for node_id in node_ids:
+            node_info = nodes.get(node_id)
+            if not node_info:
+                continue
+            if node_info.active_assignments > 0:
+                node_info.active_assignments -= 1
+            if cancelled_query is not None:
+                node_info.cancelled_queries.add(cancelled_query)
+    
+    def _lease_expiry(self, node_info: NodeInfo, current_time: float) -> float:
+        """When a lease granted or renewed now runs out"""
+        lease = max(self.min_lease_time, self.lease_service_time_factor * self._expected_service_time(node_info))
+        
+        # Clients that have never heartbeated can't renew, so their lease covers the query's lifetime
+        if not node_info.last_heartbeat:
+            lease = max(lease, self.query_timeout)
+        return current_time + lease
+    
+    def _revive_lapsed_assignment(self, query_info: QueryInfo, node_id: str) -> bool:
+        """Make an expired assignment active again if nobody took its slot over (caller holds the query)
+        
+        A lapsed lease only reopens the slot; the node's work is only lost
+        once the query completes or another node is assigned after the
+        lease ran out. Returns True if the assignment was revived; the caller
+        must then re-reserve the node's capacity (see _reclaim_assignments).
+        """
+        assignment = query_info.assignments.get(node_id)
+        if assignment is None or assignment.state != "expired" or query_info.completed:
+            return False
+        
+        if any(other.assigned_at >= assignment.lease_expires
+               for other in query_info.assignments.values() if other is not assignment):
+            return False
+        
+        assignment.state = "active"
+        self.state.touch(query_info)
+        return True
+    
+    def _reclaim_assignments(self, nodes: Dict[str, NodeInfo], node_id: str, query_numbers: List[int]):
+        """Undo the release of revived assignments: count them again and withdraw their cancellation"""
+        node_info = nodes.get(node_id)
+        if not node_info:
+            return
+        for query_number in query_numbers:
+            node_info.active_assignments += 1
+            node_info.cancelled_queries.discard(query_number)
+    
+    def _revoke_expired_leases(self, query_info: QueryInfo, current_time: float, node_ids=None) -> List[str]:
+        """Mark outstanding assignments whose lease ran out as expired (caller holds the query)
+
+        Expired assignments stop counting against the query's slots, so the
+        next claim pass hands the work to another node.
+        """
+        expired = [node_id for node_id in _outstanding_nodes(query_info)
+                   if (node_ids is None or node_id in node_ids)
+                   and query_info.assignments[node_id].lease_expires <= current_time]
+        for node_id in expired:
+            query_info.assignments[node_id].state = "expired"
+        if expired:
+            self.state.touch(query_info)
+        return expired
+    
+    def _release_expired_leases(self, expired: List):
+        """Release the counters of revoked (query number, node ID) leases and wake idle workers"""
+        if not expired:
+            return
+        
+        with self.state.nodes([node_id for _, node_id in expired]) as nodes:
+            for query_id, node_id in expired:
+                logger.info(f"Lease of node {node_id} on query {query_id} expired, requeued")
+                self._release_assignments(nodes, [node_id], cancelled_query=query_id)
+        
+        for query_id in {query_id for query_id, _ in expired}:
+            self.state.requeue(query_id)
+        
+        self.leases_expired.inc(len(expired))
+        self.work_signal.notify()
+    
+    def _requeue(self, query_number: int):
+        """Offer a parked query to workers again and wake them if it was parked"""
+        if self.state.requeue(query_number):
+            self.work_signal.notify()
+    
+    def _park_until_deadline(self, query_info: QueryInfo, current_time: float):
+        """Schedule the requeue of a saturated query for when its first on-time assignment straggles"""
+        deadlines = [query_info.assignments[node_id].deadline for node_id in _outstanding_nodes(query_info)
+                     if query_info.assignments[node_id].deadline > current_time]
+        if deadlines:
+            self.expiry_index.schedule(("requeue", query_info.query_number), min(deadlines))
+    
+    def _expire_leases(self, query_number: int, node_ids=None):
+        """Revoke a query's expired leases, optionally only those of node_ids"""
+        with self.state.query(query_number) as query_info:
+            expired = self._revoke_expired_leases(query_info, time.time(), node_ids) if query_info else []
+        self._release_expired_leases([(query_number, node_id) for node_id in expired])
+    
+    def _on_query_removed(self, query_info: QueryInfo) -> List[str]:
+        """Free a removed query's spilled answers, returning its outstanding assignments"""
+        self.response_store.discard(query_info.responses)
+        return _outstanding_nodes(query_info)
+    
+    def _remove_query(self, query_id: int) -> bool:
+        """Drop a query, its queue slot and its workers' in-flight assignments"""
+        outstanding = self.state.remove_query(query_id, self._on_query_removed)
+        if outstanding is None:
+            return False
+        
+        self._notify_query(query_id, forget=True)
+        self.response_cache.discard_inflight(query_id)
+        self.expiry_index.cancel(("query", query_id))
+        
+        if outstanding:
+            with self.state.nodes(outstanding) as nodes:
+                self._release_assignments(nodes, outstanding, cancelled_query=query_id)
+        
+        return True
+    
+    def claim_queries(self, node_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Assign up to `limit` (default max_queries_per_request) pending queries to a polling node
+        
+        Nodes already holding their capacity in unanswered assignments get
+        nothing until they respond, so overloaded devices stop receiving work.
+        Queries whose requirements the node does not meet are skipped, and the
+        scheduling policy may hold a fresh query back for a faster peer.
+        """
+        node_id = _node_handle(node_id)
+        available_queries = []
+        finished_queries = []
+        saturated_queries = []
+        expired_queries = []
+        expired_leases = []
+        
+        # Reserve capacity up front so concurrent polls by one node can't overshoot the cap
+        with self.state.nodes([node_id]) as nodes:
+            node_info = self._register_or_update_node(nodes, node_id)
+            capacity = min(limit or self.max_queries_per_request,
+                           self._node_capacity(node_info) - node_info.active_assignments)
+            if capacity <= 0:
+                return available_queries
+            node_info.active_assignments += capacity
+        
+        current_time = time.time()
+        pass_started = time.perf_counter()
+        
+        try:
+            with self.state.dispatch() as queue:
+                for entry in queue.eligible_for(node_id):
+                    query_id = entry.query_number
+                    
+                    # A query being answered or ended right now is skipped rather than waited on;
+                    # most are only looked at, so they are opened read-only and touched when assigned
+                    with self.state.query(query_id, blocking=False, writable=False) as query_info:
+                        if query_info is None:
+                            continue
+                        
+                        # Skip if query has met its completion criterion
+                        if query_info.completed:
+                            finished_queries.append(query_id)
+                            continue
+                        
+                        # Check if query is expired
+                        if current_time - query_info.timestamp > query_info.timeout:
+                            expired_queries.append(query_id)
+                            continue
+                        
+                        # Coalesced submitters must not answer their own question either
+                        if node_id in query_info.followers:
+                            queue.exclude(entry, node_id)
+                            continue
+                        
+                        if not _meets_requirements(node_info.capabilities, query_info.requirements):
+                            continue
+                        
+                        # Reopen slots held by workers that stopped reporting back
+                        expired_leases.extend((query_id, expired_node)
+                                              for expired_node in self._revoke_expired_leases(query_info, current_time))
+                        
+                        # Park it if enough on-time workers are already on it; leases, deadlines and answers requeue it
+                        slots, overdue = self._dispatch_slots(query_info, current_time)
+                        if slots <= 0:
+                            saturated_queries.append(query_id)
+                            self._park_until_deadline(query_info, current_time)
+                            continue
+                        
+                        if not self._is_preferred_node(node_info, query_info, slots, current_time,
+                                                       capacity - len(available_queries)):
+                            continue
+                        
+                        # Assign node to query
+                        deadline = self._assignment_deadline(node_info, query_info, current_time)
+                        lease_expires = self._lease_expiry(node_info, current_time)
+                        query_info.assignments[node_id] = Assignment(current_time, deadline, lease_expires)
+                        self.state.touch(query_info)
+                        self.expiry_index.schedule(("lease", query_id, node_id), lease_expires)
+                        queue.exclude(entry, node_id)
+                        queue.charge(entry)
+                        if overdue:
+                            query_info.hedged_assignments += 1
+                            logger.info(f"Hedging query {query_id} to node {node_id} ({overdue} straggling)")
+                        if len(query_info.assignments) == 1:
+                            self.queue_wait.observe(current_time - query_info.timestamp)
+                        self.assignments_made.inc(kind="hedged" if overdue else "regular")
+                        
+                        available_queries.append({
+                            "query_number": query_info.query_number,
+                            "query": query_info.query,
+                            "timestamp": query_info.timestamp,
+                            "metadata": {
+                                "max_responses": query_info.max_responses,
+                                "current_responses": len(query_info.responses),
+                                "timeout": query_info.timeout,
+                                "deadline": deadline,
+                                "lease_expires": lease_expires,
+                                "completion_mode": query_info.completion_mode,
+                                "priority": query_info.priority
+                            }
+                        })
+                    
+                    # Limit queries per request and per node
+                    if len(available_queries) >= capacity:
+                        break
+                
+                for query_id in finished_queries:
+                    queue.discard_locked(query_id)
+                for query_id in saturated_queries:
+                    queue.park_locked(query_id)
+            
+            self.claim_duration.observe(time.perf_counter() - pass_started)
+        finally:
+            # Give back the part of the reservation that wasn't used
+            with self.state.nodes([node_id]) as nodes:
+                node_info = nodes.get(node_id)
+                if node_info:
+                    node_info.active_assignments -= capacity - len(available_queries)
+        
+        self._release_expired_leases(expired_leases)
+        
+        for query_id in expired_queries:
+            self._remove_query(query_id)
+        
+        return available_queries
+    
+    def _share_weight(self, node_info: NodeInfo) -> float:
+        """Fair-queuing weight of a submitter: 1, plus credit for answers it gave others"""
+        return 1.0 + min(self.max_contributor_bonus, node_info.responses_provided / self.contributor_credit_step)
+    
+    def _is_submitter(self, query_info: QueryInfo, node_id: str) -> bool:
+        """Whether node_id submitted the query or an identical one coalesced onto it"""
+        return node_id == query_info.submitter_node_id or node_id in query_info.followers
+    
+    def _join_inflight_query(self, node_id: str, cache_key: str, query_model: QueryModel,
+                             required_responses: int) -> Optional[QueryInfo]:
+        """Add node_id as a follower of an identical query still being dispatched
+        
+        A node assigned to that query (working on it or done) gets a fresh
+        dispatch instead: as a follower its own answer would be refused.
+        """
+        query_number = self.response_cache.find_inflight(cache_key)
+        if query_number is None:
+            return None
+        
+        with self.state.query(query_number) as query_info:
+            if (not query_info or query_info.completed
+                    or query_info.cache_key != cache_key
+                    or query_info.requirements != query_model.requirements
+                    or query_info.completion_mode != query_model.completion_mode
+                    or query_info.priority != query_model.priority
+                    or query_info.required_responses != required_responses
+                    or node_id in query_info.assignments
+                    or any(r.node_id == node_id for r in query_info.responses)):
+                return None
+            
+            if not self._is_submitter(query_info, node_id):
+                query_info.followers.append(_node_handle(node_id))
+                self.state.touch(query_info)
+            return query_info
+    
+    def _store_query(self, query_info: QueryInfo, dispatch: bool = True):
+        """Add a query to the state, index its expiry and evict the oldest past max_memory_size
+        
+        Only completed queries are evicted; accepted work that is still
+        waiting for answers is bounded by admission control and its timeout.
+        """
+        self.state.add_query(query_info, dispatch)
+        self.expiry_index.schedule(("query", query_info.query_number), query_info.timestamp + query_info.timeout)
+        
+        # Limit memory usage
+        excess = self.state.query_count() - self.max_memory_size
+        if excess > 0:
+            # Unfinished queries are at most the queue plus what workers hold, so look that far past the excess
+            for query_id in self.state.oldest_query_numbers(excess + self.max_pending_queries):
+                with self.state.query(query_id, blocking=False, writable=False) as candidate:
+                    evictable = candidate is not None and candidate.completed
+                if evictable and self._remove_query(query_id):
+                    excess -= 1
+                    if excess <= 0:
+                        break
+    
+    def check_submit_rate(self, rate_key: str):
+        """Raise 429 if this submitter has used up its token bucket"""
+        retry_after = self.submit_limiter.acquire(rate_key)
+        if retry_after > 0:
+            self.queries_rejected.inc(reason="rate_limited")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many queries from this node",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+    
+    def drain_rate(self) -> float:
+        """Queries per second the fleet completes: measured, or estimated from live worker capacity"""
+        measured = self.drain_meter.rate()
+        if measured > 0:
+            return measured
+        
+        # Nothing completed lately; assume every live worker runs at its declared capacity
+        ranking = self._get_node_ranking(time.time())
+        assignments_per_second = sum(
+            self._node_capacity(node_info) / self._expected_service_time(node_info)
+            for _, node_info in ranking
+            if node_info.responses_provided > 0 or node_info.active_assignments > 0
+        )
+        return assignments_per_second / self.max_responses_per_query
+    
+    def estimate_wait_time(self, queue_position: int) -> float:
+        """Seconds until a query at this queue position is answered"""
+        rate = self.drain_rate()
+        if rate <= 0:
+            return float(queue_position * self.default_service_time)
+        return round(queue_position / rate, 1)
+    
+    def submit_query(self, node_id: str, query_model: QueryModel, required_responses: int):
+        """Create a query and queue it for dispatch, returning (QueryInfo, status)
+
+        Unless query_model.cache is off, a query whose answers are cached is
+        created already complete ("cached"), and one identical to a query
+        still in flight joins that query instead ("coalesced").
+        """
+        with self.state.nodes([node_id]) as nodes:
+            node_info = self._register_or_update_node(nodes, node_id)
+            node_info.queries_submitted += 1
+            share_weight = self._share_weight(node_info)
+        
+        cache_key = _response_cache_key(query_model.query, query_model.requirements) if query_model.cache else None
+        cached_responses = None
+        
+        if cache_key:
+            query_info = self._join_inflight_query(node_id, cache_key, query_model, required_responses)
+            if query_info:
+                self.response_cache.count_coalesced()
+                logger.info(f"Query from node {node_id} coalesced onto query {query_info.query_number}")
+                self.queries_submitted.inc(status="coalesced")
+                return query_info, "coalesced"
+            
+            cached_responses = self.response_cache.get(cache_key, query_model.completion_mode, required_responses)
+        
+        # Only work that needs dispatching counts against the queue depth
+        if cached_responses is None:
+            pending = self.state.pending_count()
+            if pending >= self.max_pending_queries:
+                self.queries_rejected.inc(reason="queue_full")
+                retry_after = self.estimate_wait_time(pending - self.max_pending_queries + 1)
+                raise HTTPException(
+                    status_code=429,
+                    detail="Routing queue is full",
+                    headers={"Retry-After": str(max(1, min(math.ceil(retry_after), self.query_timeout)))}
+                )
+        
+        current_time = time.time()
+        query_info = QueryInfo(
+            query_number=self.state.next_query_number(),
+            query=query_model.query,
+            submitter_node_id=_node_handle(node_id),
+            timestamp=current_time,
+            requirements=query_model.requirements,
+            completion_mode=query_model.completion_mode,
+            required_responses=required_responses,
+            max_responses=self.max_responses_per_query,
+            cache_key=cache_key,
+            priority=query_model.priority,
+            share_weight=share_weight
+        )
+        
+        if cached_responses is not None:
+            query_info.responses = [StoredResponse("cache", self.response_store.pack(response), current_time)
+                                    for response in cached_responses]
+            self._aggregate_answers(query_info)
+            query_info.completed = True
+            self._store_query(query_info, dispatch=False)
+            self.queries_submitted.inc(status="cached")
+            return query_info, "cached"
+        
+        self._store_query(query_info)
+        if cache_key:
+            self.response_cache.add_inflight(cache_key, query_info.query_number)
+        
+        self.work_signal.notify()
+        self.queries_submitted.inc(status="submitted")
+        return query_info, "submitted"
+    
+    def check_submitter(self, query_number: int, node_id: Optional[str]) -> bool:
+        """False if the query does not exist, 403 if node_id is not its submitter"""
+        with self.state.query(query_number, writable=False) as query_info:
+            if not query_info:
+                return False
+            
+            if node_id and not self._is_submitter(query_info, node_id):
+                logger.warning(f"Unauthorized access: Node {node_id} tried to access query {query_number} from {query_info.submitter_node_id}")
+                raise HTTPException(status_code=403, detail="Not authorized to access this query")
+            
+            return True
+    
+    def get_responses(self, query_number: int, node_id: Optional[str],
+                      known_count: Optional[int] = None) -> Optional[List[str]]:
+        """Responses received so far; only the submitter may read them
+        
+        Answers are only ever appended, so a caller that already has
+        known_count of them gets None instead of the same list again.
+        """
+        with self.state.query(query_number, writable=False) as query_info:
+            if not query_info:
+                return [] if known_count != 0 else None
+            
+            # Only allow submitter to get responses
+            if node_id and not self._is_submitter(query_info, node_id):
+                logger.warning(f"Unauthorized access: Node {node_id} tried to access query {query_number} from {query_info.submitter_node_id}")
+                raise HTTPException(status_code=403, detail="Not authorized to access this query")
+            
+            if known_count == len(query_info.responses):
+                return None
+            return [r.response for r in query_info.responses]
+    
+    def get_best_response(self, query_number: int, node_id: Optional[str]) -> Optional[Dict]:
+        """The aggregated best answer and the distinct answers behind it, None if the query does not exist
+        
+        Aggregation happens as answers arrive, so this only reads its result.
+        """
+        with self.state.query(query_number, writable=False) as query_info:
+            if not query_info:
+                return None
+            
+            if node_id and not self._is_submitter(query_info, node_id):
+                logger.warning(f"Unauthorized access: Node {node_id} tried to access query {query_number} from {query_info.submitter_node_id}")
+                raise HTTPException(status_code=403, detail="Not authorized to access this query")
+            
+            # One entry per group of near-duplicates, best supported first
+            representatives = {}
+            for index, group in enumerate(query_info.answer_groups):
+                representatives.setdefault(group, index)
+            best_group = query_info.answer_groups[query_info.best_response] if query_info.best_response is not None else None
+            total_weight = sum(r.weight for r in query_info.responses)
+            
+            answers = [
+                {
+                    "answer": query_info.responses[query_info.best_response if group == best_group else index].response,
+                    "support": support,
+                    "responses": query_info.answer_groups.count(group)
+                }
+                for group, (support, index) in enumerate(zip(query_info.group_support, representatives.values()))
+            ]
+            answers.sort(key=lambda answer: -answer["support"])
+            
+            return {
+                "query_number": query_number,
+                "answer": answers[0]["answer"] if answers else None,
+                "agreement": round(answers[0]["support"] / total_weight, 4) if answers and total_weight else 0.0,
+                "total_responses": len(query_info.responses),
+                "answers": answers,
+                "completed": query_info.completed,
+                "completion_mode": query_info.completion_mode
+            }
+    
+    def read_stream_updates(self, query_number: int, start_index: int) -> Optional[Dict]:
+        """Responses from start_index on plus buffered chunks, which are drained
+        
+        Returns None once the query has been ended or expired.
+        """
+        with self.state.query(query_number) as query_info:
+            if not query_info:
+                return None
+            
+            new_responses = []
+            for r in query_info.responses[start_index:]:
+                stream = query_info.partial_streams.get(r.node_id)
+                new_responses.append((r.response, stream.stream_id if stream else None))
+            
+            # Drain buffered chunks, this is what relieves backpressure on the workers
+            new_chunks = []
+            for stream in query_info.partial_streams.values():
+                if stream.chunks:
+                    new_chunks.append((stream.stream_id, "".join(stream.chunks)))
+                    stream.chunks.clear()
+                    stream.buffered_chars = 0
+            if new_chunks:
+                self.state.touch(query_info, durable=False)
+            
+            return {
+                "responses": new_responses,
+                "chunks": new_chunks,
+                "completed": query_info.completed,
+                "completion_mode": query_info.completion_mode,
+                "best_response": query_info.best_response
+            }
+    
+    def submit_response(self, node_id: str, data: ResponseModel) -> Dict:
+        """Record a worker's answer and complete the query once its criterion is met"""
+        query_number = data.query_number
+        current_time = time.time()
+        cancelled_nodes = []
+        agreement = []
+        revived = []
+        
+        self._expire_leases(query_number, [node_id])
+        
+        # Read before the query lock; the node's vote is fixed when its answer arrives
+        with self.state.nodes([node_id], writable=False) as nodes:
+            weight = self._answer_weight(nodes.get(node_id))
+        
+        with self.state.query(query_number) as query_info:
+            if not query_info:
+                raise HTTPException(status_code=404, detail="Query not found")
+            
+            # Prevent self-response
+            if self._is_submitter(query_info, node_id):
+                logger.warning(f"Self-response blocked: Node {node_id} query {query_number}")
+                raise HTTPException(status_code=400, detail="Cannot respond to your own query")
+            
+            # Check if node was assigned to this query
+            assignment = query_info.assignments.get(node_id)
+            if assignment is None:
+                logger.warning(f"Unassigned response: Node {node_id} query {query_number}")
+                raise HTTPException(status_code=400, detail="Node not assigned to this query")
+            
+            # Nobody will read answers to a completed query
+            if assignment.state == "cancelled":
+                raise HTTPException(status_code=409, detail="Query already completed, assignment cancelled")
+            
+            # A late answer still counts unless the slot was handed to another node
+            if assignment.state == "expired":
+                if not self._revive_lapsed_assignment(query_info, node_id):
+                    raise HTTPException(status_code=409, detail="Assignment lease expired")
+                revived.append(query_number)
+            
+            # Check if already responded
+            if assignment.state == "answered":
+                logger.warning(f"Duplicate response: Node {node_id} query {query_number}")
+                raise HTTPException(status_code=400, detail="Already responded to this query")
+            
+            # Add response
+            node_id = _node_handle(node_id)
+            self.state.touch(query_info)
+            assignment.state = "answered"
+            body = self.response_store.pack(data.response)
+            query_info.responses.append(StoredResponse(node_id, body, current_time, weight))
+            self._aggregate_answers(query_info)
+            
+            # The full answer supersedes whatever partial output is still buffered
+            stream = query_info.partial_streams.get(node_id)
+            if stream:
+                stream.chunks.clear()
+                stream.buffered_chars = 0
+                stream.finished = True
+            
+            # Stop dispatching and cancel stragglers once the completion criterion is met
+            completed_now = not query_info.completed and self._responses_needed(query_info) <= 0
+            if completed_now:
+                query_info.completed = True
+                cancelled_nodes = _outstanding_nodes(query_info)
+                for cancelled_node in cancelled_nodes:
+                    query_info.assignments[cancelled_node].state = "cancelled"
+                
+                # With two or more answers, agreeing with the best one is evidence of a node's quality
+                if len(query_info.responses) >= 2:
+                    best_group = query_info.answer_groups[query_info.best_response]
+                    agreement = [(r.node_id, group == best_group)
+                                 for r, group in zip(query_info.responses, query_info.answer_groups)
+                                 if r.node_id != "cache"]
+            
+            assigned_at = assignment.assigned_at
+            total_responses = len(query_info.responses)
+            query_completed = query_info.completed
+            cache_key = query_info.cache_key
+            answers = [r.response for r in query_info.responses]
+            submitted_at = query_info.timestamp
+            completed_early = (completed_now and query_info.completion_mode == "consensus"
+                               and total_responses < query_info.max_responses)
+            
+            # An answer that disagrees can leave the query wanting more workers than it has
+            reopened = not query_completed and self._dispatch_slots(query_info, current_time)[0] > 0
+        
+        self._notify_query(query_number)
+        if reopened:
+            self._requeue(query_number)
+        
+        self.responses_received.inc()
+        self.response_bytes.inc(len(data.response.encode("utf-8")), stage="received")
+        self.response_bytes.inc(_stored_size(body), stage="stored")
+        if total_responses == 1:
+            self.time_to_first_response.observe(current_time - submitted_at)
+        
+        if completed_now:
+            self.drain_meter.record()
+            self.completion_time.observe(current_time - submitted_at)
+            if completed_early:
+                self.early_completions.inc()
+            self.state.dequeue(query_number)
+            self.response_cache.discard_inflight(query_number)
+            if cache_key:
+                self.response_cache.put(cache_key, query_info.completion_mode, query_info.required_responses, answers)
+            if cancelled_nodes:
+                logger.info(f"Query {query_number} complete, cancelled {len(cancelled_nodes)} outstanding assignments")
+        
+        # Update node stats
+        with self.state.nodes([node_id] + cancelled_nodes + [responder for responder, _ in agreement]) as nodes:
+            self._reclaim_assignments(nodes, node_id, revived)
+            node_info = nodes.get(node_id)
+            if node_info:
+                node_info.responses_provided += 1
+                self._record_node_performance(
+                    node_info,
+                    current_time - assigned_at,
+                    data.metadata.get("tokens_per_second")
+                )
+            self._release_assignments(nodes, [node_id])
+            self._release_assignments(nodes, cancelled_nodes, cancelled_query=query_number)
+            for responder, agreed in agreement:
+                if responder in nodes:
+                    self._record_answer_quality(nodes[responder], agreed)
+        
+        logger.info(f"Response added: query {query_number} by node {node_id}")
+        
+        return {
+            "message": "Response received successfully",
+            "query_number": query_number,
+            "node_id": node_id,
+            "total_responses": total_responses,
+            "query_completed": query_completed
+        }
+    
+    def submit_response_chunk(self, node_id: str, data: ResponseChunkModel) -> Dict:
+        """Buffer a piece of a worker's in-progress answer for the submitter's stream"""
+        query_number = data.query_number
+        revived = []
+        
+        self._expire_leases(query_number, [node_id])
+        
+        with self.state.query(query_number) as query_info:
+            if not query_info:
+                raise HTTPException(status_code=404, detail="Query not found")
+            
+            assignment = query_info.assignments.get(node_id)
+            if assignment is None:
+                logger.warning(f"Unassigned chunk: Node {node_id} query {query_number}")
+                raise HTTPException(status_code=400, detail="Node not assigned to this query")
+            
+            # Tells a streaming worker to stop generating
+            if assignment.state == "cancelled":
+                raise HTTPException(status_code=409, detail="Query already completed, assignment cancelled")
+            
+            if assignment.state == "expired":
+                if not self._revive_lapsed_assignment(query_info, node_id):
+                    raise HTTPException(status_code=409, detail="Assignment lease expired")
+                revived.append(query_number)
+            
+            stream = query_info.partial_streams.get(node_id)
+            if stream is None:
+                if not query_info.partial_streams and not query_info.responses:
+                    self.time_to_first_chunk.observe(time.time() - query_info.timestamp)
+                stream = PartialStream(stream_id=len(query_info.partial_streams))
+                query_info.partial_streams[_node_handle(node_id)] = stream
+            
+            if stream.finished:
+                raise HTTPException(status_code=400, detail="Already responded to this query")
+            
+            # Drop retransmissions of chunks we already have
+            if data.sequence is not None and data.sequence < stream.next_sequence:
+                return {
+                    "accepted": True,
+                    "duplicate": True,
+                    "query_number": query_number,
+                    "buffered_chars": stream.buffered_chars
+                }
+            
+            # Backpressure: the submitter is not draining this stream fast enough
+            if stream.buffered_chars + len(data.chunk) > self.max_stream_buffer_chars:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Stream buffer full",
+                    headers={"Retry-After": "1"}
+                )
+            
+            self.state.touch(query_info, durable=False)
+            stream.chunks.append(data.chunk)
+            stream.buffered_chars += len(data.chunk)
+            stream.next_sequence = (data.sequence if data.sequence is not None else stream.next_sequence) + 1
+            buffered_chars = stream.buffered_chars
+            
+            # Visible progress keeps the assignment alive like a heartbeat; renewing only once
+            # half the lease is used up bounds the journal writes to a few per lease, not one per chunk
+            current_time = time.time()
+            if assignment.lease_expires - current_time < self.min_lease_time / 2:
+                assignment.lease_expires = current_time + self.min_lease_time
+                self.state.touch(query_info)
+                self.expiry_index.schedule(("lease", query_number, node_id), assignment.lease_expires)
+        
+        if revived:
+            with self.state.nodes([node_id]) as nodes:
+                self._reclaim_assignments(nodes, node_id, revived)
+        
+        self._notify_query(query_number)
+        
+        return {
+            "accepted": True,
+            "query_number": query_number,
+            "buffered_chars": buffered_chars
+        }
+    
+    def end_query(self, query_number: int, node_id: Optional[str]) -> bool:
+        """Remove a query on behalf of its submitter, False if it no longer exists
+
+        A query shared by coalesced submitters stays until the last one ends it.
+        """
+        with self.state.query(query_number) as query_info:
+            if not query_info:
+                return False
+            
+            # Only allow submitter to end the query
+            if node_id and not self._is_submitter(query_info, node_id):
+                raise HTTPException(status_code=403, detail="Not authorized to end this query")
+            
+            if node_id and query_info.followers:
+                self.state.touch(query_info)
+                if node_id in query_info.followers:
+                    query_info.followers.remove(node_id)
+                else:
+                    query_info.submitter_node_id = query_info.followers.pop(0)
+                return True
+        
+        # Remove query, its queue slot and outstanding assignments
+        return self._remove_query(query_number)
+    
+    def renew_leases(self, node_id: str, query_numbers: List[int]) -> Dict:
+        """Extend a node's leases on the queries it is still working on
+
+        Returns the new expiry per renewed query, and the queries the node
+        should drop because they are gone, completed or their slot was handed
+        to another node after the lease ran out.
+        """
+        with self.state.nodes([node_id]) as nodes:
+            node_info = self._register_or_update_node(nodes, node_id)
+            if query_numbers:
+                node_info.last_heartbeat = time.time()
+        
+        renewed = []
+        lost = []
+        revived = []
+        
+        for query_number in query_numbers:
+            self._expire_leases(query_number, [node_id])
+            
+            with self.state.query(query_number) as query_info:
+                if query_info and self._revive_lapsed_assignment(query_info, node_id):
+                    revived.append(query_number)
+                
+                if not query_info or node_id not in _outstanding_nodes(query_info):
+                    lost.append(query_number)
+                    continue
+                
+                assignment = query_info.assignments[node_id]
+                lease_expires = max(assignment.lease_expires, self._lease_expiry(node_info, time.time()))
+                assignment.lease_expires = lease_expires
+                self.state.touch(query_info)
+                self.expiry_index.schedule(("lease", query_number, node_id), lease_expires)
+                renewed.append({"query_number": query_number, "lease_expires": lease_expires})
+        
+        if revived:
+            with self.state.nodes([node_id]) as nodes:
+                self._reclaim_assignments(nodes, node_id, revived)
+        
+        return {"renewed": renewed, "lost": lost}
+    
+    def submit_batch(self, node_id: str, responses: List[ResponseModel], chunks: List[ResponseChunkModel],
+                     heartbeat: List[int] = None) -> Dict:
+        """Apply many chunk and response submissions and lease renewals, reporting each item's outcome"""
+        leases = self.renew_leases(node_id, heartbeat or [])
+        
+        def apply(submit, item) -> Dict:
+            try:
+                return dict(submit(node_id, item), status_code=200)
+            except HTTPException as e:
+                return {"query_number": item.query_number, "status_code": e.status_code, "detail": e.detail}
         
-        if node_id not in self.nodes:
-            self.nodes[node_id] = NodeInfo(
-                node_id=node_id,
-                registration_time=current_time,
-                last_seen=current_time,
-                capabilities=capabilities or {},
-                info=info or {}
-            )
-            logger.info(f"New node registered: {node_id}")
-        else:
-            self.nodes[node_id].last_seen = current_time
-            if capabilities:
-                self.nodes[node_id].capabilities.update(capabilities)
-            if info:
-                self.nodes[node_id].info.update(info)
+        return {
+            "leases": leases,
+            "chunks": [apply(self.submit_response_chunk, chunk) for chunk in chunks],
+            "responses": [apply(self.submit_response, response) for response in responses]
+        }
+    
+    def pop_cancelled_assignments(self, node_id: str) -> List[int]:
+        """Hand out (once) the query numbers a node should stop working on"""
+        with self.state.nodes([node_id]) as nodes:
+            node_info = nodes.get(node_id)
+            if not node_info or not node_info.cancelled_queries:
+                return []
+            cancelled = sorted(node_info.cancelled_queries)
+            node_info.cancelled_queries.clear()
+            return cancelled
     
     def _get_available_nodes_for_query(self, submitter_node_id: str, max_nodes: int = None) -> List[str]:
         """Get list of nodes that can process the query (excluding submitter)"""
@@ -160,28 +3294,86 @@ class DistributedRoutingServer:
         available_nodes = []
         current_time = time.time()
         
-        for node_id, node_info in self.nodes.items():
-            # Skip submitter node
-            if node_id == submitter_node_id:
-                continue
-            
-            # Skip inactive nodes
-            if current_time - node_info.last_seen > self.node_timeout:
-                continue
-            
-            # Check if node is not overloaded
-            active_queries = sum(1 for q in self.queries.values() 
-                               if node_id in q.assigned_nodes)
-            if active_queries < self.max_queries_per_node:
-                available_nodes.append(node_id)
+        with self.state.nodes(writable=False) as nodes:
+            for node_id, node_info in nodes.items():
+                # Skip submitter node
+                if node_id == submitter_node_id:
+                    continue
+                
+                # Skip inactive nodes
+                if current_time - node_info.last_seen > self.node_timeout:
+                    continue
+                
+                # Check if node is not overloaded
+                if node_info.active_assignments < self._node_capacity(node_info):
+                    available_nodes.append(node_id)
         
         # Return limited number of nodes
         return available_nodes[:max_nodes]
 
-# Global server instance
-server = DistributedRoutingServer()
+# Global server instance; ROUTING_STATE_BACKEND=sqlite shares state between router processes,
+# ROUTING_STATE_BACKEND=journal keeps in-memory state across restarts
+server = DistributedRoutingServer(create_state_backend(
+    os.environ.get("ROUTING_STATE_BACKEND", "memory"),
+    os.environ.get("ROUTING_STATE_PATH")
+), spill_directory=os.environ.get("ROUTING_SPILL_PATH"))
 app = fastapi.FastAPI(title="Enhanced Distributed LLM Routing Server", version="2.0.0")
 
+class RequestDecompressionMiddleware:
+    """Inflate request bodies sent with Content-Encoding: gzip or deflate
+    
+    Lets workers upload long answers compressed. The inflated size is capped
+    at max_size so a small compressed body can't expand without bound.
+    """
+    
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        encoding = dict(scope["headers"]).get(b"content-encoding", b"identity").strip().lower()
+        if encoding == b"identity":
+            return await self.app(scope, receive, send)
+        if encoding not in (b"gzip", b"deflate"):
+            return await JSONResponse({"detail": "Unsupported Content-Encoding"}, status_code=415)(scope, receive, send)
+        
+        compressed = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            compressed.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        
+        data = b"".join(compressed)
+        
+        # "deflate" should be a zlib stream, but some clients send raw deflate
+        wbits = 32 + zlib.MAX_WBITS if encoding == b"gzip" or data[:1] == b"\x78" else -zlib.MAX_WBITS
+        try:
+            body = zlib.decompressobj(wbits).decompress(data, self.max_size + 1)
+        except zlib.error:
+            return await JSONResponse({"detail": "Malformed compressed body"}, status_code=400)(scope, receive, send)
+        if len(body) > self.max_size:
+            return await JSONResponse({"detail": "Request body too large"}, status_code=413)(scope, receive, send)
+        
+        headers = [(name, value) for name, value in scope["headers"]
+                   if name not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(body)).encode()))
+        delivered = False
+        
+        async def inflated_receive():
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        
+        await self.app(dict(scope, headers=headers), inflated_receive, send)
+
 @app.middleware("http")
 async def add_node_id_header(request, call_next):
     """Middleware to handle node identification"""
@@ -198,6 +3390,18 @@ async def add_node_id_header(request, call_next):
         logger.error(f"Middleware error: {e}")
         raise
 
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    """Time every request per endpoint for GET /metrics"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    
+    # The route template, not the raw path, so query numbers don't create new series
+    route = request.scope.get("route")
+    server.request_duration.observe(time.perf_counter() - started, method=request.method,
+                                    endpoint=route.path if route else "unmatched")
+    return response
+
 @app.get("/")
 def root():
     return {
@@ -209,7 +3413,23 @@ def root():
             "Self-query prevention", 
             "Automatic cleanup",
             "Query timeout handling",
-            "Load balancing"
+            "Load balancing",
+            "Long-polling work dispatch",
+            "Server-Sent Events response delivery",
+            "Token streaming relay",
+            "Capability and throughput-aware scheduling",
+            "Hedged dispatch with early completion",
+            "Shared state for multi-process routing",
+            "Response cache and duplicate query coalescing",
+            "Batched worker protocol",
+            "Lease-based assignments with automatic requeue",
+            "Write-ahead journal with snapshots for restart recovery",
+            "Admission control with per-node rate limits",
+            "Priority classes and fair queuing across submitters",
+            "Prometheus metrics and latency histograms",
+            "Paginated and incremental status listings",
+            "Compressed transfers and compressed-at-rest answers",
+            "Answer aggregation with weighted consensus"
         ]
     }
 
@@ -220,89 +3440,100 @@ def register_node(
 ) -> Dict:
     """Register a new node or update existing node information"""
     try:
-        with server.lock:
-            # Generate new node ID if not provided
-            if not x_node_id:
-                node_id = server._generate_node_id()
-            else:
-                node_id = x_node_id
-            
-            server._register_or_update_node(
-                node_id, 
-                registration.node_capabilities,
-                registration.node_info
-            )
-            
-            logger.info(f"Node registered/updated: {node_id}")
-            
-            return {
-                "node_id": node_id,
-                "status": "registered",
-                "message": "Node registered successfully"
-            }
+        # Generate new node ID if not provided
+        if not x_node_id:
+            node_id = server._generate_node_id()
+        else:
+            node_id = x_node_id
+        
+        server.touch_node(
+            node_id, 
+            registration.node_capabilities,
+            registration.node_info
+        )
+        
+        logger.info(f"Node registered/updated: {node_id}")
+        
+        return {
+            "node_id": node_id,
+            "status": "registered",
+            "message": "Node registered successfully"
+        }
     
     except Exception as e:
         logger.error(f"Error in register_node: {str(e)}")
         raise HTTPException(status_code=500, detail="Error registering node")
 
-@app.get("/request")
-def get_requests(x_node_id: Optional[str] = Header(None)) -> List[Dict]:
-    """Get pending queries for a specific node to process"""
+async def _wait_for_disconnect(request: Request):
+    """Return once the client has gone away"""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def _claim_with_wait(node_id: str, wait: float, limit: Optional[int] = None,
+                           request: Optional[Request] = None) -> List[Dict]:
+    """Claim queries for a node, parking up to `wait` seconds while there are none
+    
+    With the request given, nothing is claimed once its client has
+    disconnected, and the park ends as soon as it does, so a dead poll
+    neither takes work nor counts as a peer worth holding work for.
+    """
+    deadline = time.time() + min(wait, server.max_long_poll_wait)
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(request)) if request and wait > 0 else None
+    
     try:
-        if not x_node_id:
-            return []
-        
-        with server.lock:
-            # Update node last seen
-            server._register_or_update_node(x_node_id)
-            
-            available_queries = []
-            
-            for query_id in server.pending_queries[:]:  # Copy list to avoid modification during iteration
-                query_info = server.queries.get(query_id)
-                if not query_info:
-                    server.pending_queries.remove(query_id)
-                    continue
-                
-                # Skip if this node submitted the query
-                if query_info.submitter_node_id == x_node_id:
-                    continue
-                
-                # Skip if node is already assigned to this query
-                if x_node_id in query_info.assigned_nodes:
-                    continue
+        with server.long_poll(node_id) if wait > 0 else nullcontext():
+            while True:
+                if request and (await request.is_disconnected() or (disconnected and disconnected.done())):
+                    logger.debug(f"Node {node_id} disconnected from its long-poll")
+                    return []
                 
-                # Skip if query has enough responses
-                if len(query_info.responses) >= query_info.max_responses:
-                    server.pending_queries.remove(query_id)
-                    continue
+                # Read the version before claiming so a submit in between is not missed
+                version = server.work_signal.version
                 
-                # Check if query is expired
-                if time.time() - query_info.timestamp > query_info.timeout:
-                    server.pending_queries.remove(query_id)
-                    del server.queries[query_id]
-                    continue
+                # Claiming takes blocking locks, keep it off the event loop
+                available_queries = await run_in_threadpool(server.claim_queries, node_id, limit)
                 
-                # Assign node to query
-                query_info.assigned_nodes.append(x_node_id)
+                remaining = deadline - time.time()
+                if available_queries or remaining <= 0:
+                    logger.debug(f"Node {node_id} received {len(available_queries)} queries")
+                    return available_queries
                 
-                available_queries.append({
-                    "query_number": query_info.query_number,
-                    "query": query_info.query,
-                    "timestamp": query_info.timestamp,
-                    "metadata": {
-                        "max_responses": query_info.max_responses,
-                        "current_responses": len(query_info.responses),
-                        "timeout": query_info.timeout
-                    }
-                })
+                # Wake up at least once per hold time so queries held for a preferred peer reach us,
+                # and per poll interval when other router processes may have queued work
+                wait_time = remaining
+                if server.scheduler_hold_time > 0:
+                    wait_time = min(wait_time, server.scheduler_hold_time)
+                if server.state.shared:
+                    wait_time = min(wait_time, server.state.poll_interval)
                 
-                # Limit queries per request
-                if len(available_queries) >= 3:
-                    break
-            
-            logger.debug(f"Node {x_node_id} received {len(available_queries)} queries")
-            return available_queries
+                woken = asyncio.ensure_future(server.work_signal.wait(version, wait_time))
+                await asyncio.wait([woken, disconnected] if disconnected else [woken],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+    finally:
+        if disconnected:
+            disconnected.cancel()
+
+@app.get("/request")
+async def get_requests(
+    request: Request,
+    wait: float = Query(0, ge=0, description="Seconds to hold the request open while no work is queued"),
+    limit: Optional[int] = Query(None, ge=1, description="Queries wanted, bounded by the node's free capacity"),
+    x_node_id: Optional[str] = Header(None)
+) -> List[Dict]:
+    """Get pending queries for a specific node to process
+
+    With wait > 0 the request is parked (long-poll) until a query is
+    submitted or the wait runs out, instead of returning [] immediately.
+    A client that disconnects while parked is not handed any work.
+    Without limit a node gets at most max_queries_per_request per poll;
+    nodes that register max_concurrent_queries can ask for more.
+    """
+    try:
+        if not x_node_id:
+            return []
+        
+        return await _claim_with_wait(x_node_id, wait, limit, request)
     
     except Exception as e:
         logger.error(f"Error in get_requests: {str(e)}")
@@ -311,68 +3542,102 @@ def get_requests(x_node_id: Optional[str] = Header(None)) -> List[Dict]:
 @app.post("/query")
 def submit_query(
     query_model: QueryModel,
+    request: Request,
     x_node_id: Optional[str] = Header(None)
 ) -> Dict:
-    """Submit a new query and get query number"""
+    """Submit a new query and get query number
+
+    completion_mode picks when the query is done: "all" waits for
+    max_responses answers, "first" for the first required_responses answers
+    and "quorum" for required_responses matching answers. "consensus"
+    dispatches max_responses workers and completes as soon as similar
+    answers from at least two workers reach required_responses weighted
+    votes (see GET /response/best).
+    Outstanding assignments are cancelled as soon as the criterion is met.
+    
+    status is "cached" when stored answers were returned right away and
+    "coalesced" when an identical in-flight query's number was handed out;
+    send cache=false to always get a fresh dispatch.
+    
+    Queries are dispatched by priority class, and fairly between submitters
+    within a class; nodes that answer other people's queries get a larger
+    share. Each submitter (or client address, without X-Node-ID) is rate
+    limited, and new work is refused while the dispatch queue is full. Both
+    answer 429 with a Retry-After header.
+    """
     try:
-        with server.lock:
-            # Get or create node ID
-            if not x_node_id:
-                x_node_id = server._generate_node_id()
-            
-            # Register/update node
-            server._register_or_update_node(x_node_id)
-            
-            # Increment counter and create query
-            server.counter += 1
-            query_info = QueryInfo(
-                query_number=server.counter,
-                query=query_model.query,
-                submitter_node_id=x_node_id,
-                timestamp=time.time(),
-                max_responses=server.max_responses_per_query
-            )
-            
-            server.queries[server.counter] = query_info
-            server.pending_queries.append(server.counter)
-            
-            # Update node stats
-            server.nodes[x_node_id].queries_submitted += 1
-            
-            logger.info(f"Query submitted - ID: {server.counter}, Node: {x_node_id}, Query: {query_model.query[:50]}...")
-            
-            return {
-                "query_number": server.counter,
-                "node_id": x_node_id,
-                "status": "submitted",
-                "estimated_wait_time": len(server.pending_queries) * 5  # Rough estimate in seconds
-            }
+        if query_model.completion_mode not in COMPLETION_MODES:
+            raise HTTPException(status_code=400, detail=f"completion_mode must be one of {', '.join(COMPLETION_MODES)}")
+        
+        if query_model.priority not in PRIORITY_CLASSES:
+            raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITY_CLASSES)}")
+        
+        if query_model.required_responses is not None:
+            required_responses = query_model.required_responses
+        elif query_model.completion_mode == "first":
+            required_responses = 1
+        elif query_model.completion_mode in ("quorum", "consensus"):
+            required_responses = server.max_responses_per_query // 2 + 1
+        else:
+            required_responses = server.max_responses_per_query
+        
+        if not 1 <= required_responses <= server.max_responses_per_query:
+            raise HTTPException(status_code=400, detail=f"required_responses must be between 1 and {server.max_responses_per_query}")
+        
+        server.check_submit_rate(x_node_id or f"address:{request.client.host if request.client else 'unknown'}")
+        
+        # Get or create node ID
+        if not x_node_id:
+            x_node_id = server._generate_node_id()
+        
+        query_info, status = server.submit_query(x_node_id, query_model, required_responses)
+        
+        logger.info(f"Query {status} - ID: {query_info.query_number}, Node: {x_node_id}, Query: {query_model.query[:50]}...")
+        
+        return {
+            "query_number": query_info.query_number,
+            "node_id": x_node_id,
+            "status": status,
+            "estimated_wait_time": 0 if status == "cached" else server.estimate_wait_time(server.state.pending_count())
+        }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in submit_query: {str(e)}")
         raise HTTPException(status_code=500, detail="Error processing query")
 
+def _known_response_count(if_none_match: Optional[str], query_number: int) -> Optional[int]:
+    """Answer count encoded in an ETag from GET /response, None if it is not one of ours"""
+    prefix = f'W/"{query_number}-'
+    if not if_none_match or not if_none_match.startswith(prefix):
+        return None
+    try:
+        return int(if_none_match[len(prefix):].rstrip('"'))
+    except ValueError:
+        return None
+
 @app.get("/response")
 def get_responses(
     query_number: int,
-    x_node_id: Optional[str] = Header(None)
+    response: Response,
+    x_node_id: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
 ) -> List[str]:
-    """Get all responses for a specific query number"""
+    """Get all responses for a specific query number
+    
+    Replies carry an ETag; pollers that send it back as If-None-Match get
+    304 Not Modified until a new answer arrives.
+    """
     try:
-        with server.lock:
-            query_info = server.queries.get(query_number)
-            if not query_info:
-                return []
-            
-            # Only allow submitter to get responses
-            if x_node_id and query_info.submitter_node_id != x_node_id:
-                logger.warning(f"Unauthorized access: Node {x_node_id} tried to access query {query_number} from {query_info.submitter_node_id}")
-                raise HTTPException(status_code=403, detail="Not authorized to access this query")
-            
-            responses = [r["response"] for r in query_info.responses]
-            logger.debug(f"Retrieved {len(responses)} responses for query {query_number}")
-            
-            return responses
+        known_count = _known_response_count(if_none_match, query_number)
+        responses = server.get_responses(query_number, x_node_id, known_count)
+        if responses is None:
+            return Response(status_code=304, headers={"ETag": if_none_match})
+        
+        response.headers["ETag"] = f'W/"{query_number}-{len(responses)}"'
+        logger.debug(f"Retrieved {len(responses)} responses for query {query_number}")
+        return responses
     
     except HTTPException:
         raise
@@ -380,6 +3645,123 @@ def get_responses(
         logger.error(f"Error in get_responses: {str(e)}")
         return []
 
+def _format_sse(event: str, data: Dict, event_id: Optional[int] = None) -> str:
+    """Encode one Server-Sent Events message"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+async def _stream_query_responses(query_number: int, start_index: int):
+    """Yield SSE messages for each response as it arrives, then a completion event"""
+    index = start_index
+    last_message_time = time.time()
+    
+    # With a shared state backend other router processes don't signal us, so re-check periodically
+    wait_time = server.stream_keepalive_interval
+    if server.state.shared:
+        wait_time = min(wait_time, server.state.poll_interval)
+    
+    while True:
+        # Read the version before the snapshot so an append in between is not missed
+        signal = server.query_signal(query_number)
+        version = signal.version
+        
+        # Takes the query's blocking lock (and may read spilled answers), keep it off the event loop
+        updates = await run_in_threadpool(server.read_stream_updates, query_number, index)
+        
+        if updates is None:
+            # Query was ended or expired before enough responses arrived
+            yield _format_sse("closed", {
+                "query_number": query_number,
+                "total_responses": index
+            })
+            return
+        
+        for stream_id, text in updates["chunks"]:
+            yield _format_sse("chunk", {
+                "query_number": query_number,
+                "stream": stream_id,
+                "text": text
+            })
+        
+        for response, stream_id in updates["responses"]:
+            data = {
+                "query_number": query_number,
+                "index": index,
+                "response": response
+            }
+            if stream_id is not None:
+                data["stream"] = stream_id
+            yield _format_sse("response", data, event_id=index)
+            index += 1
+        
+        if updates["completed"]:
+            yield _format_sse("complete", {
+                "query_number": query_number,
+                "completion_mode": updates["completion_mode"],
+                "total_responses": index,
+                "best_index": updates["best_response"]
+            })
+            return
+        
+        if updates["chunks"] or updates["responses"]:
+            last_message_time = time.time()
+        
+        if not await signal.wait(version, wait_time):
+            if time.time() - last_message_time >= server.stream_keepalive_interval:
+                yield ": keepalive\n\n"
+                last_message_time = time.time()
+
+@app.get("/response/best")
+def get_best_response(
+    query_number: int,
+    x_node_id: Optional[str] = Header(None)
+) -> Dict:
+    """Get one aggregated answer instead of every worker's
+    
+    Near-identical answers are merged and each distinct answer is scored by
+    how many workers agree with it, weighted by each worker's track record.
+    "answer" is the best one so far; "answers" lists every distinct answer
+    with its support. Submit with completion_mode "consensus" to have the
+    query complete once the best answer's support reaches required_responses.
+    """
+    result = server.get_best_response(query_number, x_node_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Query not found")
+    return result
+
+@app.get("/response/stream")
+def stream_responses(
+    query_number: int,
+    x_node_id: Optional[str] = Header(None),
+    last_event_id: Optional[int] = Header(None)
+):
+    """Push responses for a query as Server-Sent Events instead of polling GET /response
+
+    Emits a "response" event per answer, then "complete" once the query's
+    completion criterion is met or "closed" if it is ended/expired first. Reconnecting
+    clients resume after the Last-Event-ID they already received. Workers that
+    upload partial output via POST /response/chunk also produce "chunk" events
+    tagged with a per-worker stream number; the matching "response" event
+    carries the same number and is the authoritative full text.
+    """
+    # Only allow submitter to subscribe to responses
+    if not server.check_submitter(query_number, x_node_id):
+        raise HTTPException(status_code=404, detail="Query not found")
+    
+    # Event IDs are response indexes, so anything below -1 can't have come from us
+    if last_event_id is not None and last_event_id < -1:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be a response index")
+    start_index = last_event_id + 1 if last_event_id is not None else 0
+    logger.debug(f"Response stream opened for query {query_number} from index {start_index}")
+    
+    return StreamingResponse(
+        _stream_query_responses(query_number, start_index),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/response")
 def submit_response(
     data: ResponseModel,
@@ -387,57 +3769,10 @@ def submit_response(
 ):
     """Submit a response for a query"""
     try:
-        query_number = data.query_number
-        new_response = data.response
-        
         if not x_node_id:
             raise HTTPException(status_code=400, detail="Node ID required")
         
-        with server.lock:
-            query_info = server.queries.get(query_number)
-            if not query_info:
-                raise HTTPException(status_code=404, detail="Query not found")
-            
-            # Prevent self-response
-            if query_info.submitter_node_id == x_node_id:
-                logger.warning(f"Self-response blocked: Node {x_node_id} query {query_number}")
-                raise HTTPException(status_code=400, detail="Cannot respond to your own query")
-            
-            # Check if node was assigned to this query
-            if x_node_id not in query_info.assigned_nodes:
-                logger.warning(f"Unassigned response: Node {x_node_id} query {query_number}")
-                raise HTTPException(status_code=400, detail="Node not assigned to this query")
-            
-            # Check if already responded
-            for existing_response in query_info.responses:
-                if existing_response.get("node_id") == x_node_id:
-                    logger.warning(f"Duplicate response: Node {x_node_id} query {query_number}")
-                    raise HTTPException(status_code=400, detail="Already responded to this query")
-            
-            # Add response
-            query_info.responses.append({
-                "node_id": x_node_id,
-                "response": new_response,
-                "timestamp": time.time()
-            })
-            
-            # Update node stats
-            if x_node_id in server.nodes:
-                server.nodes[x_node_id].responses_provided += 1
-            
-            # Remove from pending if enough responses
-            if len(query_info.responses) >= query_info.max_responses:
-                if query_number in server.pending_queries:
-                    server.pending_queries.remove(query_number)
-            
-            logger.info(f"Response added: query {query_number} by node {x_node_id}")
-            
-            return {
-                "message": "Response received successfully",
-                "query_number": query_number,
-                "node_id": x_node_id,
-                "total_responses": len(query_info.responses)
-            }
+        return server.submit_response(x_node_id, data)
     
     except HTTPException:
         raise
@@ -445,6 +3780,102 @@ def submit_response(
         logger.error(f"Error in submit_response: {str(e)}")
         raise HTTPException(status_code=500, detail="Error processing response")
 
+@app.post("/response/chunk")
+def submit_response_chunk(
+    data: ResponseChunkModel,
+    x_node_id: Optional[str] = Header(None)
+):
+    """Upload a piece of a response while it is still being generated
+
+    Chunks are relayed to the submitter's /response/stream subscription. Each
+    worker stream buffers at most max_stream_buffer_chars of unread text; past
+    that the router answers 429 with Retry-After and the worker should retry
+    later or simply continue and POST /response with the full answer.
+    """
+    try:
+        if not x_node_id:
+            raise HTTPException(status_code=400, detail="Node ID required")
+        
+        return server.submit_response_chunk(x_node_id, data)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in submit_response_chunk: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error processing response chunk")
+
+@app.post("/batch")
+async def worker_batch(
+    batch: WorkerBatchModel,
+    request: Request,
+    x_node_id: Optional[str] = Header(None)
+) -> Dict:
+    """Submit many chunks and responses and claim new work in one round trip
+
+    Leases listed in `heartbeat` are renewed first (see POST /heartbeat).
+    Submissions are applied chunks first, then responses, each with its own
+    result: status_code 200 plus the usual /response or /response/chunk body,
+    or the error status_code and detail. Then up to `claim` queries are handed
+    out, with the same long-poll `wait` as GET /request. Every call also counts
+    as a node heartbeat and returns the node's cancelled assignments.
+    """
+    try:
+        if not x_node_id:
+            raise HTTPException(status_code=400, detail="Node ID required")
+        
+        if len(batch.responses) + len(batch.chunks) > server.max_batch_items:
+            raise HTTPException(status_code=400, detail=f"At most {server.max_batch_items} items per batch")
+        
+        results = await run_in_threadpool(server.submit_batch, x_node_id, batch.responses, batch.chunks, batch.heartbeat)
+        results["queries"] = await _claim_with_wait(x_node_id, batch.wait, batch.claim, request) if batch.claim > 0 else []
+        results["cancelled"] = await run_in_threadpool(server.pop_cancelled_assignments, x_node_id)
+        return results
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in worker_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error processing batch")
+
+@app.post("/heartbeat")
+def heartbeat(
+    data: HeartbeatModel,
+    x_node_id: Optional[str] = Header(None)
+) -> Dict:
+    """Renew the leases on assignments the worker is still generating
+
+    Every assignment comes with a lease (lease_expires in the /request
+    metadata). Once a worker heartbeats, an assignment it neither responds to,
+    uploads chunks for nor renews before then is offered to another node. A
+    late /response is still accepted unless another node took the slot or the
+    query completed, in which case it is rejected with 409. Workers that never
+    heartbeat get leases as long as the query timeout. "lost" lists the
+    queries to drop.
+    """
+    try:
+        if not x_node_id:
+            raise HTTPException(status_code=400, detail="Node ID required")
+        
+        return server.renew_leases(x_node_id, data.query_numbers)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in heartbeat: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error renewing leases")
+
+@app.get("/cancelled")
+def get_cancelled_assignments(x_node_id: Optional[str] = Header(None)) -> List[int]:
+    """Query numbers this node was assigned but should stop working on
+
+    Each cancellation is returned once; workers can check this between
+    generations or rely on the 409 from /response and /response/chunk.
+    """
+    if not x_node_id:
+        return []
+    
+    return server.pop_cancelled_assignments(x_node_id)
+
 @app.post("/end")
 def end_query(
     data: QueryNumberModel,
@@ -454,29 +3885,16 @@ def end_query(
     try:
         query_number = data.query_number
         
-        with server.lock:
-            query_info = server.queries.get(query_number)
-            if not query_info:
-                return {"success": False, "message": "Query not found"}
-            
-            # Only allow submitter to end the query
-            if x_node_id and query_info.submitter_node_id != x_node_id:
-                raise HTTPException(status_code=403, detail="Not authorized to end this query")
-            
-            # Remove from pending queries
-            if query_number in server.pending_queries:
-                server.pending_queries.remove(query_number)
-            
-            # Remove query
-            del server.queries[query_number]
-            
-            logger.info(f"Query {query_number} ended by node {x_node_id}")
-            
-            return {
-                "success": True,
-                "query_number": query_number,
-                "message": "Query ended successfully"
-            }
+        if not server.end_query(query_number, x_node_id):
+            return {"success": False, "message": "Query not found"}
+        
+        logger.info(f"Query {query_number} ended by node {x_node_id}")
+        
+        return {
+            "success": True,
+            "query_number": query_number,
+            "message": "Query ended successfully"
+        }
     
     except HTTPException:
         raise
@@ -486,47 +3904,136 @@ def end_query(
 
 @app.get("/status")
 def get_status(x_node_id: Optional[str] = Header(None)):
-    """Get current server status and statistics"""
-    with server.lock:
-        # Update node last seen if provided
-        if x_node_id:
-            server._register_or_update_node(x_node_id)
-        
-        return {
-            "server_status": "running",
-            "version": "2.0.0",
-            "active_nodes": len(server.nodes),
-            "active_queries": len(server.queries),
-            "pending_queries": len(server.pending_queries),
-            "total_queries_processed": server.counter,
-            "timestamp": time.time(),
-            "configuration": {
-                "max_queries_per_node": server.max_queries_per_node,
-                "node_timeout": server.node_timeout,
-                "query_timeout": server.query_timeout,
-                "max_responses_per_query": server.max_responses_per_query  # Fixed typo
-            },
-            "nodes_info": [
-                {
-                    "node_id": node.node_id,
-                    "last_seen": time.time() - node.last_seen,
-                    "queries_submitted": node.queries_submitted,
-                    "responses_provided": node.responses_provided,
-                    "capabilities": node.capabilities
-                }
-                for node in server.nodes.values()
-            ],
-            "queries_summary": [
-                {
-                    "id": q.query_number,
-                    "submitter": q.submitter_node_id,
-                    "responses_count": len(q.responses),
-                    "assigned_nodes": len(q.assigned_nodes),
-                    "age": time.time() - q.timestamp
-                }
-                for q in server.queries.values()
-            ]
+    """Get current server status and aggregate statistics
+    
+    Per-node and per-query listings are paginated at /status/nodes and
+    /status/queries. Aggregates come from the status snapshot, at most
+    a second old, whose version those listings accept as since_version.
+    
+    The nodes_info and queries_summary lists this endpoint used to return
+    are gone; their entries are the items of those two listings, and
+    nodes_stats / queries_stats hold the aggregates.
+    """
+    # Update node last seen if provided
+    if x_node_id:
+        server.touch_node(x_node_id)
+    
+    current_time = time.time()
+    snapshot = server.status_snapshot()
+    nodes = snapshot.nodes.values()
+    queries = snapshot.queries.values()
+    live_nodes = [node for node in nodes if current_time - node["last_seen_at"] <= server.scheduler_live_window]
+    unfinished = [query for query in queries if not query["completed"]]
+    
+    return {
+        "server_status": "running",
+        "version": "2.0.0",
+        "active_nodes": server.state.node_count(),
+        "active_queries": server.state.query_count(),
+        "pending_queries": server.state.pending_count(),
+        "total_queries_processed": server.state.last_query_number(),
+        "timestamp": current_time,
+        "status_version": snapshot.version,
+        "configuration": {
+            "max_queries_per_node": server.max_queries_per_node,
+            "max_batch_items": server.max_batch_items,
+            "node_timeout": server.node_timeout,
+            "query_timeout": server.query_timeout,
+            "max_responses_per_query": server.max_responses_per_query,  # Fixed typo
+            "max_long_poll_wait": server.max_long_poll_wait,
+            "state_backend": server.state.name,
+            "scheduling_policy": server.scheduling_policy.name,
+            "min_assignment_deadline": server.min_assignment_deadline,
+            "hedge_deadline_factor": server.hedge_deadline_factor,
+            "min_lease_time": server.min_lease_time,
+            "max_pending_queries": server.max_pending_queries,
+            "submit_rate_per_node": server.submit_rate_per_node,
+            "contributor_credit_step": server.contributor_credit_step
+        },
+        "admission": {
+            "drain_rate": round(server.drain_rate(), 3),
+            "rate_limited": server.queries_rejected.labels(reason="rate_limited").value,
+            "queue_full": server.queries_rejected.labels(reason="queue_full").value
+        },
+        "response_cache": server.response_cache.stats(),
+        "nodes_stats": {
+            "registered": len(snapshot.nodes),
+            "live": len(live_nodes),
+            "busy": sum(1 for node in live_nodes if node["active_assignments"] > 0),
+            "active_assignments": sum(node["active_assignments"] for node in nodes),
+            "by_hardware_class": dict(Counter(node["capabilities"].get("hardware_class", "unknown") for node in live_nodes))
+        },
+        "queries_stats": {
+            "total": len(snapshot.queries),
+            "completed": len(snapshot.queries) - len(unfinished),
+            "unfinished_by_priority": dict(Counter(query["priority"] for query in unfinished)),
+            "unfinished_by_completion_mode": dict(Counter(query["completion_mode"] for query in unfinished)),
+            "hedged_assignments": sum(query["hedged_assignments"] for query in queries),
+            "oldest_unfinished_age": max((current_time - query["timestamp"] for query in unfinished), default=0)
         }
+    }
+
+def _status_page_size(limit: int) -> int:
+    if not 1 <= limit <= server.max_status_page_size:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {server.max_status_page_size}")
+    return limit
+
+@app.get("/status/nodes")
+def get_status_nodes(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100),
+    live: Optional[bool] = Query(None),
+    hardware_class: Optional[str] = Query(None),
+    model: Optional[str] = Query(None),
+    since_version: Optional[int] = Query(None)
+):
+    """Page through node summaries in node ID order
+    
+    Pass next_cursor back as cursor for the next page. With since_version
+    only nodes changed after that status version are listed, plus the IDs
+    of nodes removed since; resync=true means the version is too old and
+    the full listing must be fetched again.
+    """
+    limit = _status_page_size(limit)
+    current_time = time.time()
+    
+    def matches(node: Dict) -> bool:
+        if live is not None and (current_time - node["last_seen_at"] <= server.scheduler_live_window) != live:
+            return False
+        if hardware_class is not None and node["capabilities"].get("hardware_class") != hardware_class:
+            return False
+        return model is None or node["capabilities"].get("model") == model
+    
+    page = server.status_view.page(server.status_snapshot(), "node", cursor, limit, since_version, matches)
+    page["items"] = [dict(node, last_seen=current_time - node["last_seen_at"]) for node in page["items"]]
+    return page
+
+@app.get("/status/queries")
+def get_status_queries(
+    cursor: Optional[int] = Query(None),
+    limit: int = Query(100),
+    submitter: Optional[str] = Query(None),
+    completed: Optional[bool] = Query(None),
+    priority: Optional[str] = Query(None),
+    completion_mode: Optional[str] = Query(None),
+    since_version: Optional[int] = Query(None)
+):
+    """Page through query summaries in query number order
+    
+    Cursor and since_version work as for /status/nodes.
+    """
+    limit = _status_page_size(limit)
+    current_time = time.time()
+    
+    def matches(query: Dict) -> bool:
+        return ((submitter is None or query["submitter"] == submitter)
+                and (completed is None or query["completed"] == completed)
+                and (priority is None or query["priority"] == priority)
+                and (completion_mode is None or query["completion_mode"] == completion_mode))
+    
+    page = server.status_view.page(server.status_snapshot(), "query", cursor, limit, since_version, matches)
+    page["items"] = [dict(query, age=current_time - query["timestamp"]) for query in page["items"]]
+    return page
 
 @app.get("/health")
 def health_check():
@@ -534,11 +4041,23 @@ def health_check():
     return {
         "status": "healthy",
         "timestamp": time.time(),
-        "uptime": time.time(),
-        "active_nodes": len(server.nodes),
-        "active_queries": len(server.queries)
+        "uptime": time.time() - server.start_time,
+        "active_nodes": server.state.node_count(),
+        "active_queries": server.state.query_count()
     }
 
+@app.get("/metrics")
+def get_metrics():
+    """Counters, gauges and latency histograms in the Prometheus text format
+    
+    Cheap to scrape: no per-query data, and node stats are read once.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Compress replies for clients that send Accept-Encoding: gzip (SSE streams are left alone)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+app.add_middleware(RequestDecompressionMiddleware, max_size=server.max_request_body_bytes)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -558,18 +4077,36 @@ if __name__ == "__main__":
     print("   • Automatic cleanup and memory management")
     print("   • Query timeout handling")
     print("   • Load balancing and node assignment")
+    print("   • Long-polling work dispatch (GET /request?wait=N)")
+    print("   • Push response delivery (GET /response/stream)")
+    print("   • Token streaming relay (POST /response/chunk)")
+    print("   • Batched worker protocol (POST /batch)")
+    print("   • Assignment leases with heartbeat renewal (POST /heartbeat)")
+    print("   • Multi-process routing (ROUTING_WORKERS, ROUTING_STATE_BACKEND=sqlite)")
+    print("   • Write-ahead journal and snapshots (ROUTING_STATE_BACKEND=journal)")
+    print("   • gzip transfers, compressed answers spilled to ROUTING_SPILL_PATH when large")
+    print("   • Aggregated best answer (GET /response/best, completion_mode=consensus)")
     print("   • Enhanced security and authorization")
     print()
     print("📡 Server endpoints:")
     print("   • Main: http://0.0.0.0:8313")
     print("   • Status: http://0.0.0.0:8313/status")
     print("   • Health: http://0.0.0.0:8313/health")
+    print("   • Metrics: http://0.0.0.0:8313/metrics")
     print("   • Docs: http://0.0.0.0:8313/docs")
     print("=" * 60)
     
+    # Several worker processes only make sense when they share state
+    workers = int(os.environ.get("ROUTING_WORKERS", "1"))
+    if workers > 1 and not server.state.shared:
+        print("⚠️  ROUTING_WORKERS > 1 needs ROUTING_STATE_BACKEND=sqlite, starting a single process")
+        workers = 1
+    
     uvicorn.run(
-        app,
+        "Routing:app" if workers > 1 else app,
         host="0.0.0.0",
         port=8313,
-        log_level="info"
+        log_level="info",
+        workers=workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__))
     )
\ No newline at end of file
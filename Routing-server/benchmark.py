@@ -0,0 +1,348 @@
+"""Load and latency benchmark for the routing server
+
+Drives Routing.app in-process (default) or a running server over HTTP
+with simulated fleets that behave like the Flutter client: workers poll
+GET /request on a timer (or long-poll), "generate" for a lognormally
+distributed time that depends on their hardware class and POST /response;
+submitters send queries after random think times, poll GET /response
+every second until their answers arrive and then POST /end.
+
+Reports throughput and p50/p95/p99 latencies per endpoint and for whole
+queries, and saves everything as JSON so runs can be compared:
+
+    python benchmark.py --duration 60 --workers 50 --submitters 20
+    python benchmark.py --url http://localhost:8313 --compare benchmark_results/baseline.json
+
+In-process runs use the state backend selected by ROUTING_STATE_BACKEND,
+like Routing.py itself. Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict, Counter
+from typing import List, Dict, Optional
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("benchmark.py needs httpx: pip install httpx")
+
+HARDWARE_SPEED = {"desktop": 1.0, "laptop": 1.5, "mobile": 3.0}  # Generation time multiplier per class
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+def summarize(samples: List[float]) -> Dict:
+    """Count, mean and tail latencies of a list of durations in seconds"""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 6),
+        "p50": round(percentile(values, 0.50), 6),
+        "p95": round(percentile(values, 0.95), 6),
+        "p99": round(percentile(values, 0.99), 6),
+        "max": round(values[-1], 6)
+    }
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """'desktop:0.2,mobile:0.8' -> {"desktop": 0.2, "mobile": 0.8}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition(":")
+        if name not in HARDWARE_SPEED:
+            raise argparse.ArgumentTypeError(f"Unknown hardware class: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class Recorder:
+    """Latency samples and status codes per endpoint, plus per-query timings"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.query_completion: List[float] = []
+        self.time_to_first_response: List[float] = []
+        self.queries_submitted = 0
+        self.queries_completed = 0
+        self.queries_timed_out = 0
+        self.queries_rejected = 0
+        self.responses_sent = 0
+
+    async def request(self, client: httpx.AsyncClient, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        endpoint = f"{method} {path}"
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.statuses[endpoint]["error"] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        self.statuses[endpoint][response.status_code] += 1
+        return response
+
+async def run_worker(client: httpx.AsyncClient, recorder: Recorder, args, worker_id: str,
+                     hardware_class: str, stop: asyncio.Event):
+    """Poll for work and answer it after a simulated generation time"""
+    headers = {"X-Node-ID": worker_id}
+    await recorder.request(client, "POST", "/register", headers=headers, json={
+        "node_capabilities": {"hardware_class": hardware_class, "max_concurrent_queries": args.worker_capacity}
+    })
+
+    async def answer(query: Dict):
+        generation_time = random.lognormvariate(math.log(args.generation_median * HARDWARE_SPEED[hardware_class]),
+                                                args.generation_sigma)
+        for sequence in range(args.stream_chunks):
+            await asyncio.sleep(generation_time / (args.stream_chunks + 1))
+            await recorder.request(client, "POST", "/response/chunk", headers=headers, json={
+                "query_number": query["query_number"], "chunk": "token " * 8, "sequence": sequence
+            })
+        await asyncio.sleep(generation_time / (args.stream_chunks + 1))
+
+        # Most workers agree on an answer, the rest say something of their own
+        if random.random() < args.answer_agreement:
+            text = f"The answer to query {query['query_number']} is forty two, as most models agree."
+        else:
+            text = f"Worker {worker_id} believes something else entirely: {uuid.uuid4().hex}"
+        response = await recorder.request(client, "POST", "/response", headers=headers, json={
+            "query_number": query["query_number"],
+            "response": text,
+            "metadata": {"tokens_per_second": args.response_tokens / generation_time}
+        })
+        if response is not None and response.status_code == 200:
+            recorder.responses_sent += 1
+
+    # Workers don't start in lockstep
+    await asyncio.sleep(random.uniform(0, args.worker_poll_interval))
+
+    while not stop.is_set():
+        params = {"limit": args.worker_capacity}
+        if args.long_poll:
+            params["wait"] = args.long_poll
+        response = await recorder.request(client, "GET", "/request", headers=headers, params=params)
+        queries = response.json() if response is not None and response.status_code == 200 else []
+
+        if queries:
+            await asyncio.gather(*(answer(query) for query in queries))
+
+        # The Flutter client polls on a fixed timer; a long-poll returns only with work or on timeout
+        if not args.long_poll or response is None or response.status_code != 200:
+            await asyncio.sleep(args.worker_poll_interval)
+
+async def run_submitter(client: httpx.AsyncClient, recorder: Recorder, args, submitter_id: str, stop_at: float):
+    """Send one query at a time and poll for its answers, like the chat screen"""
+    headers = {"X-Node-ID": submitter_id}
+
+    while True:
+        await asyncio.sleep(random.expovariate(1 / args.think_time))
+        if time.time() >= stop_at:
+            return
+
+        submitted = time.perf_counter()
+        response = await recorder.request(client, "POST", "/query", headers=headers, json={
+            "query": f"benchmark {submitter_id} {uuid.uuid4().hex[:8]}",
+            "completion_mode": args.completion_mode,
+            "cache": False
+        })
+        if response is None:
+            continue
+        if response.status_code == 429:
+            recorder.queries_rejected += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+            continue
+        if response.status_code != 200:
+            continue
+
+        recorder.queries_submitted += 1
+        query_number = response.json()["query_number"]
+        first_response_at = None
+
+        while True:
+            await asyncio.sleep(args.response_poll_interval)
+            elapsed = time.perf_counter() - submitted
+            if elapsed > args.query_timeout:
+                recorder.queries_timed_out += 1
+                break
+
+            # Only the router knows when the completion mode is satisfied (quorum and consensus
+            # depend on agreement, and its max_responses may differ), so ask it instead of counting
+            response = await recorder.request(client, "GET", "/response/best", headers=headers,
+                                              params={"query_number": query_number})
+            best = response.json() if response is not None and response.status_code == 200 else {}
+            received = best.get("total_responses", 0)
+            done = best.get("completed", False)
+
+            if received and first_response_at is None:
+                first_response_at = elapsed
+                recorder.time_to_first_response.append(elapsed)
+            if done:
+                recorder.queries_completed += 1
+                recorder.query_completion.append(elapsed)
+                break
+
+        await recorder.request(client, "POST", "/end", headers=headers, json={"query_number": query_number})
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def make_client(args) -> httpx.AsyncClient:
+    """HTTP client for a running server, or one wired straight into Routing.app"""
+    timeout = httpx.Timeout(args.long_poll + 30)
+    limits = httpx.Limits(max_connections=args.workers + args.submitters + 10)
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import Routing
+    Routing.server.max_responses_per_query = args.max_responses
+    if not args.server_logs:
+        logging.getLogger("Routing").setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=Routing.app), base_url="http://routing", timeout=timeout)
+
+async def run_benchmark(args) -> Dict:
+    recorder = Recorder()
+    stop_workers = asyncio.Event()
+    classes = list(args.hardware_mix)
+    weights = [args.hardware_mix[name] for name in classes]
+
+    async with make_client(args) as client:
+        started = time.time()
+        stop_at = started + args.duration
+        workers = [
+            asyncio.create_task(run_worker(client, recorder, args, f"bench_worker_{i}",
+                                           random.choices(classes, weights)[0], stop_workers))
+            for i in range(args.workers)
+        ]
+        submitters = [run_submitter(client, recorder, args, f"bench_submitter_{i}", stop_at)
+                      for i in range(args.submitters)]
+
+        # Submitters stop asking at stop_at but wait for the queries they have in flight
+        await asyncio.gather(*submitters)
+        elapsed = time.time() - started
+        stop_workers.set()
+        await asyncio.gather(*workers)
+
+    total_requests = sum(len(samples) for samples in recorder.latencies.values())
+    return {
+        "timestamp": started,
+        "revision": git_revision(),
+        "target": args.url or "in-process",
+        "state_backend": None if args.url else os.environ.get("ROUTING_STATE_BACKEND", "memory"),
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+        "elapsed": round(elapsed, 3),
+        "throughput": {
+            "queries_per_second": round(recorder.queries_completed / elapsed, 3),
+            "requests_per_second": round(total_requests / elapsed, 3),
+            "responses_per_second": round(recorder.responses_sent / elapsed, 3)
+        },
+        "queries": {
+            "submitted": recorder.queries_submitted,
+            "completed": recorder.queries_completed,
+            "timed_out": recorder.queries_timed_out,
+            "rejected": recorder.queries_rejected,
+            "completion": summarize(recorder.query_completion),
+            "time_to_first_response": summarize(recorder.time_to_first_response)
+        },
+        "endpoints": {
+            endpoint: dict(summarize(samples), statuses={str(code): count for code, count in recorder.statuses[endpoint].items()})
+            for endpoint, samples in sorted(recorder.latencies.items())
+        }
+    }
+
+def _milliseconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+def print_report(results: Dict, baseline: Optional[Dict] = None):
+    """Human-readable summary, with the change against a baseline run if given"""
+    def change(section: Dict, baseline_section: Optional[Dict], key: str) -> str:
+        if not baseline_section or not baseline_section.get(key) or section.get(key) is None:
+            return ""
+        return f" ({(section[key] / baseline_section[key] - 1) * 100:+.0f}%)"
+
+    queries = results["queries"]
+    throughput = results["throughput"]
+    print(f"Target: {results['target']}  revision: {results['revision'] or 'unknown'}  elapsed: {results['elapsed']}s")
+    print(f"Queries: {queries['submitted']} submitted, {queries['completed']} completed, "
+          f"{queries['timed_out']} timed out, {queries['rejected']} rejected")
+    print(f"Throughput: {throughput['queries_per_second']} queries/s, {throughput['requests_per_second']} requests/s"
+          + change(throughput, baseline and baseline["throughput"], "queries_per_second"))
+    print()
+    print(f"{'latency (ms)':<28}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+
+    rows = [("query completion", queries["completion"], baseline and baseline["queries"]["completion"]),
+            ("time to first response", queries["time_to_first_response"],
+             baseline and baseline["queries"]["time_to_first_response"])]
+    rows += [(endpoint, stats, baseline and baseline["endpoints"].get(endpoint))
+             for endpoint, stats in results["endpoints"].items()]
+    for name, stats, baseline_stats in rows:
+        print(f"{name:<28}{stats['count']:>8}{_milliseconds(stats.get('p50')):>10}{_milliseconds(stats.get('p95')):>10}"
+              f"{_milliseconds(stats.get('p99')):>10}{_milliseconds(stats.get('max')):>10}"
+              + change(stats, baseline_stats, "p99"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the routing server with simulated submitters and workers")
+    parser.add_argument("--url", help="Benchmark a running server (e.g. http://localhost:8313) instead of Routing.app in-process")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds during which new queries are submitted")
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--submitters", type=int, default=10)
+    parser.add_argument("--hardware-mix", type=parse_mix, default=parse_mix("desktop:0.2,laptop:0.3,mobile:0.5"),
+                        help="Worker hardware classes and their weights")
+    parser.add_argument("--worker-capacity", type=int, default=1, help="Queries a worker claims and generates at once")
+    parser.add_argument("--worker-poll-interval", type=float, default=3.0, help="Flutter client polls every 3 seconds")
+    parser.add_argument("--long-poll", type=float, default=0, help="Use GET /request?wait=N instead of timed polling")
+    parser.add_argument("--generation-median", type=float, default=2.0, help="Median desktop generation time in seconds")
+    parser.add_argument("--generation-sigma", type=float, default=0.5, help="Lognormal spread of generation times")
+    parser.add_argument("--response-tokens", type=int, default=256, help="Used to report tokens/sec to the router")
+    parser.add_argument("--answer-agreement", type=float, default=0.8,
+                        help="Chance a worker gives the common answer rather than one of its own")
+    parser.add_argument("--stream-chunks", type=int, default=0, help="Chunks streamed via /response/chunk per answer")
+    parser.add_argument("--think-time", type=float, default=5.0, help="Mean seconds a submitter waits between queries")
+    parser.add_argument("--response-poll-interval", type=float, default=1.0)
+    parser.add_argument("--completion-mode", choices=("all", "first", "quorum", "consensus"), default="all")
+    parser.add_argument("--max-responses", type=int, default=3,
+                        help="Answers the in-process router collects per query; a --url server keeps its own setting")
+    parser.add_argument("--query-timeout", type=float, default=180)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--server-logs", action="store_true", help="Keep the in-process router's INFO logging")
+    parser.add_argument("--output", help="Where to save the JSON results (default benchmark_results/<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to show changes against")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run_benchmark(args))
+
+    output = args.output or os.path.join("benchmark_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print_report(results, baseline)
+    print(f"\nResults saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Routing  # noqa: E402
+
+logging.getLogger("Routing").setLevel(logging.WARNING)
+
+
+def make_server(state, spill_directory):
+    """A router on its own state, dispatching without scheduler holds"""
+    server = Routing.DistributedRoutingServer(state, spill_directory=str(spill_directory))
+    server.scheduler_hold_time = 0
+    return server
+
+
+def submit(server, node_id, query, required_responses=None, cache=False, **fields):
+    """Submit a query like POST /query does, returning (query number, status)"""
+    query_model = Routing.QueryModel(query=query, cache=cache, **fields)
+    if required_responses is None:
+        if query_model.completion_mode == "first":
+            required_responses = 1
+        elif query_model.completion_mode in ("quorum", "consensus"):
+            required_responses = server.max_responses_per_query // 2 + 1
+        else:
+            required_responses = server.max_responses_per_query
+    query_info, status = server.submit_query(node_id, query_model, required_responses)
+    return query_info.query_number, status
+
+
+def answer(server, node_id, query_number, text="answer"):
+    return server.submit_response(node_id, Routing.ResponseModel(query_number=query_number, response=text))
+
+
+def claimed(server, node_id):
+    """Query numbers a poll by node_id is handed"""
+    return [query["query_number"] for query in server.claim_queries(node_id)]
+
+
+def heartbeat(server, node_id, query_numbers):
+    return server.renew_leases(node_id, list(query_numbers))
+
+
+def node(server, node_id):
+    with server.state.nodes([node_id], writable=False) as nodes:
+        return nodes[node_id]
+
+
+@pytest.fixture
+def server(tmp_path):
+    return make_server(Routing.InMemoryState(), tmp_path / "spill")
+
+
+@pytest.fixture
+def short_leases(server):
+    """A server whose leases run out 0.2s after the last sign of life"""
+    server.min_lease_time = 0.2
+    server.lease_service_time_factor = 0
+    return server
+
+
+@pytest.fixture
+def routed(server, monkeypatch):
+    """The server behind the module's endpoints for this test"""
+    monkeypatch.setattr(Routing, "server", server)
+    return server
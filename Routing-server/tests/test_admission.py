@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import answer, claimed
+
+import Routing
+
+
+@pytest.fixture
+def client(routed):
+    return TestClient(Routing.app)
+
+
+def post_query(client, node_id, query, **fields):
+    return client.post("/query", headers={"X-Node-ID": node_id}, json={"query": query, **fields})
+
+
+def test_submitter_over_its_rate_gets_429_with_retry_after(routed, client):
+    routed.submit_limiter = Routing.RateLimiter(rate=0.5, burst=2)
+    assert post_query(client, "flooder", "q1").status_code == 200
+    assert post_query(client, "flooder", "q2").status_code == 200
+
+    refused = post_query(client, "flooder", "q3")
+    assert refused.status_code == 429
+    assert 1 <= int(refused.headers["Retry-After"]) <= 2
+
+    # Other submitters have buckets of their own
+    assert post_query(client, "someone_else", "q").status_code == 200
+    assert client.get("/status").json()["admission"]["rate_limited"] == 1
+
+
+def test_full_queue_refuses_new_work_until_it_drains(routed, client):
+    routed.max_pending_queries = 2
+    first = post_query(client, "submitter", "q1", completion_mode="first").json()["query_number"]
+    assert post_query(client, "submitter", "q2").status_code == 200
+
+    refused = post_query(client, "submitter", "q3")
+    assert refused.status_code == 429
+    assert int(refused.headers["Retry-After"]) >= 1
+
+    assert first in claimed(routed, "worker_a")
+    answer(routed, "worker_a", first)
+    assert post_query(client, "submitter", "q3").status_code == 200
+
+
+def test_cached_answers_are_served_while_the_queue_is_full(routed, client):
+    routed.max_pending_queries = 1
+    cached = post_query(client, "submitter", "cached", completion_mode="first").json()["query_number"]
+    assert claimed(routed, "worker_a") == [cached]
+    answer(routed, "worker_a", cached, "Paris")
+    assert post_query(client, "submitter", "filler").status_code == 200
+
+    repeated = post_query(client, "other_submitter", "cached", completion_mode="first")
+    assert repeated.status_code == 200
+    assert repeated.json()["status"] == "cached"
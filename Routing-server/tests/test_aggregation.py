@@ -0,0 +1,65 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import answer, claimed, submit
+
+import Routing
+
+
+def test_near_duplicate_answers_are_merged_into_one_best_answer(server):
+    query_number, _ = submit(server, "submitter", "q")
+    for worker in ("worker_a", "worker_b", "worker_c"):
+        assert claimed(server, worker) == [query_number]
+    answer(server, "worker_a", query_number, "Lyon is the capital of France.")
+    answer(server, "worker_b", query_number, "The capital of France is Paris.")
+    answer(server, "worker_c", query_number, "the capital of France is Paris")
+
+    best = server.get_best_response(query_number, "submitter")
+    assert best["completed"]
+    assert best["answer"] == "The capital of France is Paris."
+    assert [answer["responses"] for answer in best["answers"]] == [2, 1]
+    assert best["agreement"] > 0.5
+
+
+def test_consensus_completes_early_on_similar_answers(server):
+    query_number, _ = submit(server, "submitter", "q", completion_mode="consensus")
+    for worker in ("worker_a", "worker_b", "worker_c"):
+        assert claimed(server, worker) == [query_number]
+
+    assert not answer(server, "worker_a", query_number, "The capital of France is Paris.")["query_completed"]
+    result = answer(server, "worker_b", query_number, "the capital of France is Paris")
+    assert result["query_completed"]
+    assert result["total_responses"] == 2
+
+    best = server.get_best_response(query_number, "submitter")
+    assert best["completed"]
+    assert best["answer"] == "The capital of France is Paris."
+
+    # The third worker is told to stop, and its answer is refused
+    assert server.pop_cancelled_assignments("worker_c") == [query_number]
+    with pytest.raises(HTTPException) as error:
+        answer(server, "worker_c", query_number, "I think it is Lyon")
+    assert error.value.status_code == 409
+
+
+def test_a_trusted_node_cannot_reach_consensus_alone(server):
+    # As if every earlier answer of worker_a had agreed with the best one
+    with server.state.nodes(["worker_a"]) as nodes:
+        nodes["worker_a"] = Routing.NodeInfo("worker_a", time.time(), time.time(), answer_quality=1.0)
+    query_number, _ = submit(server, "submitter", "q", completion_mode="consensus", required_responses=2)
+    for worker in ("worker_a", "worker_b", "worker_c"):
+        assert claimed(server, worker) == [query_number]
+
+    assert not answer(server, "worker_a", query_number, "Paris")["query_completed"]
+    assert server.pop_cancelled_assignments("worker_b") == []
+    assert answer(server, "worker_b", query_number, "paris")["query_completed"]
+    assert server.pop_cancelled_assignments("worker_c") == [query_number]
+
+
+def test_a_lone_answer_completes_consensus_once_every_worker_answered(server):
+    server.max_responses_per_query = 1
+    query_number, _ = submit(server, "submitter", "q", completion_mode="consensus", required_responses=1)
+    assert claimed(server, "worker_a") == [query_number]
+    assert answer(server, "worker_a", query_number, "Paris")["query_completed"]
@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import claimed, submit
+
+import Routing
+
+
+@pytest.fixture
+def client(routed):
+    return TestClient(Routing.app)
+
+
+def batch(client, node_id, **body):
+    return client.post("/batch", headers={"X-Node-ID": node_id}, json=body)
+
+
+def test_each_item_reports_its_own_outcome(routed, client):
+    assigned, _ = submit(routed, "submitter", "assigned")
+    assert claimed(routed, "worker_a") == [assigned]
+    not_assigned, _ = submit(routed, "submitter", "not assigned")
+
+    result = batch(client, "worker_a",
+                   chunks=[{"query_number": not_assigned, "chunk": "Pa"}],
+                   responses=[{"query_number": assigned, "response": "Paris"},
+                              {"query_number": 999, "response": "Paris"}])
+    assert result.status_code == 200
+    result = result.json()
+    assert [item["status_code"] for item in result["chunks"]] == [400]
+    assert [item["status_code"] for item in result["responses"]] == [200, 404]
+    assert result["responses"][1]["query_number"] == 999
+
+
+def test_claims_many_queries_in_one_round_trip(routed, client):
+    query_numbers = [submit(routed, "submitter", f"q{i}")[0] for i in range(3)]
+
+    assert [query["query_number"] for query in batch(client, "worker_a", claim=2).json()["queries"]] == query_numbers[:2]
+    assert [query["query_number"] for query in batch(client, "worker_a", claim=2).json()["queries"]] == query_numbers[2:]
+    assert batch(client, "worker_a").json()["queries"] == []
+
+
+def test_batch_returns_cancelled_assignments_once(routed, client):
+    query_number, _ = submit(routed, "submitter", "q")
+    assert claimed(routed, "worker_a") == [query_number]
+    assert routed.end_query(query_number, "submitter")
+
+    assert batch(client, "worker_a").json()["cancelled"] == [query_number]
+    assert batch(client, "worker_a").json()["cancelled"] == []
+
+
+def test_oversized_batch_is_rejected(routed, client):
+    routed.max_batch_items = 2
+    chunks = [{"query_number": 1, "chunk": "x"}] * 3
+    assert batch(client, "worker_a", chunks=chunks).status_code == 400
+    assert batch(client, "worker_a", claim=1).status_code == 200
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import answer, claimed, submit
+
+import Routing
+
+
+@pytest.fixture
+def client(routed):
+    return TestClient(Routing.app)
+
+
+def post_chunk(client, node_id, query_number, chunk, sequence=None):
+    return client.post("/response/chunk", headers={"X-Node-ID": node_id},
+                       json={"query_number": query_number, "chunk": chunk, "sequence": sequence})
+
+
+def in_progress(server):
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+    assert claimed(server, "worker_a") == [query_number]
+    return query_number
+
+
+def test_chunks_are_relayed_before_the_full_answer(routed, client):
+    query_number = in_progress(routed)
+    assert post_chunk(client, "worker_a", query_number, "Pa", 0).json()["buffered_chars"] == 2
+    assert post_chunk(client, "worker_a", query_number, "ris", 1).json()["buffered_chars"] == 5
+
+    # What the submitter's stream sends as one "chunk" event
+    assert routed.read_stream_updates(query_number, 0)["chunks"] == [(0, "Paris")]
+
+    answer(routed, "worker_a", query_number, "Paris")
+    body = client.get("/response/stream", params={"query_number": query_number},
+                      headers={"X-Node-ID": "submitter"}).text
+    response_event = body.split("\n\n")[0].splitlines()
+    assert response_event[0] == "event: response"
+    assert json.loads(response_event[-1].removeprefix("data: "))["stream"] == 0
+
+
+def test_retransmitted_chunks_are_dropped(routed, client):
+    query_number = in_progress(routed)
+    post_chunk(client, "worker_a", query_number, "Pa", 0)
+
+    retried = post_chunk(client, "worker_a", query_number, "Pa", 0).json()
+    assert retried["duplicate"]
+    assert retried["buffered_chars"] == 2
+
+
+def test_full_stream_buffer_answers_429_until_drained(routed, client):
+    routed.max_stream_buffer_chars = 4
+    query_number = in_progress(routed)
+    assert post_chunk(client, "worker_a", query_number, "abc").status_code == 200
+
+    refused = post_chunk(client, "worker_a", query_number, "de")
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "1"
+
+    assert routed.read_stream_updates(query_number, 0)["chunks"] == [(0, "abc")]
+    assert post_chunk(client, "worker_a", query_number, "de").status_code == 200
+
+
+def test_unassigned_worker_cannot_stream(routed, client):
+    query_number = in_progress(routed)
+    assert post_chunk(client, "worker_b", query_number, "abc").status_code == 400
@@ -0,0 +1,119 @@
+from conftest import answer, claimed, submit
+
+import Routing
+
+
+def dispatch_order(queue, node_id="worker"):
+    with queue.lock:
+        return [entry.query_number for entry in queue.eligible_for(node_id)]
+
+
+def park(queue, *query_numbers):
+    with queue.lock:
+        for query_number in query_numbers:
+            queue.park_locked(query_number)
+
+
+def test_requeued_queries_go_back_in_start_tag_order():
+    queue = Routing.DispatchQueue()
+    for query_number in range(1, 5):
+        queue.append(query_number, "submitter_a")
+    queue.append(5, "submitter_b")
+
+    park(queue, 1, 3)
+    assert dispatch_order(queue) == [5, 2, 4]
+    assert len(queue) == 5
+
+    assert queue.requeue(3)
+    assert queue.requeue(1)
+    assert not queue.requeue(1)
+    assert dispatch_order(queue) == [1, 5, 2, 3, 4]
+
+
+def test_discarding_parked_and_queued_entries():
+    queue = Routing.DispatchQueue()
+    for query_number in range(1, 4):
+        queue.append(query_number, "submitter")
+    park(queue, 2)
+
+    assert queue.discard(2)
+    assert queue.discard(3)
+    assert not queue.discard(3)
+    assert not queue.requeue(2)
+    assert 2 not in queue and 1 in queue
+    assert dispatch_order(queue) == [1]
+
+
+def test_membership_is_by_query_number():
+    queue = Routing.DispatchQueue()
+    queue.append(1, "submitter")
+    queue.append(2, "submitter")
+    queue.append(1, "submitter")  # Queued again, not twice
+
+    assert len(queue) == 2
+    assert 1 in queue and 3 not in queue
+    assert sorted(dispatch_order(queue)) == [1, 2]
+
+
+def test_submitter_and_excluded_nodes_are_never_offered():
+    queue = Routing.DispatchQueue()
+    queue.append(1, "submitter", excluded_nodes=["worker_a"])
+    queue.append(2, "submitter")
+
+    assert dispatch_order(queue, "submitter") == []
+    assert dispatch_order(queue, "worker_a") == [2]
+    with queue.lock:
+        entry = next(queue.eligible_for("worker_b"))
+        queue.exclude(entry, "worker_b")
+    assert dispatch_order(queue, "worker_b") == [2]
+
+
+def test_completed_queries_leave_the_queue(server):
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+    other, _ = submit(server, "submitter", "other")
+    assert server.state.pending_count() == 2
+
+    assert claimed(server, "worker_a") == [query_number, other]
+    answer(server, "worker_a", query_number)
+    assert server.state.pending_count() == 1
+    assert server.end_query(other, "submitter")
+    assert server.state.pending_count() == 0
+
+
+def test_light_submitter_overtakes_a_flood():
+    queue = Routing.DispatchQueue()
+    for query_number in range(1, 6):
+        queue.append(query_number, "heavy")
+    with queue.lock:
+        queue.charge(next(queue.eligible_for("worker")))
+        queue.discard_locked(1)
+
+    queue.append(6, "light")
+    assert dispatch_order(queue) == [6, 2, 3, 4, 5]
+
+
+def test_weight_sets_each_submitters_share():
+    queue = Routing.DispatchQueue()
+    for query_number in range(1, 5):
+        queue.append(query_number, "contributor", weight=2.0)
+    for query_number in range(5, 7):
+        queue.append(query_number, "freeloader")
+
+    assert dispatch_order(queue) == [1, 5, 2, 3, 6, 4]
+
+
+def test_priority_classes_are_strict():
+    queue = Routing.DispatchQueue()
+    queue.append(1, "submitter_a", priority=Routing.PRIORITY_CLASSES["low"])
+    queue.append(2, "submitter_b", priority=Routing.PRIORITY_CLASSES["normal"])
+    for query_number in range(3, 5):
+        queue.append(query_number, "submitter_a", priority=Routing.PRIORITY_CLASSES["high"])
+
+    assert dispatch_order(queue) == [3, 4, 2, 1]
+
+
+def test_server_dispatches_high_priority_first(server):
+    low, _ = submit(server, "submitter", "low", priority="low")
+    high, _ = submit(server, "submitter", "high", priority="high")
+
+    assert claimed(server, "worker_a") == [high, low]
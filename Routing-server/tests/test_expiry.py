@@ -0,0 +1,59 @@
+import threading
+import time
+
+import Routing
+
+
+def test_due_keys_come_out_in_deadline_order():
+    index = Routing.ExpiryIndex()
+    now = time.time()
+    index.schedule("later", now + 60)
+    index.schedule("second", now - 1)
+    index.schedule("first", now - 2)
+
+    assert index.wait_due(0) == ["first", "second"]
+    assert len(index) == 1 and "later" in index
+    assert index.wait_due(0) == []
+
+
+def test_postponed_and_cancelled_keys_do_not_fire():
+    index = Routing.ExpiryIndex()
+    now = time.time()
+    index.schedule("postponed", now - 1)
+    index.schedule("postponed", now + 60)
+    index.schedule("cancelled", now - 1)
+    index.cancel("cancelled")
+
+    assert index.wait_due(0) == []
+    assert "cancelled" not in index
+
+    # Brought forward again, it fires once
+    index.schedule("postponed", now - 1)
+    assert index.wait_due(0) == ["postponed"]
+    assert index.wait_due(0) == []
+
+
+def test_waiter_wakes_for_a_key_scheduled_while_it_waits():
+    index = Routing.ExpiryIndex()
+    index.schedule("far", time.time() + 60)
+    fired = []
+    waiter = threading.Thread(target=lambda: fired.extend(index.wait_due(5)))
+    waiter.start()
+
+    time.sleep(0.05)
+    started = time.time()
+    index.schedule("soon", started + 0.05)
+    waiter.join()
+    assert fired == ["soon"]
+    assert time.time() - started < 1
+
+
+def test_inactive_nodes_are_removed_without_a_sweep(server):
+    server.node_timeout = 0.1
+    server.touch_node("worker_a")
+    assert server.state.node_count() == 1
+
+    deadline = time.time() + 5
+    while server.state.node_count() and time.time() < deadline:
+        time.sleep(0.02)
+    assert server.state.node_count() == 0
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import answer, claimed, heartbeat, make_server, submit
+
+import Routing
+
+
+def test_straggler_is_hedged_and_cancelled_by_the_first_answer(server):
+    server.min_assignment_deadline = 0.2
+    server.hedge_deadline_factor = 0
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+    assert claimed(server, "worker_a") == [query_number]
+    assert claimed(server, "worker_b") == []
+
+    time.sleep(0.3)
+    assert claimed(server, "worker_b") == [query_number]
+    with server.state.query(query_number, writable=False) as query_info:
+        assert query_info.hedged_assignments == 1
+
+    assert answer(server, "worker_b", query_number)["query_completed"]
+    assert server.pop_cancelled_assignments("worker_a") == [query_number]
+    with pytest.raises(HTTPException) as error:
+        answer(server, "worker_a", query_number)
+    assert error.value.status_code == 409
+
+
+def test_saturated_query_is_parked_until_its_lease_expires(short_leases):
+    server = short_leases
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+    heartbeat(server, "worker_a", [query_number])  # A heartbeating node gets the short lease
+
+    assert claimed(server, "worker_a") == [query_number]
+    assert claimed(server, "worker_b") == []
+    assert server.state.pending_count() == 1  # Parked, but still queued work
+
+    # The expiry thread revokes the lease and offers the query again, without anyone polling worker_a
+    deadline = time.time() + 5
+    while not (handed_out := claimed(server, "worker_b")) and time.time() < deadline:
+        time.sleep(0.05)
+    assert handed_out == [query_number]
+
+
+def test_quorum_completes_on_matching_answers(server):
+    query_number, _ = submit(server, "submitter", "q", completion_mode="quorum")
+    assert claimed(server, "worker_a") == [query_number]
+    assert claimed(server, "worker_b") == [query_number]
+    assert claimed(server, "worker_c") == []
+
+    assert not answer(server, "worker_a", query_number, "Paris")["query_completed"]
+    assert answer(server, "worker_b", query_number, "  paris ")["query_completed"]
+    assert claimed(server, "worker_c") == []
+    assert server.state.pending_count() == 0
+
+
+def test_disagreeing_answer_requeues_a_parked_quorum_query(server):
+    query_number, _ = submit(server, "submitter", "q", completion_mode="quorum", required_responses=2)
+    assert claimed(server, "worker_a") == [query_number]
+    assert claimed(server, "worker_b") == [query_number]
+    assert claimed(server, "worker_c") == []
+
+    answer(server, "worker_a", query_number, "Paris")
+    assert not answer(server, "worker_b", query_number, "Lyon")["query_completed"]
+    assert claimed(server, "worker_c") == [query_number]
+    assert answer(server, "worker_c", query_number, "  paris ")["query_completed"]
+
+
+def test_saturated_query_is_parked_but_still_queued(tmp_path):
+    server = make_server(Routing.SQLiteState(str(tmp_path / "state.db")), tmp_path / "spill")
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+
+    assert claimed(server, "worker_a") == [query_number]
+    assert claimed(server, "worker_b") == []
+
+    # Parked outside the eligible set, yet still queue depth for admission control
+    assert server.state.pending_count() == 1
+    assert server.state.requeue(query_number)
+    assert not server.state.requeue(query_number)
@@ -0,0 +1,142 @@
+import os
+import time
+
+from conftest import answer, claimed, heartbeat, make_server, submit
+
+import Routing
+
+
+def crash_and_recover(state):
+    """Flush what the router acknowledged and open its journal again, without a final snapshot"""
+    state.journal.flush()
+    return Routing.JournaledState(state.directory)
+
+
+def segment_paths(state):
+    """The journal's segment files on disk, oldest first"""
+    return sorted(os.path.join(state.directory, name) for name in os.listdir(state.directory)
+                  if name.startswith("journal.") and name.endswith(".log"))
+
+
+def journaled_bytes(state):
+    """Size of everything journaled so far, once flushed"""
+    state.journal.flush()
+    return sum(os.path.getsize(path) for path in segment_paths(state))
+
+
+def test_replay_restores_queries_responses_and_assignments(tmp_path):
+    state = Routing.JournaledState(str(tmp_path / "journal"))
+    server = make_server(state, tmp_path / "spill")
+    answered, _ = submit(server, "submitter", "answered", completion_mode="first")
+    assert claimed(server, "worker_a") == [answered]
+    answer(server, "worker_a", answered, "Paris")
+    in_flight, _ = submit(server, "submitter", "in flight")
+    assert claimed(server, "worker_b") == [in_flight]
+
+    recovered = crash_and_recover(state)
+    with recovered.query(answered, writable=False) as query_info:
+        assert query_info.completed
+        assert [response.node_id for response in query_info.responses] == ["worker_a"]
+        assert query_info.assignments["worker_a"].state == "answered"
+    with recovered.query(in_flight, writable=False) as query_info:
+        assert not query_info.completed
+        assert query_info.assignments["worker_b"].state == "active"
+
+    # The unfinished query is queued again and worker_b's reservation is still held
+    assert recovered.pending_count() == 1
+    with recovered.nodes(writable=False) as nodes:
+        assert nodes["worker_b"].active_assignments == 1
+        assert nodes["worker_a"].active_assignments == 0
+
+
+def test_replay_ignores_a_torn_final_record(tmp_path):
+    state = Routing.JournaledState(str(tmp_path / "journal"))
+    server = make_server(state, tmp_path / "spill")
+    query_number, _ = submit(server, "submitter", "q")
+    state.journal.flush()
+    with open(segment_paths(state)[-1], "a", encoding="utf-8") as f:
+        f.write('{"op": "query", "rec')
+
+    recovered = crash_and_recover(state)
+    with recovered.query(query_number, writable=False) as query_info:
+        assert query_info.query == "q"
+    assert recovered.pending_count() == 1
+
+
+def test_replay_restores_the_query_counter_past_removed_queries(tmp_path):
+    state = Routing.JournaledState(str(tmp_path / "journal"))
+    server = make_server(state, tmp_path / "spill")
+    query_numbers = [submit(server, "submitter", f"q{i}")[0] for i in range(3)]
+    assert server.end_query(query_numbers[-1], "submitter")
+
+    recovered = crash_and_recover(state)
+    assert recovered.next_query_number() == query_numbers[-1] + 1
+
+    # A snapshot carries the counter on after its segments are deleted
+    server = make_server(recovered, tmp_path / "spill")
+    query_number, _ = submit(server, "submitter", "q")
+    assert server.end_query(query_number, "submitter")
+    again = crash_and_recover(recovered)
+    assert again.next_query_number() == query_number + 1
+
+
+def test_only_touched_queries_are_journaled(tmp_path):
+    state = Routing.JournaledState(str(tmp_path / "journal"))
+    server = make_server(state, tmp_path / "spill")
+    query_number, _ = submit(server, "submitter", "q")
+    journaled = journaled_bytes(state)
+
+    with state.query(query_number):
+        pass
+    with state.query(query_number, writable=False):
+        pass
+    assert journaled_bytes(state) == journaled
+
+    assert claimed(server, "worker_a") == [query_number]
+    assert journaled_bytes(state) > journaled
+
+
+def test_idle_polls_and_heartbeats_journal_nothing(tmp_path):
+    state = Routing.JournaledState(str(tmp_path / "journal"))
+    server = make_server(state, tmp_path / "spill")
+    assert claimed(server, "worker_a") == []
+    journaled = journaled_bytes(state)
+
+    for _ in range(3):
+        assert claimed(server, "worker_a") == []
+        heartbeat(server, "worker_a", [])
+    assert journaled_bytes(state) == journaled
+
+
+def test_nodes_are_recovered_as_seen_at_startup(tmp_path):
+    state = Routing.JournaledState(str(tmp_path / "journal"))
+    server = make_server(state, tmp_path / "spill")
+    server.touch_node("worker_a", capabilities={"max_concurrent": 3})
+    with state.nodes(["worker_a"]) as nodes:
+        nodes["worker_a"].last_seen = 0.0
+        nodes["worker_a"].responses_provided = 5
+
+    recovered = crash_and_recover(state)
+    with recovered.nodes(writable=False) as nodes:
+        assert nodes["worker_a"].capabilities == {"max_concurrent": 3}
+        assert nodes["worker_a"].responses_provided == 5
+        assert time.time() - nodes["worker_a"].last_seen < 5
+
+
+def test_lease_renewed_by_a_chunk_survives_replay(tmp_path):
+    state = Routing.JournaledState(str(tmp_path / "journal"))
+    server = make_server(state, tmp_path / "spill")
+    server.min_lease_time = 0.4
+    server.lease_service_time_factor = 0
+    query_number, _ = submit(server, "submitter", "q")
+    heartbeat(server, "worker_a", [query_number])  # Workers that heartbeat get short leases
+    assert claimed(server, "worker_a") == [query_number]
+
+    time.sleep(0.25)
+    server.submit_response_chunk("worker_a", Routing.ResponseChunkModel(query_number=query_number, chunk="Pa"))
+    with state.query(query_number, writable=False) as query_info:
+        lease_expires = query_info.assignments["worker_a"].lease_expires
+
+    recovered = crash_and_recover(state)
+    with recovered.query(query_number, writable=False) as query_info:
+        assert query_info.assignments["worker_a"].lease_expires == lease_expires
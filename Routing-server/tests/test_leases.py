@@ -0,0 +1,53 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import answer, claimed, heartbeat, node, submit
+
+
+def test_lapsed_lease_is_requeued_to_another_node(short_leases):
+    server = short_leases
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+    heartbeat(server, "worker_a", [query_number])  # A heartbeating node gets the short lease
+
+    assert claimed(server, "worker_a") == [query_number]
+    assert claimed(server, "worker_b") == []
+
+    time.sleep(0.3)
+    assert claimed(server, "worker_b") == [query_number]
+    assert node(server, "worker_a").active_assignments == 0
+    assert server.pop_cancelled_assignments("worker_a") == [query_number]
+
+    # The slot went to worker_b, so worker_a's late answer no longer counts
+    with pytest.raises(HTTPException) as error:
+        answer(server, "worker_a", query_number)
+    assert error.value.status_code == 409
+    assert heartbeat(server, "worker_a", [query_number])["lost"] == [query_number]
+
+    assert answer(server, "worker_b", query_number)["query_completed"]
+    assert node(server, "worker_b").active_assignments == 0
+
+
+def test_late_answer_counts_if_nobody_took_the_slot(short_leases):
+    server = short_leases
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+    heartbeat(server, "worker_a", [query_number])  # A heartbeating node gets the short lease
+
+    assert claimed(server, "worker_a") == [query_number]
+    # The expiry thread revokes the lease and gives the reservation back
+    deadline = time.time() + 5
+    while node(server, "worker_a").active_assignments and time.time() < deadline:
+        time.sleep(0.02)
+    assert node(server, "worker_a").active_assignments == 0
+
+    assert answer(server, "worker_a", query_number)["query_completed"]
+    assert node(server, "worker_a").active_assignments == 0
+    assert server.pop_cancelled_assignments("worker_a") == []
+
+
+def test_nodes_that_never_heartbeat_get_leases_as_long_as_the_query(short_leases):
+    server = short_leases
+    submit(server, "submitter", "q")
+    lease_expires = server.claim_queries("worker_a")[0]["metadata"]["lease_expires"]
+    assert lease_expires - time.time() > server.query_timeout - 1
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from starlette.requests import Request
+
+from conftest import claimed, submit
+
+import Routing
+
+
+def client_request():
+    """A request whose client disconnects once the returned event is set"""
+    gone = asyncio.Event()
+
+    async def receive():
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "method": "GET", "path": "/request", "headers": [], "query_string": b""}
+    return Request(scope, receive), gone
+
+
+def test_long_poll_wakes_up_when_a_query_is_submitted(routed):
+    async def scenario():
+        poll = asyncio.ensure_future(Routing._claim_with_wait("worker", 5))
+        await asyncio.sleep(0.1)
+        assert not poll.done()
+
+        submitted_at = time.time()
+        query_number, _ = submit(routed, "submitter", "q")
+        assert [query["query_number"] for query in await asyncio.wait_for(poll, 2)] == [query_number]
+        assert time.time() - submitted_at < 1
+
+    asyncio.run(scenario())
+
+
+def test_long_poll_returns_nothing_once_the_wait_runs_out(routed):
+    started = time.time()
+    assert asyncio.run(Routing._claim_with_wait("worker", 0.3)) == []
+    assert 0.3 <= time.time() - started < 2
+
+
+def test_disconnected_long_poll_takes_no_work(routed):
+    async def scenario():
+        request, gone = client_request()
+        poll = asyncio.ensure_future(Routing._claim_with_wait("dead_worker", 20, request=request))
+        await asyncio.sleep(0.1)
+
+        gone.set()
+        assert await asyncio.wait_for(poll, 1) == []
+
+    asyncio.run(scenario())
+    query_number, _ = submit(routed, "submitter", "q")
+    assert claimed(routed, "live_worker") == [query_number]
+
+
+def test_no_work_is_claimed_for_a_client_already_gone(routed):
+    query_number, _ = submit(routed, "submitter", "q")
+
+    async def scenario():
+        request, gone = client_request()
+        gone.set()
+        return await Routing._claim_with_wait("dead_worker", 20, request=request)
+
+    assert asyncio.run(scenario()) == []
+    assert claimed(routed, "live_worker") == [query_number]
@@ -0,0 +1,59 @@
+import threading
+
+import Routing
+
+
+def rendered(metric):
+    """Sample lines of a metric by their name and labels"""
+    return dict(line.rsplit(" ", 1) for line in metric.render())
+
+
+def test_concurrent_observations_are_all_counted():
+    histogram = Routing.HistogramMetric("test_seconds", "Test histogram", buckets=(0.1, 1))
+    series = [histogram.labels(lock="a"), histogram.labels(lock="b")]
+
+    def observe():
+        for i in range(2000):
+            series[i % 2].observe(0.05 if i % 4 < 2 else 0.5)
+
+    threads = [threading.Thread(target=observe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    samples = rendered(histogram)
+    for label in ("a", "b"):
+        assert samples[f'test_seconds_count{{lock="{label}"}}'] == "8000"
+        assert samples[f'test_seconds_bucket{{lock="{label}",le="0.1"}}'] == "4000"
+        assert samples[f'test_seconds_bucket{{lock="{label}",le="+Inf"}}'] == "8000"
+
+
+def test_counter_series_are_rendered_per_label():
+    counter = Routing.CounterMetric("test_total", "Test counter")
+    counter.inc(kind="regular")
+    counter.inc(2, kind="hedged")
+    assert rendered(counter) == {'test_total{kind="regular"}': "1.0", 'test_total{kind="hedged"}': "2.0"}
+
+
+def test_locks_of_one_kind_record_into_one_series_from_every_thread():
+    locks = [Routing.InstrumentedLock("test_kind") for _ in range(4)]
+
+    def use(lock):
+        for _ in range(500):
+            with lock:
+                pass
+
+    threads = [threading.Thread(target=use, args=(lock,)) for lock in locks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert rendered(Routing.LOCK_HOLD_SECONDS)['routing_lock_hold_seconds_count{lock="test_kind"}'] == "2000"
+    assert rendered(Routing.LOCK_WAIT_SECONDS)['routing_lock_wait_seconds_count{lock="test_kind"}'] == "2000"
+
+
+def test_histograms_only_observe():
+    histogram = Routing.HistogramMetric("test_only_seconds", "Test histogram")
+    assert not hasattr(histogram, "inc")
@@ -0,0 +1,62 @@
+import pytest
+from fastapi import HTTPException
+
+from conftest import answer, claimed, submit
+
+
+def test_completed_answers_are_served_from_the_cache(server):
+    first, _ = submit(server, "submitter_a", "What is the capital of France?", cache=True)
+    assert claimed(server, "worker_a") == [first]
+    assert claimed(server, "worker_b") == [first]
+    assert claimed(server, "worker_c") == [first]
+    for worker in ("worker_a", "worker_b", "worker_c"):
+        answer(server, worker, first, "Paris")
+
+    second, status = submit(server, "submitter_b", "what is the capital of france", cache=True)
+    assert status == "cached"
+    assert server.get_responses(second, "submitter_b") == ["Paris"] * 3
+
+    # cache=False always asks the workers again
+    third, status = submit(server, "submitter_b", "what is the capital of france", cache=False)
+    assert status == "submitted"
+    assert claimed(server, "worker_a") == [third]
+
+
+def test_coalesced_query_is_removed_by_the_last_end(server):
+    first, status = submit(server, "submitter_a", "What is the capital of France?", cache=True)
+    assert status == "submitted"
+    second, status = submit(server, "submitter_b", "what is the capital of france", cache=True)
+    assert (second, status) == (first, "coalesced")
+
+    assert server.end_query(first, "submitter_a")
+    with server.state.query(first, writable=False) as query_info:
+        assert query_info.submitter_node_id == "submitter_b"
+        assert query_info.followers == []
+
+    with pytest.raises(HTTPException):
+        server.end_query(first, "submitter_a")
+    assert server.end_query(first, "submitter_b")
+    with server.state.query(first, writable=False) as query_info:
+        assert query_info is None
+
+
+def test_coalescing_respects_every_requirement(server):
+    first, _ = submit(server, "submitter_a", "q", cache=True, requirements={"hardware_class": "desktop"})
+    second, status = submit(server, "submitter_b", "q", cache=True)
+    assert status == "submitted"
+    assert second != first
+
+
+def test_assigned_worker_asking_the_same_question_is_not_coalesced(server):
+    query_number, _ = submit(server, "submitter", "q", cache=True)
+    assert claimed(server, "worker_a") == [query_number]
+
+    own_query, status = submit(server, "worker_a", "q", cache=True)
+    assert status == "submitted"
+    assert own_query != query_number
+
+    # worker_a still answers the query it was assigned, and gets its own answered by others
+    answer(server, "worker_a", query_number)
+    assert claimed(server, "worker_b") == [query_number, own_query]
+    answer(server, "worker_b", own_query)
+    assert server.get_responses(own_query, "worker_a") == ["answer"]
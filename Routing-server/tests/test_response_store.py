@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import answer, claimed, submit
+
+import Routing
+
+LONG_ANSWER = " ".join(f"Step {i}: the answer is {i * i}." for i in range(400))
+
+
+@pytest.fixture
+def client(routed):
+    return TestClient(Routing.app)
+
+
+def spilled_files(server):
+    return [name for name in os.listdir(server.response_store.directory) if name.endswith(".z")]
+
+
+def test_answers_are_kept_by_size(tmp_path):
+    store = Routing.ResponseStore(str(tmp_path), compress_threshold=10, spill_threshold=1000)
+
+    assert store.pack("Paris") == "Paris"
+    assert isinstance(store.pack("The capital of France is Paris. " * 10), bytes)
+    spilled = store.pack(LONG_ANSWER)
+    assert isinstance(spilled, Routing.SpilledBody)
+    assert os.path.exists(spilled.path)
+
+    # Compressing would not save enough
+    assert store.pack("Paris, France!") == "Paris, France!"
+
+
+def test_spilled_answers_are_served_and_deleted_with_their_query(server):
+    server.response_store.spill_threshold = 100
+    query_number, _ = submit(server, "submitter", "q", completion_mode="first")
+    assert claimed(server, "worker_a") == [query_number]
+    answer(server, "worker_a", query_number, LONG_ANSWER)
+
+    assert len(spilled_files(server)) == 1
+    assert server.get_responses(query_number, "submitter") == [LONG_ANSWER]
+
+    assert server.end_query(query_number, "submitter")
+    assert spilled_files(server) == []
+
+
+def test_unchanged_responses_answer_304(routed, client):
+    query_number, _ = submit(routed, "submitter", "q", required_responses=2)
+    for worker in ("worker_a", "worker_b"):
+        assert claimed(routed, worker) == [query_number]
+    answer(routed, "worker_a", query_number, "Paris")
+
+    params = {"query_number": query_number}
+    first = client.get("/response", params=params, headers={"X-Node-ID": "submitter"})
+    assert first.json() == ["Paris"]
+    etag = first.headers["ETag"]
+
+    unchanged = client.get("/response", params=params, headers={"X-Node-ID": "submitter", "If-None-Match": etag})
+    assert unchanged.status_code == 304
+
+    answer(routed, "worker_b", query_number, "Paris")
+    changed = client.get("/response", params=params, headers={"X-Node-ID": "submitter", "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json() == ["Paris", "Paris"]
+    assert changed.headers["ETag"] != etag
+
+
+def test_bodies_are_compressed_both_ways(routed, client):
+    query_number, _ = submit(routed, "submitter", "q", completion_mode="first")
+    assert claimed(routed, "worker_a") == [query_number]
+
+    body = gzip.compress(json.dumps({"query_number": query_number, "response": LONG_ANSWER}).encode())
+    uploaded = client.post("/response", content=body,
+                           headers={"X-Node-ID": "worker_a", "Content-Type": "application/json",
+                                    "Content-Encoding": "gzip"})
+    assert uploaded.status_code == 200
+
+    downloaded = client.get("/response", params={"query_number": query_number},
+                            headers={"X-Node-ID": "submitter", "Accept-Encoding": "gzip"})
+    assert downloaded.headers["Content-Encoding"] == "gzip"
+    assert downloaded.json() == [LONG_ANSWER]
+
+
+def test_unknown_content_encoding_is_refused(routed, client):
+    refused = client.post("/response", content=b"{}",
+                          headers={"X-Node-ID": "worker_a", "Content-Type": "application/json",
+                                   "Content-Encoding": "br"})
+    assert refused.status_code == 415
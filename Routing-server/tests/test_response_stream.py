@@ -0,0 +1,64 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import answer, claimed, submit
+
+import Routing
+
+
+@pytest.fixture
+def client(routed):
+    return TestClient(Routing.app)
+
+
+def events(body):
+    """(event, id, data) of each message in an SSE body, skipping comments"""
+    parsed = []
+    for message in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines() if not line.startswith(":"))
+        if fields:
+            parsed.append((fields["event"], fields.get("id"), json.loads(fields["data"])))
+    return parsed
+
+
+def answered_query(server, answers):
+    """A query completed by one answer from each of `answers`"""
+    query_number, _ = submit(server, "submitter", "q", required_responses=len(answers))
+    for i, text in enumerate(answers):
+        assert claimed(server, f"worker_{i}") == [query_number]
+        answer(server, f"worker_{i}", query_number, text)
+    return query_number
+
+
+def test_responses_carry_their_index_as_event_id(routed, client):
+    query_number = answered_query(routed, ["Paris", "Lyon"])
+
+    response = client.get("/response/stream", params={"query_number": query_number},
+                          headers={"X-Node-ID": "submitter"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    received = events(response.text)
+    assert [(event, event_id) for event, event_id, _ in received] == [
+        ("response", "0"), ("response", "1"), ("complete", None)
+    ]
+    assert [data["response"] for _, _, data in received[:2]] == ["Paris", "Lyon"]
+    assert received[-1][2]["total_responses"] == 2
+
+
+def test_reconnecting_client_resumes_after_last_event_id(routed, client):
+    query_number = answered_query(routed, ["Paris", "Lyon"])
+
+    response = client.get("/response/stream", params={"query_number": query_number},
+                          headers={"X-Node-ID": "submitter", "Last-Event-ID": "0"})
+    received = events(response.text)
+    assert [(event, event_id) for event, event_id, _ in received] == [("response", "1"), ("complete", None)]
+    assert received[0][2]["response"] == "Lyon"
+
+
+def test_last_event_id_below_minus_one_is_rejected(routed, client):
+    query_number = answered_query(routed, ["Paris"])
+
+    response = client.get("/response/stream", params={"query_number": query_number},
+                          headers={"X-Node-ID": "submitter", "Last-Event-ID": "-5"})
+    assert response.status_code == 400
@@ -0,0 +1,34 @@
+import pytest
+
+import Routing
+
+
+def ranked(server, policy, *nodes):
+    return sorted(((policy.cost(server, node_info), node_info) for node_info in nodes), key=lambda r: r[0])
+
+
+def worker(node_id, active_assignments=0):
+    return Routing.NodeInfo(node_id=node_id, registration_time=0.0, last_seen=0.0,
+                            active_assignments=active_assignments)
+
+
+@pytest.mark.parametrize("policy_class", [Routing.FastestCompletionPolicy, Routing.PowerOfTwoChoicesPolicy])
+def test_node_defers_only_when_every_open_slot_has_a_cheaper_rival(server, policy_class):
+    policy = policy_class()
+    busy, idle = worker("busy", active_assignments=2), worker("idle")
+    ranking = ranked(server, policy, busy, idle)
+
+    for _ in range(20):
+        assert not policy.allows(server, busy, ranking, lambda rival: True, slots=1)
+        assert policy.allows(server, busy, ranking, lambda rival: True, slots=2)
+        assert policy.allows(server, idle, ranking, lambda rival: True, slots=1)
+
+
+@pytest.mark.parametrize("policy_class", [Routing.FastestCompletionPolicy, Routing.PowerOfTwoChoicesPolicy])
+def test_only_eligible_rivals_count(server, policy_class):
+    policy = policy_class()
+    busy, idle = worker("busy", active_assignments=2), worker("idle")
+    ranking = ranked(server, policy, busy, idle)
+
+    for _ in range(20):
+        assert policy.allows(server, busy, ranking, lambda rival: rival.node_id != "idle", slots=1)
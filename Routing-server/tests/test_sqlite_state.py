@@ -0,0 +1,60 @@
+import multiprocessing
+from collections import Counter
+
+from conftest import answer, claimed, make_server, submit
+
+import Routing
+
+
+def claim_and_answer(path, spill_directory, node_ids, start, results):
+    """Worker process: poll with every node until nothing is left, answering each claim"""
+    server = make_server(Routing.SQLiteState(path), spill_directory)
+    claims = []
+    start.wait()
+    idle_rounds = 0
+    while idle_rounds < 3:
+        claimed_any = False
+        for node_id in node_ids:
+            for query_number in claimed(server, node_id):
+                claims.append((query_number, node_id))
+                answer(server, node_id, query_number)
+                claimed_any = True
+        idle_rounds = 0 if claimed_any else idle_rounds + 1
+    results.put(claims)
+
+
+def test_claims_are_at_most_once_across_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    server = make_server(Routing.SQLiteState(path), tmp_path / "spill")
+    query_numbers = [submit(server, f"submitter_{i % 3}", f"q{i}")[0] for i in range(60)]
+
+    # Start polling together so the processes really race for the same slots
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(3)
+    results = context.Queue()
+    processes = [
+        context.Process(target=claim_and_answer, args=(path, str(tmp_path / "spill"),
+                                                       [f"process_{p}_worker_{w}" for w in range(4)], start, results))
+        for p in range(3)
+    ]
+    for process in processes:
+        process.start()
+    process_claims = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join()
+    claims = [claim for claims in process_claims for claim in claims]
+
+    # No node is handed a query twice, and no query gets more workers than it has slots
+    assert len(claims) == len(set(claims))
+    per_query = Counter(query_number for query_number, _ in claims)
+    assert set(per_query) == set(query_numbers)
+    assert max(per_query.values()) == server.max_responses_per_query
+
+    for query_number in query_numbers:
+        with server.state.query(query_number, writable=False) as query_info:
+            assert query_info.completed
+            assert len(query_info.responses) == server.max_responses_per_query
+    assert server.state.pending_count() == 0
+    with server.state.nodes() as nodes:
+        assert all(node_info.active_assignments == 0 for node_info in nodes.values())
+
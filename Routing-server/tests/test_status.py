@@ -0,0 +1,72 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import submit
+
+import Routing
+
+
+@pytest.fixture
+def client(routed):
+    routed.status_view.max_age = 0  # Rebuild the snapshot on every request
+    return TestClient(Routing.app)
+
+
+def test_status_reports_aggregates_instead_of_listings(routed, client):
+    routed.touch_node("worker_a", capabilities={"hardware_class": "gpu"})
+    submit(routed, "submitter", "q")
+
+    status = client.get("/status").json()
+    assert "nodes_info" not in status and "queries_summary" not in status
+    assert status["nodes_stats"]["registered"] == 2
+    assert status["nodes_stats"]["by_hardware_class"] == {"gpu": 1, "unknown": 1}
+    assert status["queries_stats"]["total"] == 1
+    assert status["queries_stats"]["unfinished_by_priority"] == {"normal": 1}
+
+
+def test_listings_are_paged_by_cursor(routed, client):
+    for i in range(5):
+        routed.touch_node(f"worker_{i}")
+
+    node_ids = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        page = client.get("/status/nodes", params=params).json()
+        node_ids += [node["node_id"] for node in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert node_ids == [f"worker_{i}" for i in range(5)]
+
+    assert client.get("/status/nodes", params={"limit": 0}).status_code == 400
+
+
+def test_since_version_lists_only_changes_and_removals(routed, client):
+    routed.touch_node("worker_a")
+    routed.touch_node("worker_b")
+    kept, _ = submit(routed, "submitter", "kept")
+    ended, _ = submit(routed, "submitter", "ended")
+    version = client.get("/status").json()["status_version"]
+
+    routed.touch_node("worker_b", capabilities={"model": "llama"})
+    assert routed.end_query(ended, "submitter")
+
+    nodes = client.get("/status/nodes", params={"since_version": version}).json()
+    assert [node["node_id"] for node in nodes["items"]] == ["worker_b"]
+    assert not nodes["resync"]
+
+    queries = client.get("/status/queries", params={"since_version": version}).json()
+    assert queries["items"] == []
+    assert queries["removed"] == [ended]
+    assert kept not in queries["removed"]
+
+
+def test_clients_too_far_behind_must_resync(routed, client):
+    routed.status_view.tombstone_versions = 2
+    routed.touch_node("worker_a")
+    version = client.get("/status").json()["status_version"]
+    for _ in range(3):
+        client.get("/status")
+
+    assert client.get("/status/nodes", params={"since_version": version}).json()["resync"]